@@ -3,6 +3,7 @@ from docido_sdk.core import Interface
 
 __all__ = [
     'ICrawler',
+    'ICrawlMetrics',
 ]
 
 
@@ -59,6 +60,9 @@ class ICrawler(Interface):
           `prev_result` parameter of a sub-task will be given what the
           previous sub-task of the same list returns. `None` is given to the
           first task of every sequence.
+          Tasks of a flat list may be given an estimate of the work they
+          require with :py:func:`docido_sdk.crawler.tasks.set_task_cost`,
+          so that the framework balances the load among sequences.
 
         - 'epilogue' (optional): a :py:func:`functools.partial` instance
           to execute when all sub-tasks have been executed. The partial
@@ -82,3 +86,53 @@ class ICrawler(Interface):
         Therefore you may provide functions defined outside
         your crawler class definition.
         """
+
+
+class ICrawlMetrics(Interface):
+    """Extension point interface for components willing to be notified
+    while crawl tasks are executed.
+
+    Every member function but `crawl_ended` is given an `event`,
+    a :py:class:`docido_sdk.toolbox.collections_ext.nameddict` instance
+    providing the following keys:
+
+    - `service` (string): crawler service name
+    - `sequence` (int): index of the sequence of tasks
+    - `position` (int): index of the task in its sequence
+    - `task` (string): task name
+    - `attempt` (int): attempt number, starting at 1
+    - `epilogue` (bool): whether the task is the crawl epilogue
+
+    Events emitted when a task attempt is over also provide:
+
+    - `elapsed` (float): duration of the attempt in seconds
+    - `cards` (int): number of cards pushed by the task
+    - `error`: the exception raised by the task, `None` if it succeeded
+    - `delay` (float): number of seconds to wait for before the next
+      attempt, only given to `task_retried`.
+    """
+    def task_started(self, event):
+        """Called before every task attempt"""
+
+    def task_ended(self, event):
+        """Called when a task returned or raised an exception other than
+        :py:class:`docido_sdk.crawler.Retry`"""
+
+    def task_retried(self, event):
+        """Called when a task raised :py:class:`docido_sdk.crawler.Retry`
+        """
+
+    def epilogue_started(self, event):
+        """Called before every attempt of the crawl epilogue"""
+
+    def epilogue_ended(self, event):
+        """Called when the crawl epilogue is over. Retries of the epilogue
+        are notified thru `task_retried`."""
+
+    def crawl_ended(self, summary):
+        """Called when all tasks of a crawl are over
+
+        :param nameddict summary:
+          statistics about the crawl, as returned by
+          :py:meth:`docido_sdk.crawler.metrics.TasksStatistics.summary`
+        """
@@ -0,0 +1,142 @@
+import logging
+import threading
+import time
+
+from .errors import Retry
+
+LOGGER = logging.getLogger(__name__)
+
+
+class AdaptiveConcurrency(object):
+    """Limit number of tasks executed concurrently, following an
+    Additive-Increase/Multiplicative-Decrease policy:
+
+    - the limit is increased by `increase` every time `limit` tasks in a row
+      succeeded, as long as they were executed in less than `max_latency`
+      seconds, and the ratio of tasks that raised an unexpected exception
+      stays under `max_error_rate`.
+    - the limit is multiplied by `decrease` every time a task raises
+      :py:class:`docido_sdk.crawler.Retry`, which is also what
+      :py:func:`docido_sdk.toolbox.rate_limits.teb_retry` raises when
+      a source API answers with HTTP 429 status code. Tasks started before
+      a decrease cannot trigger another one, so that a burst of rejected
+      tasks only divides the limit once.
+    """
+    def __init__(self, maximum, minimum=1, initial=None, increase=1,
+                 decrease=0.5, max_latency=None, max_error_rate=0.1,
+                 logger=None):
+        """
+        :param int maximum:
+          maximum number of tasks executed concurrently
+        :param int minimum:
+          minimum number of tasks executed concurrently
+        :param initial:
+          initial limit, default is `minimum`
+        :param increase:
+          value added to the limit when tasks are healthy
+        :param float decrease:
+          factor applied to the limit when a task is asked to be retried
+        :param max_latency:
+          optional duration in seconds above which a task is considered
+          unhealthy.
+        :param float max_error_rate:
+          maximum ratio of tasks raising an unexpected exception.
+        """
+        assert 0 < decrease < 1
+        self.maximum = max(1, maximum)
+        self.minimum = max(1, min(minimum, self.maximum))
+        self.limit = float(initial or self.minimum)
+        self.limit = min(max(self.limit, self.minimum), self.maximum)
+        self.increase = increase
+        self.decrease = decrease
+        self.max_latency = max_latency
+        self.max_error_rate = max_error_rate
+        self.logger = logger or LOGGER
+        self._in_flight = 0
+        self._epoch = 0
+        self._completed = 0
+        self._errors = 0
+        self._healthy = True
+        self._cond = threading.Condition()
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    def acquire(self):
+        """Wait until a new task can be executed
+
+        :return: opaque value to give to :py:meth:`release`
+        """
+        with self._cond:
+            while self._in_flight >= int(self.limit):
+                self._cond.wait()
+            self._in_flight += 1
+            return self._epoch
+
+    def release(self, epoch, latency=None, retry=False, error=False):
+        """Notify that a task is over
+
+        :param epoch: value returned by :py:meth:`acquire`
+        :param float latency: task duration in seconds
+        :param bool retry: whether the task raised `Retry`
+        :param bool error: whether the task raised an unexpected exception
+        """
+        with self._cond:
+            self._in_flight -= 1
+            if retry:
+                if epoch == self._epoch:
+                    self._epoch += 1
+                    self._set_limit(self.limit * self.decrease)
+            else:
+                self._completed += 1
+                if error:
+                    self._errors += 1
+                if self.max_latency is not None and latency is not None \
+                        and latency > self.max_latency:
+                    self._healthy = False
+                if self._completed >= int(self.limit):
+                    error_rate = float(self._errors) / self._completed
+                    if self._healthy and error_rate <= self.max_error_rate:
+                        self._set_limit(self.limit + self.increase)
+                    else:
+                        self._reset_round()
+            self._cond.notify_all()
+
+    def _set_limit(self, limit):
+        previous = int(self.limit)
+        self.limit = min(max(limit, self.minimum), self.maximum)
+        self._reset_round()
+        if int(self.limit) != previous:
+            self.logger.info(
+                'tasks concurrency changed from {} to {}'.format(
+                    previous, int(self.limit)
+                )
+            )
+
+    def _reset_round(self):
+        self._completed = 0
+        self._errors = 0
+        self._healthy = True
+
+    def wrap(self, call_task):
+        """Decorate a callable object executing a task so that
+        it is executed under control of this object.
+        """
+        def _call_task(*args, **kwargs):
+            epoch = self.acquire()
+            start = time.time()
+            try:
+                result = call_task(*args, **kwargs)
+            except Retry:
+                self.release(epoch, retry=True)
+                raise
+            except Exception:
+                self.release(epoch, time.time() - start, error=True)
+                raise
+            except BaseException:
+                self.release(epoch)
+                raise
+            self.release(epoch, time.time() - start)
+            return result
+        return _call_task
@@ -0,0 +1,160 @@
+import base64
+import hashlib
+import logging
+import pickle
+
+from docido_sdk.toolbox.storage_ext import (
+    JSONLinesFile,
+    PrefixedKV,
+)
+
+LOGGER = logging.getLogger(__name__)
+
+
+class KVJournalStorage(PrefixedKV):
+    """Persist a :py:class:`CrawlJournal` in the key-value store
+    of an :py:class:`docido_sdk.index.IndexAPI`.
+    """
+    def __init__(self, index_api, prefix='crawl-journal'):
+        super(KVJournalStorage, self).__init__(index_api, prefix)
+
+
+class FileJournalStorage(object):
+    """Persist a :py:class:`CrawlJournal` in a local file, where every
+    update is appended as a JSON line.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._file = JSONLinesFile(path, fsync=True)
+
+    def load(self):
+        return dict(self._file)
+
+    def set(self, key, value):
+        self._file.append([[key, value]])
+
+    def clear(self):
+        self._file.remove()
+
+
+class CrawlJournal(object):
+    """Record tasks completed by a
+    :py:class:`docido_sdk.crawler.run.TasksRunner` along with their results,
+    so that a crawl interrupted halfway can be resumed where it stopped.
+
+    For every sequence of tasks, the journal keeps the number of tasks
+    completed and the result of the last one. Results must be picklable,
+    otherwise they are not recorded and the task will be executed again
+    when the crawl is resumed.
+
+    A crawl is identified by a digest of its pickled tasks and
+    configuration, so the journal of a different crawl is discarded.
+    """
+    TASKS_KEY = 'tasks'
+    SEQUENCE_KEY = 'seq:{}'
+
+    def __init__(self, storage, logger=None):
+        self.storage = storage
+        self.logger = logger or LOGGER
+
+    @classmethod
+    def from_config(cls, config, index_api, logger=None):
+        """Build a journal from the `journal` key of a crawl configuration
+
+        :param config:
+          either `True` or a `dict` providing the following optional keys:
+
+          - `storage`: either `kv` (default) to use the key-value store
+            of the `index_api`, or `file`.
+          - `key`: prefix of the keys written in the key-value store.
+          - `path`: path to the journal file, mandatory with
+            the `file` storage.
+
+        :param index_api: crawl :py:class:`docido_sdk.index.IndexAPI`
+        """
+        config = config if isinstance(config, dict) else {}
+        storage = config.get('storage', 'kv')
+        if storage == 'kv':
+            storage = KVJournalStorage(
+                index_api, config.get('key', 'crawl-journal')
+            )
+        elif storage == 'file':
+            if 'path' not in config:
+                raise Exception("'file' journal storage requires a 'path'")
+            storage = FileJournalStorage(config['path'])
+        else:
+            raise Exception("Unknown journal storage: '{}'".format(storage))
+        return cls(storage, logger)
+
+    @classmethod
+    def digest(cls, tasks, crawl_config=None):
+        """Identify a crawl by its tasks and configuration
+
+        :return: digest of the pickled tasks and configuration, `None`
+          if they cannot be pickled.
+        """
+        try:
+            data = pickle.dumps([tasks, dict(crawl_config or {})], 2)
+        except Exception:
+            return None
+        return hashlib.sha1(data).hexdigest()
+
+    def load(self, tasks, crawl_config=None):
+        """Retrieve the progression of a previous crawl
+
+        :param list tasks:
+          list of list of tasks of the crawl to resume. If they do not
+          match the ones of the journal, then the journal is discarded.
+        :param dict crawl_config:
+          configuration of the crawl to resume. If it does not match the
+          one of the journal, then the journal is discarded.
+
+        :return:
+          `dict` giving for every sequence index a tuple
+          `(completed_tasks, last_result)`
+        :rtype: dict
+        """
+        entries = self.storage.load()
+        digest = self.digest(tasks, crawl_config)
+        if digest is None:
+            self.logger.warn('crawl tasks cannot be pickled, '
+                             'crawl will not be resumed')
+        if digest is None or entries.get(self.TASKS_KEY) != digest:
+            if entries:
+                self.logger.warn('discarding journal of a different crawl')
+                self.storage.clear()
+            self.storage.set(self.TASKS_KEY, digest or '')
+            return dict()
+        progression = dict()
+        for index in range(len(tasks)):
+            value = entries.get(self.SEQUENCE_KEY.format(index))
+            if value is not None:
+                progression[index] = pickle.loads(base64.b64decode(value))
+        if progression:
+            self.logger.info('resuming {} sequences of tasks'.format(
+                len(progression)
+            ))
+        return progression
+
+    def record(self, index, completed, result):
+        """Record progression of a sequence of tasks
+
+        :param int index: sequence index
+        :param int completed: number of tasks completed
+        :param result: result returned by the last completed task
+        """
+        try:
+            value = pickle.dumps((completed, result), 2)
+        except Exception as e:
+            self.logger.warn(
+                'could not record result of task {} of sequence {}: {}'.format(
+                    completed - 1, index, e
+                )
+            )
+            return
+        self.storage.set(self.SEQUENCE_KEY.format(index),
+                         base64.b64encode(value))
+
+    def clear(self):
+        """Remove the journal, once a crawl is over"""
+        self.storage.clear()
@@ -0,0 +1,147 @@
+import functools
+import logging
+import math
+import random
+import threading
+import time
+
+from ..toolbox.collections_ext import nameddict
+
+LOGGER = logging.getLogger(__name__)
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of a list of numbers
+
+    :param list values: sorted numbers
+    :param percent: number between 0 and 100
+
+    :return: the percentile, or `None` if `values` is empty
+    """
+    if not values:
+        return None
+    rank = int(math.ceil(percent / 100.0 * len(values))) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+
+class CardsCounter(object):
+    """Count the cards successfully pushed thru an index, by thread.
+
+    The `push_cards` member method of the index is instrumented in place,
+    so that tasks keep using the index pipeline itself, along with
+    the methods specific to its processors.
+    """
+    def __init__(self, index_api):
+        self._local = threading.local()
+        push_cards = index_api.push_cards
+
+        @functools.wraps(push_cards)
+        def _push_cards(cards):
+            if not isinstance(cards, list):
+                cards = list(cards)
+            errors = push_cards(cards)
+            self._local.cards = self.cards + max(
+                len(cards) - len(errors or []), 0
+            )
+            return errors
+        index_api.push_cards = _push_cards
+
+    @property
+    def cards(self):
+        """number of cards pushed by the current thread since
+        the last :py:meth:`reset`"""
+        return getattr(self._local, 'cards', 0)
+
+    def reset(self):
+        self._local.cards = 0
+
+
+class TasksStatistics(object):
+    """Collect statistics about the tasks executed during a crawl.
+
+    It implements the :py:class:`docido_sdk.crawler.ICrawlMetrics`
+    interface, and keeps a uniform sample of at most `max_samples`
+    task durations to compute latency percentiles.
+    """
+    def __init__(self, max_samples=10000):
+        self.max_samples = max_samples
+        self.started = time.time()
+        self.tasks = 0
+        self.errors = 0
+        self.retries = 0
+        self.retry_wait = 0.0
+        self.cards = 0
+        self._durations = []
+        self._lock = threading.Lock()
+
+    def task_started(self, event):
+        pass
+
+    def task_ended(self, event):
+        with self._lock:
+            self.tasks += 1
+            if event.error is not None:
+                self.errors += 1
+            self.cards += event.cards
+            self._add_duration(event.elapsed)
+
+    def task_retried(self, event):
+        with self._lock:
+            self.retries += 1
+            self.retry_wait += event.delay or 0
+            self._add_duration(event.elapsed)
+
+    epilogue_started = task_started
+    epilogue_ended = task_ended
+
+    def crawl_ended(self, summary):
+        pass
+
+    def _add_duration(self, duration):
+        samples = self.tasks + self.retries
+        if len(self._durations) < self.max_samples:
+            self._durations.append(duration)
+        else:
+            # reservoir sampling
+            index = random.randint(0, samples - 1)
+            if index < self.max_samples:
+                self._durations[index] = duration
+
+    def summary(self):
+        """
+        :return: statistics about the tasks executed so far, providing the
+          following keys: `tasks`, `errors`, `retries`,
+          `retry_wait` (seconds), `cards`, `elapsed` (seconds),
+          `cards_per_sec`, `latency_p50` and `latency_p95` (seconds).
+        :rtype: nameddict
+        """
+        with self._lock:
+            durations = sorted(self._durations)
+            elapsed = time.time() - self.started
+            return nameddict(
+                tasks=self.tasks,
+                errors=self.errors,
+                retries=self.retries,
+                retry_wait=self.retry_wait,
+                cards=self.cards,
+                elapsed=elapsed,
+                cards_per_sec=self.cards / elapsed if elapsed else 0.0,
+                latency_p50=percentile(durations, 50),
+                latency_p95=percentile(durations, 95),
+            )
+
+    @classmethod
+    def format(cls, summary):
+        def _sec(value):
+            return 'n/a' if value is None else '{:.3f}s'.format(value)
+        return (
+            '{s.tasks} tasks executed in {elapsed}, {s.errors} errors, '
+            '{s.retries} retries waiting {retry_wait}, latency p50={p50} '
+            'p95={p95}, {s.cards} cards pushed ({s.cards_per_sec:.1f}/s)'
+        ).format(
+            s=summary,
+            elapsed=_sec(summary.elapsed),
+            retry_wait=_sec(summary.retry_wait),
+            p50=_sec(summary.latency_p50),
+            p95=_sec(summary.latency_p95),
+        )
@@ -1,19 +1,44 @@
+import collections
 import datetime
+import functools
+import heapq
+import itertools
+import multiprocessing
+from multiprocessing import util as multiprocessing_util
+import pickle
+import threading
 import time
 import sys
+import traceback
 
 import six
 
+from ..crawler.concurrency import AdaptiveConcurrency
 from ..crawler.errors import Retry
+from ..crawler.journal import CrawlJournal
+from ..crawler.metrics import CardsCounter, TasksStatistics
 from ..crawler.tasks import (
     reorg_crawl_tasks,
+    sort_crawl_tasks_by_cost,
     split_crawl_tasks,
 )
 from ..toolbox.collections_ext import nameddict
 from ..toolbox.date_ext import timestamp_ms
 
 
-def wait_or_raise(logger, retry_exc, attempt):
+def retry_delay(retry_exc, attempt):
+    """Compute how long to wait before retrying a task.
+
+    :param Retry retry_exc:
+      exception raised by the task
+    :param int attempt:
+      number of attempts already made
+
+    :return:
+      number of seconds to wait for, or `None` if the task can be retried
+      right away.
+    :raise Retry: if maximum number of retries is reached
+    """
     wait_time = None
     if attempt == retry_exc.max_retries:
         raise retry_exc
@@ -30,14 +55,383 @@ def wait_or_raise(logger, retry_exc, attempt):
         wait_time = (target_ts - now_ts) / 1e3
         if wait_time < 0:
             raise Exception("'eta' is in the future"), None, sys.exc_info()[2]
+    return wait_time
+
+
+def wait_or_raise(logger, retry_exc, attempt):
+    wait_time = retry_delay(retry_exc, attempt)
     logger.warn("Retry raised, waiting {} seconds".format(wait_time))
     if wait_time is not None:
         time.sleep(wait_time)
 
 
+def log_index_errors(logger, errors, limit=10):
+    """Log errors returned by the index when a task or the crawl is over,
+    for instance by processors flushing buffered operations.
+    """
+    if errors:
+        logger.error(
+            '{} index operations failed while flushing buffers, '
+            'first ones: {}'.format(len(errors), errors[:limit])
+        )
+
+
+class TasksSequence(object):
+    """Execution state of a sequence of tasks"""
+    def __init__(self, index, tasks, result=None, completed=0, journal=None,
+                 shared=False):
+        """
+        :param int index:
+          position of the sequence in the crawl
+        :param tasks:
+          iterable of tasks to execute in order
+        :param result:
+          `prev_result` given to the first task
+        :param int completed:
+          number of tasks of the sequence already executed
+        :param journal:
+          optional :py:class:`docido_sdk.crawler.journal.CrawlJournal`
+          where sequence progression is recorded.
+        :param bool shared:
+          `True` if `tasks` is shared with other sequences, in which case
+          tasks are unrelated and `prev_result` is always `None`.
+        """
+        self.index = index
+        self.tasks = iter(tasks)
+        self.result = result
+        self.completed = completed
+        self.journal = journal
+        self.shared = shared
+        self.task = None
+        self.epilogue = False
+        self.attempt = 1
+        self.kwargs = dict()
+
+    def next_task(self):
+        """Move to the next task of the sequence
+
+        :return: the task to execute, `None` if the sequence is over.
+        """
+        self.task = next(self.tasks, None)
+        self.attempt = 1
+        self.kwargs = dict()
+        return self.task
+
+
+class TasksScheduler(object):
+    """Thread-safe queue of :py:class:`TasksSequence` ready to be executed.
+
+    A sequence whose current task raised :py:class:`Retry` is parked in
+    a time-ordered heap until its countdown expires, so that workers keep
+    executing the other sequences in the meantime.
+
+    Sequences can also be pulled lazily from a `feed`, only when a worker
+    is idle and no other sequence is ready.
+    """
+    def __init__(self, feed=None):
+        """
+        :param feed:
+          optional iterator of :py:class:`TasksSequence` to execute
+        """
+        self._ready = collections.deque()
+        self._delayed = []
+        self._counter = itertools.count()
+        self._pending = 0
+        self._aborted = False
+        self._feed = feed
+        self._feeding = False
+        self._cond = threading.Condition()
+
+    def add(self, sequence):
+        """Submit a new sequence"""
+        with self._cond:
+            self._pending += 1
+            self._ready.append(sequence)
+            self._cond.notify()
+
+    def reschedule(self, sequence, delay=None):
+        """Put back a sequence in the queue
+
+        :param delay:
+          optional number of seconds to wait for before the sequence
+          is ready again.
+        """
+        with self._cond:
+            if delay:
+                heapq.heappush(
+                    self._delayed,
+                    (time.time() + delay, next(self._counter), sequence)
+                )
+            else:
+                self._ready.append(sequence)
+            self._cond.notify()
+
+    def done(self, sequence):
+        """Notify that all tasks of the given sequence have been executed"""
+        with self._cond:
+            self._pending -= 1
+            if self._pending == 0:
+                self._cond.notify_all()
+
+    def abort(self):
+        """Stop delivering sequences to workers"""
+        with self._cond:
+            self._aborted = True
+            self._cond.notify_all()
+
+    @property
+    def aborted(self):
+        """`True` once :py:meth:`abort` is called, workers must not start
+        new tasks"""
+        return self._aborted
+
+    def next(self):
+        """Wait for a sequence to be ready
+
+        :return:
+          the next sequence to execute, or `None` when all sequences
+          are over.
+        """
+        while True:
+            with self._cond:
+                while True:
+                    if self._aborted:
+                        return None
+                    now = time.time()
+                    while self._delayed and self._delayed[0][0] <= now:
+                        self._ready.append(heapq.heappop(self._delayed)[2])
+                    if self._ready:
+                        return self._ready.popleft()
+                    if self._feed is not None and not self._feeding:
+                        self._feeding = True
+                        break
+                    if self._pending == 0 and not self._feeding:
+                        return None
+                    timeout = None
+                    if self._delayed:
+                        timeout = self._delayed[0][0] - now
+                    self._cond.wait(timeout)
+            sequence = self._pull_feed()
+            if sequence is not None:
+                return sequence
+
+    def _pull_feed(self):
+        # the feed is consumed outside of the condition so that
+        # other workers can reschedule their sequences meanwhile.
+        sequence = None
+        try:
+            sequence = next(self._feed, None)
+        finally:
+            with self._cond:
+                self._feeding = False
+                if sequence is None:
+                    self._feed = None
+                else:
+                    self._pending += 1
+                self._cond.notify_all()
+        return sequence
+
+
+class _SharedIterator(object):
+    """Thread-safe wrapper around an iterator"""
+    def __init__(self, iterable):
+        self._iterator = iter(iterable)
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        with self._lock:
+            return next(self._iterator)
+
+    __next__ = next
+
+
+_PROCESS_WORKER_CONTEXT = None
+
+
+def _init_process_worker(runner):
+    """Initializer of the `process` executor workers. The runner is
+    inherited from the parent process, and every worker builds its own
+    index pipeline.
+    """
+    global _PROCESS_WORKER_CONTEXT
+    index_api = runner.index_api_factory()
+    _PROCESS_WORKER_CONTEXT = (
+        index_api,
+        CardsCounter(index_api),
+        runner.config.token,
+        runner.crawl_config,
+        runner.logger,
+    )
+    # run when the worker exits, after the pool is closed
+    multiprocessing_util.Finalize(
+        None, _terminate_process_worker, (index_api, runner.logger),
+        exitpriority=10
+    )
+
+
+def _terminate_process_worker(index_api, logger):
+    try:
+        log_index_errors(logger, index_api.crawl_terminated())
+    except Exception:
+        logger.exception('could not terminate index of worker process')
+
+
+def _run_process_task(task, prev_result, kwargs):
+    index_api, counter, token, crawl_config, logger = _PROCESS_WORKER_CONTEXT
+    counter.reset()
+    try:
+        result = task(index_api, token, prev_result, crawl_config, logger,
+                      **kwargs)
+        return result, counter.cards
+    except Retry as e:
+        # tracebacks cannot be sent back to the parent process
+        e.traceback = None
+        raise
+    except Exception as e:
+        raise _picklable_exception(e, traceback.format_exc())
+    finally:
+        log_index_errors(logger, index_api.task_terminated())
+
+
+def _picklable_exception(exc, formatted_traceback):
+    """Make sure an exception raised in a worker process can be sent
+    back to the parent process. Otherwise the pool fails to unpickle it,
+    and never returns.
+
+    :return: `exc` if it can be pickled, an :py:class:`Exception`
+      describing it otherwise.
+    """
+    try:
+        pickle.loads(pickle.dumps(exc, 2))
+        return exc
+    except Exception:
+        return Exception('{}: {}\n{}'.format(
+            exc.__class__.__name__, exc, formatted_traceback
+        ))
+
+
+def _process_unsafe_processors(index_api):
+    """:return: names of the processors of a pipeline that cannot be
+    used by several processes"""
+    names = []
+    while index_api is not None:
+        if not getattr(index_api, 'process_safe', True):
+            names.append(index_api.__class__.__name__)
+        index_api = getattr(index_api, '_parent', None)
+    return names
+
+
 class TasksRunner(object):
-    def __init__(self, crawler, index_api, config, logger):
+    """Execute the tasks provided by a crawler.
+
+    How the sequences of tasks are executed is driven by the `executor` key
+    of the crawl configuration:
+
+    - `sequential` (default): every sequence is executed one after
+      the other in the current thread.
+    - `thread`: sequences are executed concurrently by
+      `max_concurrent_tasks` threads. Tasks order and `prev_result`
+      chaining are preserved inside every sequence.
+    - `process`: same as `thread`, but every task is executed in a pool of
+      `max_concurrent_tasks` processes. Every worker process builds its own
+      index pipeline with the `index_api_factory` given to the constructor.
+      Tasks, the results they return, and the exceptions they raise must be
+      picklable. Worker processes do not share the state of the local
+      index processors, the process executor is meant to be used along with
+      an index that supports concurrent writers, like Elasticsearch.
+      Processors having a `process_safe` attribute set to `False` are
+      therefore rejected. When the crawl is over, worker processes call
+      `crawl_terminated` on their pipeline before exiting.
+    - `gevent`: same as `thread`, but sequences are executed by
+      `max_concurrent_tasks` greenlets, so that crawlers performing a lot
+      of concurrent network calls, one sequence per message or per card,
+      can use a high concurrency level without spawning as many threads.
+      It requires the `gevent` package, installed by the `gevent` extra
+      of `docido-sdk`, and the process to be monkey patched with
+      :py:func:`gevent.monkey.patch_all` before anything else is imported.
+      Tasks and index pipeline remain regular functions, and cooperate
+      thru the patched standard library modules.
+
+    When a task raises :py:class:`docido_sdk.crawler.Retry`, its sequence
+    is parked by a :py:class:`TasksScheduler` until the retry delay
+    expires, and the workers keep executing the other sequences
+    in the meantime.
+
+    If the `streaming` key of the crawl configuration is `True`, then tasks
+    are lazily pulled from the generator returned by the crawler instead of
+    being loaded in memory beforehand:
+
+    - a flat generator of tasks is consumed by `max_concurrent_tasks`
+      sequences, every sequence pulling its next task from the generator
+      as soon as its previous task is over. Like with the `dynamic`
+      scheduling below, tasks are given a `None` previous result.
+    - a generator of list of tasks is consumed one list at a time, only
+      when a worker is idle.
+
+    If the `scheduling` key of the crawl configuration is `dynamic`, then
+    a flat list of tasks is not split in sequences of equal size beforehand.
+    Tasks are pulled from a shared queue by `max_concurrent_tasks`
+    sequences instead, by decreasing cost if tasks have a cost attached
+    with :py:func:`docido_sdk.crawler.tasks.set_task_cost`. Every task is
+    given a `None` previous result, and the epilogue receives the result
+    of the last task of every sequence that executed at least one task.
+    Lists of list of tasks are still executed sequence by sequence.
+    Default scheduling is `static`.
+
+    If the `adaptive_concurrency` key of the crawl configuration is
+    provided, then the number of tasks executed concurrently by the `thread`,
+    `process` and `gevent` executors is adjusted during the crawl by an
+    :py:class:`docido_sdk.crawler.concurrency.AdaptiveConcurrency`
+    instance, between 1 and `max_concurrent_tasks`. The key value can be
+    either `True` or a `dict` of keyword arguments given to the
+    controller constructor.
+
+    If the `journal` key of the crawl configuration is provided, then
+    the progression of every sequence is recorded in a
+    :py:class:`docido_sdk.crawler.journal.CrawlJournal` built from this
+    key value. A crawl restarted after an interruption skips the tasks
+    already executed, gives the recorded results to the next tasks and to
+    the epilogue, and the journal is cleared when the crawl is over.
+    The journal is discarded if the pickled tasks or the crawler
+    configuration differ from the ones of the interrupted crawl.
+    Completion of a task is recorded before `task_terminated` is called
+    on the index, so that it is persisted along with the task changes.
+    Journal is only supported with the `static` scheduling,
+    without streaming.
+
+    Statistics about the executed tasks are collected by a
+    :py:class:`docido_sdk.crawler.metrics.TasksStatistics` instance,
+    logged when the crawl is over, and every task attempt is notified to
+    the :py:class:`docido_sdk.crawler.ICrawlMetrics` listeners given
+    to the constructor. Cards pushed by every task are counted by a
+    :py:class:`docido_sdk.crawler.metrics.CardsCounter`, cards rejected
+    by the index are not.
+    """
+    def __init__(self, crawler, index_api, config, logger,
+                 index_api_factory=None, check_task=None, metrics=None):
+        """
+        :param index_api_factory:
+          callable object returning a new
+          :py:class:`docido_sdk.index.IndexAPI`, used by the `process`
+          executor to create the index pipeline of every worker process.
+
+        :param check_task:
+          optional callable object given every task before it is executed,
+          in streaming mode.
+
+        :param metrics:
+          optional list of :py:class:`docido_sdk.crawler.ICrawlMetrics`
+          instances notified while tasks are executed.
+        """
         self.index_api = index_api
+        self.cards_counter = CardsCounter(index_api)
+        self.index_api_factory = index_api_factory
+        self.check_task = check_task
+        self.metrics = list(metrics or [])
+        self.statistics = TasksStatistics()
         self.config = config
         self.crawler = crawler
         self.crawl_config = nameddict(self.config.get('config') or {})
@@ -46,24 +440,332 @@ class TasksRunner(object):
         self.tasks = self._iter_crawl_tasks()
 
     def execute(self):
+        streaming = bool(self.config.get('streaming', False))
         tasks, epilogue, concurrency = reorg_crawl_tasks(
             self.tasks,
-            int(self.config.get('max_concurrent_tasks', 2))
+            int(self.config.get('max_concurrent_tasks', 2)),
+            streaming=streaming
         )
-        tasks = split_crawl_tasks(tasks, concurrency)
-        results = []
+        executor = self._get_executor()
+        self.statistics = TasksStatistics()
+        journal = None
         try:
-            for seq in tasks:
-                previous_result = None
-                for task in seq:
-                    previous_result = self._run_task(task, previous_result)
-                results.append(previous_result)
-            if epilogue is not None:
-                return self._run_task(epilogue, results)
+            if streaming:
+                sequences = self._stream_sequences(tasks, concurrency)
+            elif self._dynamic_scheduling(tasks):
+                sequences = self._share_tasks(
+                    sort_crawl_tasks_by_cost(tasks), concurrency
+                )
             else:
-                return results
+                tasks = split_crawl_tasks(tasks, concurrency)
+                journal = self._get_journal()
+                sequences = self._static_sequences(tasks, journal,
+                                                   self.crawl_config)
+            if journal is None and self.config.get('journal'):
+                self.logger.warn('crawl journal is only supported with '
+                                 'static scheduling, without streaming')
+            results = executor(sequences, concurrency)
+            if epilogue is not None:
+                results = self._run_epilogue(epilogue, results)
+            if journal is not None:
+                journal.clear()
+            return results
+        finally:
+            log_index_errors(self.logger, self.index_api.crawl_terminated())
+            summary = self.statistics.summary()
+            self.logger.info(TasksStatistics.format(summary))
+            for listener in self.metrics:
+                self._notify(listener, 'crawl_ended', summary)
+
+    def _get_journal(self):
+        config = self.config.get('journal')
+        if not config:
+            return None
+        return CrawlJournal.from_config(config, self.index_api, self.logger)
+
+    @classmethod
+    def _static_sequences(cls, tasks, journal=None, crawl_config=None):
+        if journal is None:
+            return [TasksSequence(i, seq) for i, seq in enumerate(tasks)]
+        progression = journal.load(tasks, crawl_config)
+        sequences = []
+        for i, seq in enumerate(tasks):
+            completed, result = progression.get(i, (0, None))
+            sequences.append(TasksSequence(
+                i, seq[completed:], result, completed, journal
+            ))
+        return sequences
+
+    @classmethod
+    def executors(cls):
+        return dict(
+            sequential=cls._execute_sequential,
+            thread=cls._execute_threads,
+            process=cls._execute_processes,
+            gevent=cls._execute_greenlets,
+        )
+
+    def _get_executor(self):
+        name = self.config.get('executor') or 'sequential'
+        executor = self.executors().get(name)
+        if executor is None:
+            raise Exception("Unknown tasks executor: '{}'".format(name))
+        return functools.partial(executor, self)
+
+    def _stream_sequences(self, tasks, concurrency):
+        """Build sequences lazily pulling tasks from a generator"""
+        tasks = iter(tasks)
+        first = next(tasks, None)
+        if first is None:
+            return []
+        tasks = itertools.chain([first], tasks)
+        if isinstance(first, list):
+            return (
+                TasksSequence(i, self._check_tasks(seq))
+                for i, seq in enumerate(self._check_sequences(tasks))
+            )
+        return self._share_tasks(self._check_tasks(tasks), concurrency)
+
+    def _dynamic_scheduling(self, tasks):
+        scheduling = self.config.get('scheduling') or 'static'
+        if scheduling not in ['static', 'dynamic']:
+            raise Exception("Unknown scheduling: '{}'".format(scheduling))
+        if scheduling == 'static':
+            return False
+        return not (any(tasks) and isinstance(tasks[0], list))
+
+    @classmethod
+    def _share_tasks(cls, tasks, concurrency):
+        """Build sequences pulling their tasks from the same queue"""
+        tasks = _SharedIterator(tasks)
+        return [
+            TasksSequence(i, tasks, shared=True)
+            for i in range(max(1, concurrency))
+        ]
+
+    @classmethod
+    def _check_sequences(cls, sequences):
+        for seq in sequences:
+            if not isinstance(seq, list):
+                raise Exception("Expected a list of tasks")
+            yield seq
+
+    def _check_tasks(self, tasks):
+        for task in tasks:
+            if self.check_task is not None:
+                self.check_task(task)
+            yield task
+
+    def _execute_sequential(self, sequences, concurrency):
+        return self._run_sequences(sequences, 1)
+
+    def _execute_threads(self, sequences, concurrency):
+        return self._run_sequences(sequences, concurrency)
+
+    def _execute_processes(self, sequences, concurrency):
+        if self.index_api_factory is None:
+            raise Exception(
+                "'process' executor requires an index API factory"
+            )
+        unsafe = _process_unsafe_processors(self.index_api)
+        if unsafe:
+            raise Exception(
+                "'process' executor does not support index processors "
+                "whose state is local to a process: {}".format(
+                    ', '.join(unsafe)
+                )
+            )
+        if isinstance(sequences, list):
+            concurrency = min(concurrency, len(sequences))
+        concurrency = max(1, concurrency)
+        pool = multiprocessing.Pool(concurrency, _init_process_worker, (self,))
+
+        def _call_task(task, prev_result, kwargs):
+            return pool.apply(_run_process_task, (task, prev_result, kwargs))
+
+        try:
+            results = self._run_sequences(sequences, concurrency, _call_task)
+        except BaseException:
+            pool.terminate()
+            pool.join()
+            raise
+        # let workers terminate their index pipeline
+        pool.close()
+        pool.join()
+        return results
+
+    def _execute_greenlets(self, sequences, concurrency):
+        try:
+            from gevent import monkey
+        except ImportError:
+            raise Exception("'gevent' executor requires the gevent package")
+        for module in ['socket', 'thread', 'threading', 'time']:
+            if not monkey.is_module_patched(module):
+                raise Exception(
+                    "'gevent' executor requires module '{}' to be patched "
+                    "by gevent.monkey".format(module)
+                )
+        # patched threads are greenlets
+        return self._run_sequences(sequences, concurrency)
+
+    def _run_sequences(self, sequences, concurrency, call_task=None):
+        """Execute sequences of tasks
+
+        :param sequences:
+          iterable of :py:class:`TasksSequence`, consumed lazily
+        :param int concurrency:
+          number of workers executing the sequences. If 1, then
+          sequences are executed in the current thread.
+        :param call_task:
+          optional callable object used to execute a task attempt
+
+        :return: result of the last task of every sequence
+        :rtype: list
+        """
+        adaptive = self.config.get('adaptive_concurrency')
+        if adaptive and concurrency > 1:
+            params = dict(adaptive) if isinstance(adaptive, dict) else {}
+            params.setdefault('logger', self.logger)
+            controller = AdaptiveConcurrency(concurrency, **params)
+            call_task = controller.wrap(call_task or self._call_task)
+        started = []
+
+        def _feed():
+            for sequence in sequences:
+                started.append(sequence)
+                if sequence.next_task() is not None:
+                    yield sequence
+
+        scheduler = TasksScheduler(_feed())
+        self._run_workers(scheduler, concurrency, call_task)
+        return [
+            sequence.result for sequence in started
+            # shared sequences may have found no task left
+            if not sequence.shared or sequence.completed
+        ]
+
+    def _run_workers(self, scheduler, concurrency, call_task=None):
+        if concurrency <= 1:
+            return self._work(scheduler, call_task)
+        errors = []
+
+        def _worker():
+            try:
+                self._work(scheduler, call_task)
+            except BaseException:
+                errors.append(sys.exc_info())
+                scheduler.abort()
+
+        workers = [
+            threading.Thread(target=_worker) for _ in range(concurrency)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        if any(errors):
+            exc_type, exc_value, traceback = errors[0]
+            raise exc_type, exc_value, traceback
+
+    def _work(self, scheduler, call_task=None):
+        while True:
+            sequence = scheduler.next()
+            if sequence is None:
+                break
+            while sequence is not None and not scheduler.aborted:
+                sequence = self._step(scheduler, sequence, call_task)
+
+    def _step(self, scheduler, sequence, call_task=None):
+        """Make one attempt to execute the current task of a sequence
+
+        :return:
+          the sequence if its next task can be executed right away,
+          `None` otherwise.
+        """
+        call_task = call_task or self._call_task
+        event = self._task_event(sequence)
+        prefix = 'epilogue' if sequence.epilogue else 'task'
+        self._emit(prefix + '_started', event)
+        start = time.time()
+        cards = 0
+        prev_result = None if sequence.shared else sequence.result
+        try:
+            try:
+                result, cards = call_task(sequence.task, prev_result,
+                                          sequence.kwargs)
+            except Retry as e:
+                try:
+                    delay = retry_delay(e, sequence.attempt)
+                except:
+                    self.logger.exception('Max retries reached')
+                    result = e
+                else:
+                    self.logger.warn(
+                        "Retry raised, waiting {} seconds".format(delay)
+                    )
+                    event.update(elapsed=time.time() - start, cards=cards,
+                                 error=e, delay=delay)
+                    self._emit('task_retried', event)
+                    sequence.attempt += 1
+                    sequence.kwargs = e.kwargs
+                    scheduler.reschedule(sequence, delay)
+                    return None
+            except Exception as e:
+                self.logger.exception('Unexpected exception was raised')
+                result = e
+            sequence.result = result
+            sequence.completed += 1
+            if sequence.journal is not None:
+                # recorded before the task is terminated, so that
+                # write-behind stores persist it with the task changes
+                sequence.journal.record(sequence.index, sequence.completed,
+                                        result)
         finally:
-            self.index_api.crawl_terminated()
+            log_index_errors(self.logger, self.index_api.task_terminated())
+        event.update(elapsed=time.time() - start, cards=cards,
+                     error=result if isinstance(result, Exception) else None)
+        self._emit(prefix + '_ended', event)
+        if scheduler.aborted:
+            # do not pull tasks from shared or streamed iterators
+            return None
+        if sequence.next_task() is None:
+            scheduler.done(sequence)
+            return None
+        return sequence
+
+    def _call_task(self, task, prev_result, kwargs):
+        self.cards_counter.reset()
+        result = task(self.index_api, self.config.token, prev_result,
+                      self.crawl_config, self.logger, **kwargs)
+        return result, self.cards_counter.cards
+
+    def _task_event(self, sequence):
+        return nameddict(
+            service=getattr(self.crawler, 'get_service_name', lambda: None)(),
+            sequence=sequence.index,
+            position=sequence.completed,
+            task=self._task_name(sequence.task),
+            attempt=sequence.attempt,
+            epilogue=sequence.epilogue,
+        )
+
+    @classmethod
+    def _task_name(cls, task):
+        func = getattr(task, 'func', task)
+        return getattr(func, '__name__', repr(func))
+
+    def _emit(self, name, event):
+        self._notify(self.statistics, name, event)
+        for listener in self.metrics:
+            self._notify(listener, name, event)
+
+    def _notify(self, listener, name, *args):
+        try:
+            getattr(listener, name)(*args)
+        except Exception:
+            self.logger.exception(
+                "crawl metrics listener failed to handle '{}'".format(name)
+            )
 
     def _iter_crawl_tasks(self):
         attempt = 1
@@ -86,32 +788,15 @@ class TasksRunner(object):
                 self.logger.exception('Unexpected exception was raised')
                 raise
             finally:
-                self.index_api.task_terminated()
+                log_index_errors(self.logger,
+                                 self.index_api.task_terminated())
         return tasks
 
-    def _run_task(self, task, prev_result):
-        attempt = 1
-        result = None
-        kwargs = dict()
-        while True:
-            try:
-                result = task(self.index_api, self.config.token, prev_result,
-                              self.crawl_config, self.logger, **kwargs)
-                break
-            except Retry as e:
-                try:
-                    wait_or_raise(self.logger, e, attempt)
-                except:
-                    self.logger.exception('Max retries reached')
-                    result = e
-                    break
-                else:
-                    attempt += 1
-                    kwargs = e.kwargs
-            except Exception as e:
-                self.logger.exception('Unexpected exception was raised')
-                result = e
-                break
-            finally:
-                self.index_api.task_terminated()
-        return result
+    def _run_epilogue(self, task, prev_result):
+        sequence = TasksSequence(0, [task], prev_result)
+        sequence.epilogue = True
+        scheduler = TasksScheduler()
+        sequence.next_task()
+        scheduler.add(sequence)
+        self._work(scheduler)
+        return sequence.result
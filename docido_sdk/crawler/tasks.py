@@ -1,9 +1,37 @@
+import heapq
 import logging
 from math import ceil
 
 from docido_sdk.toolbox.collections_ext import chunks
 
 LOGGER = logging.getLogger(__name__)
+TASK_COST_ATTR = 'cost'
+
+
+def set_task_cost(task, cost):
+    """ Attach to a task an estimate of the work it requires, for instance
+    a number of items or bytes to fetch. Costs are used by
+    :py:func:`split_crawl_tasks` to balance sequences of tasks.
+
+    :param functools.partial task:
+      crawl task
+    :param cost:
+      positive number
+
+    :return: the given task
+    """
+    setattr(task, TASK_COST_ATTR, cost)
+    return task
+
+
+def get_task_cost(task, default=1):
+    """ Get the cost estimate attached to a task with
+    :py:func:`set_task_cost`
+
+    :return:
+      task cost, or `default` if task has none.
+    """
+    return getattr(task, TASK_COST_ATTR, default)
 
 
 def check_custom_concurrency(default, forced, logger=None):
@@ -35,10 +63,14 @@ def check_custom_concurrency(default, forced, logger=None):
     return default
 
 
-def reorg_crawl_tasks(tasks, concurrency, logger=None):
+def reorg_crawl_tasks(tasks, concurrency, logger=None, streaming=False):
     """ Extract content returned by the crawler `iter_crawl_tasks`
     member method.
 
+    :param bool streaming:
+      if `True`, sub-tasks are returned as given by the crawler, otherwise
+      they are loaded in a list.
+
     :return:
       tuple made of the sub-tasks to executed, the epilogue task to execute
       or `None` is none was specified by the crawler, and the proper
@@ -48,8 +80,10 @@ def reorg_crawl_tasks(tasks, concurrency, logger=None):
     futures = tasks['tasks']
     epilogue = tasks.get('epilogue')
     custom_concurrency = tasks.get('max_concurrent_tasks', concurrency)
-    check_custom_concurrency(concurrency, custom_concurrency, logger)
-    futures = list(futures)
+    concurrency = check_custom_concurrency(concurrency, custom_concurrency,
+                                           logger)
+    if not streaming:
+        futures = list(futures)
     return futures, epilogue, concurrency
 
 
@@ -62,6 +96,11 @@ def split_crawl_tasks(tasks, concurrency):
     :param int concurrency:
       Maximum number of tasks that might be executed in parallel.
 
+    If at least one task of a flat list has a cost attached with
+    :py:func:`set_task_cost`, then tasks are balanced among sequences
+    according to their costs. Otherwise every sequence gets the same number
+    of tasks.
+
     :return:
       list of list of tasks.
     """
@@ -70,7 +109,10 @@ def split_crawl_tasks(tasks, concurrency):
             if not isinstance(seq, list):
                 raise Exception("Expected a list of tasks")
     else:
-        if concurrency > 1:
+        if concurrency > 1 and any(
+                hasattr(task, TASK_COST_ATTR) for task in tasks):
+            tasks = balance_crawl_tasks(tasks, concurrency)
+        elif concurrency > 1:
             chain_size = int(ceil(float(len(tasks)) / concurrency))
             tasks = [
                 chunk for chunk in
@@ -82,3 +124,41 @@ def split_crawl_tasks(tasks, concurrency):
         else:
             tasks = [tasks]
     return tasks
+
+
+def balance_crawl_tasks(tasks, concurrency):
+    """ Split a list of tasks in sequences of balanced costs, following
+    the Longest Processing Time first rule: tasks are taken in decreasing
+    cost order, and every task is appended to the sequence having the
+    lowest total cost.
+
+    :param list tasks:
+      tasks to execute. Tasks without cost estimate are given a cost of 1.
+    :param int concurrency:
+      Maximum number of sequences to create.
+
+    :return:
+      list of list of tasks
+    """
+    sequences = [[] for _ in range(max(1, concurrency))]
+    loads = [(0, i) for i in range(len(sequences))]
+    for task in sort_crawl_tasks_by_cost(tasks):
+        load, i = heapq.heappop(loads)
+        sequences[i].append(task)
+        heapq.heappush(loads, (load + get_task_cost(task), i))
+    return [seq for seq in sequences if any(seq)]
+
+
+def sort_crawl_tasks_by_cost(tasks):
+    """ Sort tasks by decreasing cost, if at least one of them has a cost
+    attached with :py:func:`set_task_cost`.
+
+    :param list tasks:
+      tasks to sort
+
+    :return:
+      new list of tasks, or the given one if no task has a cost.
+    """
+    if not any(hasattr(task, TASK_COST_ATTR) for task in tasks):
+        return tasks
+    return sorted(tasks, key=get_task_cost, reverse=True)
@@ -57,6 +57,10 @@ class IndexAPI(object):
         the target scope by providing a `query` in parameter.
         The `query` parameters follows the Elasticsearch Query DSL.
     """
+    process_safe = True
+    """`False` if the index state is local to the process, so that several
+    worker processes cannot share it"""
+
     def get_user_identifier(self):
         """Retrieve unique resource identifier of the user that owns
         the crawled data"""
@@ -165,12 +169,16 @@ class IndexAPI(object):
         """Called by framework when crawl is over
 
         Helpful to flush buffers
+
+        :return: collection of items whose buffered operation failed, if any
         """
 
     def task_terminated(self):
         """Called by the framework when a crawl task terminates
 
         Helpful to flush buffers
+
+        :return: collection of items whose buffered operation failed, if any
         """
 
 
@@ -209,6 +217,9 @@ class IndexAPIProcessor(IndexAPI):
     def delete_thumbnails(self, query=None):
         return self._parent.delete_thumbnails(query)
 
+    def delete_thumbnails_by_id(self, ids):
+        return self._parent.delete_thumbnails_by_id(ids)
+
     def get_kv(self, key):
         return self._parent.get_kv(key)
 
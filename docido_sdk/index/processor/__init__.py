@@ -1,2 +1,4 @@
+from buffer import *  # noqa
+from changes import *  # noqa
 from check import *  # noqa
 from es_api import *  # noqa
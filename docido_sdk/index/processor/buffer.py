@@ -0,0 +1,175 @@
+import json
+import threading
+import time
+
+from docido_sdk.core import (
+    Component,
+    implements,
+)
+from docido_sdk.index import (
+    IndexAPIProcessor,
+    IndexAPIProvider,
+)
+
+__all__ = ['BufferProcessor']
+
+
+class Buffer(IndexAPIProcessor):
+    """ An index api processor accumulating cards, thumbnails, and deletions
+    by id, to forward them in bulk to the next processor.
+
+    Buffered operations are flushed in the order they were submitted,
+    consecutive operations of the same kind being merged, when one of
+    the following thresholds is reached:
+
+    - `max_operations`: number of buffered items
+    - `max_bytes`: approximate size in bytes of buffered items
+    - `max_age`: number of seconds since the oldest buffered item.
+      It is only checked when a new operation is submitted.
+
+    Thresholds are read from the `buffer` section of the processor
+    configuration. Buffers are also flushed when a task or the crawl is
+    over, and before queries are forwarded, so that they see buffered
+    changes.
+
+    Errors of a flush are returned by the call that triggered it.
+    Errors of a flush triggered by a query are returned by the next call
+    modifying the index, or by `task_terminated`. Errors may therefore be
+    reported to a task different from the one that submitted the failed
+    items, when tasks are executed concurrently.
+
+    If the next processor raises an exception during a flush, the failed
+    operation and the following ones remain buffered for the next flush,
+    and errors already collected are returned by the next call.
+    """
+    DEFAULT_MAX_OPERATIONS = 500
+    DEFAULT_MAX_BYTES = 5 * 1024 * 1024
+    DEFAULT_MAX_AGE = 5
+
+    def __init__(self, **config):
+        super(Buffer, self).__init__(**config)
+        buffer_config = config.get('buffer') or {}
+        self.max_operations = buffer_config.get('max_operations',
+                                                self.DEFAULT_MAX_OPERATIONS)
+        self.max_bytes = buffer_config.get('max_bytes', self.DEFAULT_MAX_BYTES)
+        self.max_age = buffer_config.get('max_age', self.DEFAULT_MAX_AGE)
+        self._operations = []
+        self._errors = []
+        self._count = 0
+        self._bytes = 0
+        self._since = None
+        self._lock = threading.RLock()
+
+    def push_cards(self, cards):
+        return self._buffer('push_cards', cards, self._card_size)
+
+    def delete_cards_by_id(self, ids):
+        return self._buffer('delete_cards_by_id', ids, len)
+
+    def push_thumbnails(self, thumbnails):
+        return self._buffer('push_thumbnails', thumbnails,
+                            self._thumbnail_size)
+
+    def delete_thumbnails_by_id(self, ids):
+        return self._buffer('delete_thumbnails_by_id', ids, len)
+
+    def delete_cards(self, query=None):
+        self._flush_pending()
+        return super(Buffer, self).delete_cards(query)
+
+    def search_cards(self, query=None):
+        self._flush_pending()
+        return super(Buffer, self).search_cards(query)
+
+    def delete_thumbnails(self, query=None):
+        self._flush_pending()
+        return super(Buffer, self).delete_thumbnails(query)
+
+    def task_terminated(self):
+        errors = self.flush()
+        errors.extend(super(Buffer, self).task_terminated() or [])
+        return errors
+
+    def crawl_terminated(self):
+        errors = self.flush()
+        errors.extend(super(Buffer, self).crawl_terminated() or [])
+        return errors
+
+    def flush(self):
+        """Forward all buffered operations to the next processor
+
+        :return: items whose operation failed
+        :rtype: list
+        """
+        with self._lock:
+            errors, self._errors = self._errors, []
+            operations, self._operations = self._operations, []
+            self._count = self._bytes = 0
+            self._since = None
+            for i, (operation, items, _) in enumerate(operations):
+                try:
+                    errors.extend(
+                        getattr(self._parent, operation)(items) or []
+                    )
+                except:
+                    # keep failed and next operations for the next flush
+                    remaining = operations[i:]
+                    self._operations = remaining + self._operations
+                    self._count += sum(len(o[1]) for o in remaining)
+                    self._bytes += sum(o[2] for o in remaining)
+                    self._since = time.time()
+                    self._errors = errors + self._errors
+                    raise
+            return errors
+
+    def _flush_pending(self):
+        with self._lock:
+            if any(self._operations):
+                errors = self.flush()
+                self._errors.extend(errors)
+
+    def _buffer(self, operation, items, sizeof):
+        items = list(items)
+        with self._lock:
+            if not any(self._operations):
+                self._since = time.time()
+            size = 0
+            if self.max_bytes is not None:
+                size = sum(sizeof(item) for item in items)
+            if any(self._operations) and self._operations[-1][0] == operation:
+                self._operations[-1][1].extend(items)
+                self._operations[-1][2] += size
+            else:
+                self._operations.append([operation, items, size])
+            self._count += len(items)
+            self._bytes += size
+            if self._must_flush():
+                return self.flush()
+            errors, self._errors = self._errors, []
+            return errors
+
+    def _must_flush(self):
+        if self.max_operations is not None \
+                and self._count >= self.max_operations:
+            return True
+        if self.max_bytes is not None and self._bytes >= self.max_bytes:
+            return True
+        if self.max_age is not None \
+                and time.time() - self._since >= self.max_age:
+            return True
+        return False
+
+    @classmethod
+    def _card_size(cls, card):
+        return len(json.dumps(card, default=repr))
+
+    @classmethod
+    def _thumbnail_size(cls, thumbnail):
+        return sum(len(field or '') for field in thumbnail)
+
+
+class BufferProcessor(Component):
+    implements(IndexAPIProvider)
+
+    def get_index_api(self, **config):
+        return Buffer(**config)
@@ -0,0 +1,239 @@
+import hashlib
+import json
+import logging
+import threading
+
+from docido_sdk.core import (
+    Component,
+    implements,
+)
+from docido_sdk.index import (
+    IndexAPIProcessor,
+    IndexAPIProvider,
+)
+from docido_sdk.toolbox.collections_ext import nameddict
+from docido_sdk.toolbox.storage_ext import (
+    JSONLinesFile,
+    PrefixedKV,
+)
+
+__all__ = ['ChangeDetectionProcessor']
+
+LOGGER = logging.getLogger(__name__)
+
+
+def card_fingerprint(card):
+    """Compact digest of a card content
+
+    :rtype: string
+    """
+    content = json.dumps(card, sort_keys=True, separators=(',', ':'),
+                         default=repr)
+    if isinstance(content, unicode):
+        content = content.encode('utf-8')
+    return hashlib.sha1(content).hexdigest()[:16]
+
+
+class KVFingerprintStore(PrefixedKV):
+    """Persist fingerprints in the key-value store of the index.
+
+    Fingerprints are spread over `BUCKETS` JSON values, so that a batch
+    of cards is written with at most one `set_kv` per bucket it touches,
+    instead of one per card.
+    """
+    BUCKETS = 16
+
+    def __init__(self, index_api, prefix='card-fp'):
+        super(KVFingerprintStore, self).__init__(index_api, prefix)
+        self._buckets = None
+
+    @classmethod
+    def bucket(cls, card_id):
+        digest = hashlib.md5(card_id.encode('utf-8')).hexdigest()
+        return str(int(digest[:8], 16) % cls.BUCKETS)
+
+    def load(self):
+        values = super(KVFingerprintStore, self).load()
+        self._buckets = dict(
+            (key, json.loads(value)) for key, value in values.iteritems()
+        )
+        fingerprints = dict()
+        for bucket in self._buckets.itervalues():
+            fingerprints.update(bucket)
+        return fingerprints
+
+    def update(self, fingerprints):
+        self._write(fingerprints.iteritems())
+
+    def remove(self, ids):
+        self._write((card_id, None) for card_id in ids)
+
+    def _write(self, changes):
+        if self._buckets is None:
+            self.load()
+        touched = set()
+        for card_id, fingerprint in changes:
+            key = self.bucket(card_id)
+            bucket = self._buckets.setdefault(key, dict())
+            if fingerprint is not None:
+                bucket[card_id] = fingerprint
+            elif bucket.pop(card_id, None) is None:
+                continue
+            touched.add(key)
+        for key in touched:
+            if self._buckets[key]:
+                self.set(key, json.dumps(self._buckets[key]))
+            else:
+                self.delete(key)
+                del self._buckets[key]
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FileFingerprintStore(object):
+    """Persist fingerprints in a local file, where updates are
+    appended as JSON lines.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._file = JSONLinesFile(path, keep_open=True)
+
+    def load(self):
+        fingerprints = dict()
+        for card_id, fingerprint in self._file:
+            if fingerprint is None:
+                fingerprints.pop(card_id, None)
+            else:
+                fingerprints[card_id] = fingerprint
+        return fingerprints
+
+    def update(self, fingerprints):
+        self._file.append(fingerprints.iteritems())
+
+    def remove(self, ids):
+        self._file.append((card_id, None) for card_id in ids)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class ChangeDetection(IndexAPIProcessor):
+    """ An index api processor dropping cards whose content did not change
+    since they were last pushed.
+
+    A fingerprint of every card pushed is kept in a store specified
+    by the `change_detection` section of the processor configuration:
+
+    - `storage`: either `kv` (default) to use the key-value store of
+      the next processors, or `file`.
+    - `key`: prefix of the keys written in the key-value store,
+      default is `card-fp`.
+    - `path`: path to the fingerprints file, mandatory with
+      the `file` storage.
+
+    Cards whose push failed are not fingerprinted. Deletion of cards by
+    query forgets every fingerprint, so that cards are pushed again.
+
+    Number of pushed and skipped cards are available in the `stats`
+    attribute, and logged when the crawl is over.
+    """
+    def __init__(self, **config):
+        super(ChangeDetection, self).__init__(**config)
+        change_config = config.get('change_detection') or {}
+        storage = change_config.get('storage', 'kv')
+        if storage == 'kv':
+            self._store = KVFingerprintStore(
+                self._parent, change_config.get('key', 'card-fp')
+            )
+        elif storage == 'file':
+            if 'path' not in change_config:
+                raise Exception(
+                    "'file' fingerprints storage requires a 'path'"
+                )
+            self._store = FileFingerprintStore(change_config['path'])
+        else:
+            raise Exception(
+                "Unknown fingerprints storage: '{}'".format(storage)
+            )
+        self._fingerprints = None
+        self._lock = threading.Lock()
+        self.stats = nameddict(pushed=0, skipped=0)
+
+    @property
+    def fingerprints(self):
+        if self._fingerprints is None:
+            self._fingerprints = self._store.load()
+        return self._fingerprints
+
+    def push_cards(self, cards):
+        changed = []
+        fingerprints = dict()
+        with self._lock:
+            for card in cards:
+                card_id = card.get('id') if isinstance(card, dict) else None
+                if card_id is None:
+                    # let next processors report the invalid card
+                    changed.append(card)
+                    continue
+                card_id = unicode(card_id)
+                fingerprint = card_fingerprint(card)
+                if self.fingerprints.get(card_id) == fingerprint:
+                    self.stats.skipped += 1
+                    continue
+                fingerprints[card_id] = fingerprint
+                changed.append(card)
+            self.stats.pushed += len(changed)
+        if not changed:
+            return []
+        errors = super(ChangeDetection, self).push_cards(changed) or []
+        for error in errors:
+            if isinstance(error, dict) and error.get('id') is not None:
+                fingerprints.pop(unicode(error['id']), None)
+        with self._lock:
+            self.fingerprints.update(fingerprints)
+            self._store.update(fingerprints)
+        return errors
+
+    def delete_cards_by_id(self, ids):
+        ids = list(ids)
+        with self._lock:
+            forgotten = [
+                unicode(card_id) for card_id in ids
+                if self.fingerprints.pop(unicode(card_id), None) is not None
+            ]
+            self._store.remove(forgotten)
+        return super(ChangeDetection, self).delete_cards_by_id(ids)
+
+    def delete_cards(self, query=None):
+        with self._lock:
+            self._store.remove(self.fingerprints.keys())
+            self.fingerprints.clear()
+        return super(ChangeDetection, self).delete_cards(query)
+
+    def task_terminated(self):
+        with self._lock:
+            self._store.flush()
+        return super(ChangeDetection, self).task_terminated()
+
+    def crawl_terminated(self):
+        with self._lock:
+            self._store.close()
+        LOGGER.info(
+            '{s.pushed} cards pushed, {s.skipped} unchanged cards '
+            'skipped'.format(s=self.stats)
+        )
+        return super(ChangeDetection, self).crawl_terminated()
+
+
+class ChangeDetectionProcessor(Component):
+    implements(IndexAPIProvider)
+
+    def get_index_api(self, **config):
+        return ChangeDetection(**config)
@@ -1,36 +1,168 @@
+import collections
 from collections import Mapping
-import copy
+import functools
+import itertools
+import json
+from multiprocessing.pool import ThreadPool
+import os
+import logging
+import threading
+import time
 
 from elasticsearch import Elasticsearch as _Elasticsearch
+from elasticsearch.exceptions import ConnectionTimeout
 from elasticsearch.helpers import scan
+import six
 
-from docido_sdk.toolbox.collections_ext import chunks
+from docido_sdk.toolbox.collections_ext import chunks, nameddict
+from docido_sdk.toolbox.decorators import lazy
+from docido_sdk.toolbox.ha import HA
 from docido_sdk.core import (
     Component,
     implements,
 )
 from docido_sdk.index import (
+    IndexAPIError,
     IndexAPIProcessor,
     IndexAPIProvider,
 )
+from docido_sdk.index.processor.es_transport import (
+    CompressedConnection,
+    FastJSONSerializer,
+)
 import docido_sdk.config as docido_config
 
 __all__ = ['Elasticsearch']
 
-ES_BULK_OPERATION = ['index', 'create', 'update', 'delete']
+LOGGER = logging.getLogger(__name__)
+
+ES_BULK_RETRY_STATUSES = [429, 503]
+REFRESH_POLICIES = [
+    'true', 'none', 'wait_for', 'task_terminated', 'crawl_terminated'
+]
+DEFAULT_CONNECTIONS_PER_HOST = 25
+
+_ES_CLIENTS = {}
+_ES_CLIENTS_LOCK = threading.Lock()
+
+
+def get_es_client(hosts, **params):
+    """Get an Elasticsearch client shared by the whole process
 
+    Clients are created once per process for every set of
+    hosts and connection parameters, so that their connection pools
+    are reused by every :py:class:`ElasticsearchProcessor` instance.
+
+    :param hosts:
+      Elasticsearch nodes
+    :param params:
+      extra parameters given to the
+      :py:class:`elasticsearch.Elasticsearch` constructor. `maxsize`,
+      the number of connections kept per host, defaults to
+      `DEFAULT_CONNECTIONS_PER_HOST`. The following parameters are also
+      supported:
+
+      - `http_compress`: if `True`, request bodies bigger than
+        `compress_min_size` bytes (default is 1024) are compressed
+        with gzip.
+      - `serializer`: name of the JSON library used to serialize requests,
+        either `auto` to use the fastest one available, `orjson`, `ujson`,
+        or `json` for the standard library.
+
+      See :py:mod:`docido_sdk.index.processor.es_transport`.
+
+    :rtype: elasticsearch.Elasticsearch
+    """
+    params.setdefault('maxsize', DEFAULT_CONNECTIONS_PER_HOST)
+    # connections must not be shared with forked processes
+    key = json.dumps([os.getpid(), hosts, params], sort_keys=True,
+                     default=repr)
+    if params.pop('http_compress', False):
+        params.setdefault('connection_class', CompressedConnection)
+    if isinstance(params.get('serializer'), six.string_types):
+        params['serializer'] = FastJSONSerializer(params['serializer'])
+    with _ES_CLIENTS_LOCK:
+        client = _ES_CLIENTS.get(key)
+        if client is None:
+            client = _Elasticsearch(hosts, **params)
+            _ES_CLIENTS[key] = client
+        return client
 
-class ElasticsearchProcessor(IndexAPIProcessor):
+
+class ElasticsearchProcessor(IndexAPIProcessor, HA):
     """ Main Elasticsearch entry point
 
     Every sent card or thumbnail will get indexed in the user's associated
     index.
 
-    Also provide convenience method for documents search and deletion
+    Also provide convenience method for documents search and deletion.
+
+    The `elasticsearch` section of the processor configuration may provide
+    the following keys:
+
+    - `routing`: routing value given to every request
+    - `scroll_size`: number of cards fetched by every request
+      made by :py:meth:`search_cards`
+    - `scroll_keep_alive`: how long Elasticsearch keeps the search context
+      of :py:meth:`search_cards` between 2 requests, for instance `1m`
+    - `refresh`: when modified indices are refreshed, to make changes
+      visible to search:
+
+      - `true` (default): every bulk request forces a refresh
+      - `none`: indices are never explicitly refreshed, changes become
+        visible after the index `refresh_interval`.
+      - `wait_for`: bulk requests wait for the next scheduled refresh,
+        requires Elasticsearch 5.0 or higher.
+      - `task_terminated`: modified indices are refreshed once
+        at the end of every crawl task.
+      - `crawl_terminated`: modified indices are refreshed once
+        at the end of the crawl.
+    - `bulk_chunk_size`: maximum number of documents sent
+      in a bulk request
+    - `bulk_max_bytes`: approximate maximum size in bytes of a bulk
+      request, which must remain below the cluster `http.max_content_length`
+    - `bulk_threads`: number of bulk requests sent in parallel when
+      documents pushed at once do not fit in a single request,
+      or when documents are deleted by query.
+    - `task_poll_interval`: number of seconds between 2 requests checking
+      whether a deletion by query is over, default is 5.
+
+    Bulk operations rejected because the cluster is overloaded, with HTTP
+    status 429 or 503, are resubmitted after a delay given by the
+    `elasticsearch_bulk` entry of the `ha_retry` configuration, a
+    truncated exponential backoff of 1 second by default, up to 5 times.
+    Number of resubmissions, resubmitted operations and time spent waiting
+    are available in the `bulk_stats` attribute.
+
+    Deletions by query rely on the `_delete_by_query` API, sliced in
+    `bulk_threads` parts, when the cluster runs Elasticsearch 5.0 or
+    higher. The deletion runs as a background task on the cluster, polled
+    with the `_tasks` API until it is over, so that long deletions do not
+    hit the client request timeout. :py:class:`IndexAPIError` is raised
+    if the task fails, or if some documents could not be deleted.
+    Otherwise identifiers of matching documents are scrolled and
+    deleted by concurrent bulk requests, and modified index is refreshed
+    once at the end.
     """
+    DEFAULT_SCROLL_SIZE = 500
+    DEFAULT_SCROLL_KEEP_ALIVE = '1m'
+    DEFAULT_BULK_CHUNK_SIZE = 500
+    DEFAULT_BULK_MAX_BYTES = 10 * 1024 * 1024
+    DEFAULT_BULK_THREADS = 4
+    DEFAULT_TASK_POLL_INTERVAL = 5
+    HA_BULK_CONFIG = 'elasticsearch_bulk'
+    DEFAULT_HA_BULK_CONFIG = dict(
+        delay=1,
+        max_retries=5,
+        delay_policy='truncated_exponential_backoff',
+        delay_config=dict(
+            max_collisions=5
+        )
+    )
 
     def __init__(self, **config):
         super(ElasticsearchProcessor, self).__init__(**config)
+        HA.__init__(self)
         es_config = docido_config.elasticsearch
         service = config['service']
         fmt = {'service': service}
@@ -38,56 +170,241 @@ class ElasticsearchProcessor(IndexAPIProcessor):
         self.__es_store_index = es_config.ES_STORE_INDEX.format(**fmt)
         self.__card_type = es_config.ES_CARD_TYPE.format(**fmt)
         self.__store_type = es_config.ES_STORE_TYPE.format(**fmt)
-        self.__routing = config.get('elasticsearch', {}).get('routing')
-        self.__es = _Elasticsearch(
-            es_config.ES_HOST,
-            **es_config.get('connection_params', {})
+        processor_config = config.get('elasticsearch', {})
+        self.__routing = processor_config.get('routing')
+        self.__scroll_size = processor_config.get('scroll_size',
+                                                  self.DEFAULT_SCROLL_SIZE)
+        self.__scroll_keep_alive = processor_config.get(
+            'scroll_keep_alive', self.DEFAULT_SCROLL_KEEP_ALIVE
         )
-        self.__es_store = _Elasticsearch(
+        self.__refresh = self._refresh_policy(
+            processor_config.get('refresh', True)
+        )
+        self.__dirty_indices = set()
+        self.__dirty_lock = threading.Lock()
+        self.__bulk_chunk_size = processor_config.get(
+            'bulk_chunk_size', self.DEFAULT_BULK_CHUNK_SIZE
+        )
+        self.__bulk_max_bytes = processor_config.get(
+            'bulk_max_bytes', self.DEFAULT_BULK_MAX_BYTES
+        )
+        self.__bulk_threads = processor_config.get(
+            'bulk_threads', self.DEFAULT_BULK_THREADS
+        )
+        self.__task_poll_interval = processor_config.get(
+            'task_poll_interval', self.DEFAULT_TASK_POLL_INTERVAL
+        )
+        self.__bulk_pool = None
+        self.__bulk_pool_lock = threading.Lock()
+        self.bulk_stats = nameddict(retries=0, retried_items=0, wait_time=0)
+        self.__bulk_stats_lock = threading.Lock()
+        self.__es = get_es_client(
             es_config.ES_HOST,
             **es_config.get('connection_params', {})
         )
 
+    def ha_get_config(self, name):
+        if name == self.HA_BULK_CONFIG and name not in self.ha_config:
+            return nameddict(self.DEFAULT_HA_BULK_CONFIG)
+        return super(ElasticsearchProcessor, self).ha_get_config(name)
+
+    @classmethod
+    def _refresh_policy(cls, refresh):
+        if refresh is True:
+            refresh = 'true'
+        elif refresh is False or refresh is None:
+            refresh = 'none'
+        refresh = str(refresh).lower()
+        if refresh not in REFRESH_POLICIES:
+            raise Exception("Unknown refresh policy: '{}'".format(refresh))
+        return refresh
+
+    def __bulk(self, es, index, params, refresh=True):
+        """Send a bulk request, honoring the refresh policy
+
+        :param bool refresh:
+          if `False`, then the caller is responsible for refreshing
+          the index with the `true` policy.
+        """
+        if self.__refresh == 'true':
+            if refresh:
+                params['refresh'] = True
+        elif self.__refresh == 'wait_for':
+            params['refresh'] = 'wait_for'
+        elif self.__refresh != 'none':
+            with self.__dirty_lock:
+                self.__dirty_indices.add((es, index))
+        return es.bulk(**params)
+
+    def __refresh_indices(self):
+        with self.__dirty_lock:
+            dirty_indices = self.__dirty_indices
+            self.__dirty_indices = set()
+        for es, index in dirty_indices:
+            es.indices.refresh(index=index)
+
+    def __get_bulk_pool(self):
+        with self.__bulk_pool_lock:
+            if self.__bulk_pool is None:
+                self.__bulk_pool = ThreadPool(self.__bulk_threads)
+            return self.__bulk_pool
+
+    def __close_bulk_pool(self):
+        with self.__bulk_pool_lock:
+            if self.__bulk_pool is not None:
+                self.__bulk_pool.close()
+                self.__bulk_pool.join()
+                self.__bulk_pool = None
+
+    def __map_bulk(self, func, items):
+        """Apply a function in parallel on every item with the bulk
+        thread pool, while keeping at most `bulk_threads` items in memory.
+
+        :param items: iterable consumed lazily
+        :return: generator of results, in items order
+        """
+        pool = self.__get_bulk_pool()
+        pending = collections.deque()
+        for item in items:
+            if len(pending) >= self.__bulk_threads:
+                yield pending.popleft().get()
+            pending.append(pool.apply_async(func, (item,)))
+        while pending:
+            yield pending.popleft().get()
+
+    @lazy
+    def _es_version(self):
+        version = self.__es.info()['version']['number']
+        return tuple(int(v) for v in version.split('-')[0].split('.'))
+
     def ping(self):
-        return self.__es.ping() and self.__es_store.ping()
+        return self.__es.ping()
+
+    def task_terminated(self):
+        if self.__refresh == 'task_terminated':
+            self.__refresh_indices()
+        return super(ElasticsearchProcessor, self).task_terminated()
+
+    def crawl_terminated(self):
+        if self.__refresh in ['task_terminated', 'crawl_terminated']:
+            self.__refresh_indices()
+        self.__close_bulk_pool()
+        if self.bulk_stats.retries:
+            LOGGER.info(
+                '{s.retried_items} bulk operations resubmitted in '
+                '{s.retries} retries, after waiting {s.wait_time} '
+                'seconds'.format(s=self.bulk_stats)
+            )
+        return super(ElasticsearchProcessor, self).crawl_terminated()
 
     def search_cards(self, query):
+        """Iterate over the cards matching a query with the scroll API,
+        `scroll_size` cards at a time. Cards are sorted by index order,
+        unless the query specifies a `sort` criteria.
+        """
         # pylint: disable=unexpected-keyword-arg
-        generated_results = 0
-        batch_size = 10
-        offset = 0
-        body = dict(
+        query = dict(query or {})
+        query.setdefault('sort', ['_doc'])
+        params = dict(
             body=query,
             index=self.__es_index,
             doc_type=self.__card_type,
-            size=batch_size,
-            from_=offset,
+            size=self.__scroll_size,
+            scroll=self.__scroll_keep_alive,
         )
         if self.__routing:
-            body['routing'] = self.__routing
-        search_results = self.__es.search(**body)
-
-        while generated_results != search_results['hits']['total']:
-            for hit in search_results['hits']['hits']:
-                generated_results += 1
-                yield hit['_source']
-
-            offset += batch_size
-            body['from_'] = offset
-            search_results = self.__es.search(**body)
+            params['routing'] = self.__routing
+        search_results = self.__es.search(**params)
+        scroll_id = search_results.get('_scroll_id')
+        try:
+            while any(search_results['hits']['hits']):
+                for hit in search_results['hits']['hits']:
+                    yield hit['_source']
+                if scroll_id is None:
+                    break
+                search_results = self.__es.scroll(
+                    scroll_id=scroll_id,
+                    scroll=self.__scroll_keep_alive
+                )
+                scroll_id = search_results.get('_scroll_id', scroll_id)
+        finally:
+            if scroll_id is not None:
+                # release search context on the cluster, even if
+                # the generator is not exhausted.
+                self.__es.clear_scroll(scroll_id=scroll_id, ignore=404)
 
     def __delete_es_docs(self, body, es, index, doc_type):
+        if self._es_version >= (5, 0):
+            return self.__delete_by_query(body, es, index, doc_type)
         query = dict(
             query=body,
             index=index,
             doc_type=doc_type,
-            fields=['_id']
+            fields=['_id'],
+            size=self.__scroll_size,
+            scroll=self.__scroll_keep_alive,
         )
         if self.__routing:
             query['routing'] = self.__routing
-        for chunk in chunks(scan(es, **query), 500):
-            ids = [item['_id'] for item in chunk]
-            self.delete_cards_by_id(ids)
+        ids_chunks = (
+            [item['_id'] for item in chunk]
+            for chunk in chunks(scan(es, **query), self.__bulk_chunk_size)
+        )
+        delete_chunk = functools.partial(self.__delete_by_id,
+                                         index=index, _type=doc_type,
+                                         refresh=False)
+        deleted = False
+        for _ in self.__map_bulk(delete_chunk, ids_chunks):
+            deleted = True
+        if deleted and self.__refresh == 'true':
+            es.indices.refresh(index=index)
+
+    def __delete_by_query(self, body, es, index, doc_type):
+        params = dict(conflicts='proceed', wait_for_completion='false')
+        if self._es_version >= (5, 1):
+            params['slices'] = self.__bulk_threads
+        if self.__routing:
+            params['routing'] = self.__routing
+        if self.__refresh in ['true', 'wait_for']:
+            # `wait_for` is not supported by `_delete_by_query`
+            params['refresh'] = 'true'
+        elif self.__refresh != 'none':
+            with self.__dirty_lock:
+                self.__dirty_indices.add((es, index))
+        path = '/{}/{}/_delete_by_query'.format(index, doc_type)
+        _, task = es.transport.perform_request('POST', path, params=params,
+                                               body=body)
+        response = self.__wait_for_task(es, task['task'])
+        failures = response.get('failures') or []
+        if failures:
+            raise IndexAPIError(
+                '{} documents of index {} could not be deleted by query, '
+                'first ones: {}'.format(len(failures), index, failures[:10])
+            )
+
+    def __wait_for_task(self, es, task_id):
+        """Poll the `_tasks` API until a task of the cluster is over
+
+        :return: response of the task
+        :raise IndexAPIError: if the task failed
+        """
+        path = '/_tasks/{}'.format(task_id)
+        while True:
+            try:
+                _, status = es.transport.perform_request('GET', path)
+            except ConnectionTimeout as e:
+                LOGGER.warning(
+                    'could not get status of task {}: {}'.format(task_id, e)
+                )
+            else:
+                if status.get('completed'):
+                    break
+            time.sleep(self.__task_poll_interval)
+        if status.get('error'):
+            raise IndexAPIError('task {} failed: {}'.format(
+                task_id, status['error']
+            ))
+        return status.get('response') or {}
 
     def delete_cards(self, query):
         return self.__delete_es_docs(
@@ -103,7 +420,7 @@ class ElasticsearchProcessor(IndexAPIProcessor):
     def delete_thumbnails(self, query):
         return self.__delete_es_docs(
             query,
-            self.__es_store,
+            self.__es,
             self.__es_store_index,
             self.__store_type
         )
@@ -112,76 +429,171 @@ class ElasticsearchProcessor(IndexAPIProcessor):
         return self.__delete_by_id(ids, self.__es_store_index,
                                    self.__store_type)
 
-    def __delete_by_id(self, ids, index, _type):
-        # pylint: disable=unexpected-keyword-arg
-        error_docs = []
-        body = [{
-            'delete': {
-                '_index': index,
-                '_type': _type,
-                '_id': _id
+    def __delete_by_id(self, ids, index, _type, refresh=True):
+        header = '{{"delete":{{"_index":{},"_type":{},"_id":'.format(
+            json.dumps(index), json.dumps(_type)
+        )
+        entries = [([header + json.dumps(_id) + '}}'], _id) for _id in ids]
+        if not any(entries):
+            return []
+        return [
+            {
+                'status': result['status'],
+                'id': _id,
             }
-        } for _id in ids]
+            for _id, _, result in self.__send_bulk(self.__es, index, entries,
+                                                   refresh)
+            if result['status'] != 200
+        ]
 
-        if not any(body):
-            return error_docs
+    def __send_bulk(self, es, index, entries, refresh=True):
+        """Send a bulk request, and resubmit the operations rejected by
+        an overloaded cluster, following the `elasticsearch_bulk`
+        high-availability configuration.
 
-        params = {
-            'body': body,
-            'refresh': True,
-        }
-        if self.__routing:
-            params['routing'] = self.__routing
+        :param list entries:
+          tuple `(lines, payload)` for every operation, where `lines`
+          is the list of serialized lines of the operation.
 
-        results = self.__es.bulk(**params)
-        for index, result in enumerate(results['items']):
-            if result['delete']['status'] is not 200:
-                error_docs.append({
-                    'status': result['delete']['status'],
-                    'id': ids[index],
-                })
-        return error_docs
+        :return:
+          tuple `(payload, operation, result)` for every operation
+        :rtype: list
+        """
+        results = []
+        delays = None
+        retries = 0
+        while True:
+            params = dict(body='\n'.join(
+                line for lines, _ in entries for line in lines
+            ) + '\n')
+            if self.__routing:
+                params['routing'] = self.__routing
+            response = self.__bulk(es, index, params, refresh)
+            rejected = []
+            # items of a bulk response follow the order of the request
+            for entry, item in zip(entries, response['items']):
+                operation, result = next(six.iteritems(item))
+                if result['status'] in ES_BULK_RETRY_STATUSES:
+                    rejected.append((entry, operation, result))
+                else:
+                    results.append((entry[1], operation, result))
+            config = self.ha_get_config(self.HA_BULK_CONFIG)
+            if not any(rejected) or (config.max_retries and
+                                     retries >= config.max_retries):
+                results.extend(
+                    (entry[1], operation, result)
+                    for entry, operation, result in rejected
+                )
+                return results
+            if delays is None:
+                delays = self.ha_get_delay_policy(self.HA_BULK_CONFIG)
+            delay = next(delays)
+            retries += 1
+            with self.__bulk_stats_lock:
+                self.bulk_stats.retries += 1
+                self.bulk_stats.retried_items += len(rejected)
+                self.bulk_stats.wait_time += delay
+            LOGGER.warning(
+                '{} bulk operations rejected by Elasticsearch, '
+                'resubmitting them in {} seconds'.format(len(rejected), delay)
+            )
+            time.sleep(delay)
+            entries = [entry for entry, _, _ in rejected]
 
     @classmethod
-    def _prepare_index_bulk_query(cls, docs, action):
-        body = []
-        errors = []
+    def _bulk_header(cls, index, doc_type):
+        """Build the serialized header of bulk index actions
+
+        :return: prefix of the action, to complete with the serialized
+          document identifier followed by `}}`.
+        """
+        return '{{"index":{{"_index":{},"_type":{},"_id":'.format(
+            json.dumps(index), json.dumps(doc_type)
+        )
+
+    @classmethod
+    def _iter_bulk_lines(cls, docs, header, serializer, errors):
+        """Serialize documents to index
+
+        :param docs: iterable of documents, consumed lazily
+        :param str header: value returned by :py:meth:`_bulk_header`
+        :param serializer: object serializing documents
+        :param list errors: where invalid documents are appended
+
+        :return: generator of tuple `(doc, action_line, doc_line)`
+        """
         for doc in docs:
-            if not isinstance(doc, (dict, Mapping)):
+            if not isinstance(doc, (dict, Mapping)) or doc.get('id') is None:
                 errors.append(doc)
-            else:
-                doc_id = doc.get('id')
-                if doc_id is None:
-                    errors.append(doc)
-                else:
-                    new_action = copy.deepcopy(action)
-                    new_action.values()[0].update(_id=doc['id'])
-                    body.append(new_action)
-                    body.append(doc)
-        return body, errors
+                continue
+            yield (
+                doc,
+                header + json.dumps(doc['id']) + '}}',
+                serializer.dumps(doc)
+            )
+
+    @classmethod
+    def _bulk_chunks(cls, lines, max_docs, max_bytes):
+        """Group serialized documents in bulk requests
+
+        :param lines:
+          iterable of tuple `(doc, action_line, doc_line)`, consumed lazily
+        :param int max_docs:
+          maximum number of documents per chunk
+        :param int max_bytes:
+          approximate maximum size of a chunk. A document bigger than this
+          limit is sent alone.
+
+        :return: generator of list of tuple `(lines, document)` where
+          lines are the serialized action and document.
+        """
+        chunk, size = [], 0
+        for doc, action_line, doc_line in lines:
+            doc_size = len(action_line) + len(doc_line) + 2
+            if any(chunk) and (len(chunk) >= max_docs or
+                               size + doc_size > max_bytes):
+                yield chunk
+                chunk, size = [], 0
+            chunk.append(([action_line, doc_line], doc))
+            size += doc_size
+        if any(chunk):
+            yield chunk
+
+    def __push_es_chunk(self, es, index, chunk, refresh=True):
+        return [
+            {
+                'card': doc,
+                'status': result['status'],
+                'id': doc['id'],
+                'error': result.get('error'),
+            }
+            for doc, _, result in self.__send_bulk(es, index, chunk, refresh)
+            if result['status'] not in [200, 201]
+        ]
 
     def __push_es_docs(self, docs, es, index, doc_type):
-        action = dict(index=dict(_index=index, _type=doc_type))
-        body, error_docs = self._prepare_index_bulk_query(docs, action)
-        if len(body) == 0:
+        error_docs = []
+        bulk_chunks = self._bulk_chunks(
+            self._iter_bulk_lines(
+                docs, self._bulk_header(index, doc_type),
+                es.transport.serializer, error_docs
+            ),
+            self.__bulk_chunk_size, self.__bulk_max_bytes
+        )
+        first = next(bulk_chunks, None)
+        if first is None:
             return error_docs
-        params = dict(body=body, refresh=True)
-        if self.__routing:
-            params['routing'] = self.__routing
-        results = es.bulk(**params)
-        if results['errors']:
-            for index, item in enumerate(results['items']):
-                for operation in ES_BULK_OPERATION:
-                    if operation in item:
-                        if item[operation]['status'] not in [200, 201]:
-                            error_docs.append({
-                                'card': docs[index],
-                                'status': item[operation]['status'],
-                                'id': docs[index]['id']
-                                if 'id' in docs[index] else None,
-                                'error': item[operation]['error'],
-                            })
-                            break
+        second = next(bulk_chunks, None)
+        if second is None:
+            return error_docs + self.__push_es_chunk(es, index, first)
+        # serialize next chunks while previous ones are being sent
+        push_chunk = functools.partial(self.__push_es_chunk, es, index,
+                                       refresh=False)
+        bulk_chunks = itertools.chain([first, second], bulk_chunks)
+        for chunk_errors in self.__map_bulk(push_chunk, bulk_chunks):
+            error_docs.extend(chunk_errors)
+        if self.__refresh == 'true':
+            es.indices.refresh(index=index)
         return error_docs
 
     def push_cards(self, cards):
@@ -194,7 +606,7 @@ class ElasticsearchProcessor(IndexAPIProcessor):
 
     def push_thumbnails(self, thumbnails):
         return self.__push_es_docs(
-            [
+            (
                 {
                     'id': t[0],
                     'content': {
@@ -202,8 +614,8 @@ class ElasticsearchProcessor(IndexAPIProcessor):
                         'mimetype': t[2]
                     }
                 }
-                for t in thumbnails],
-            self.__es_store,
+                for t in thumbnails),
+            self.__es,
             self.__es_store_index,
             self.__store_type
         )
@@ -0,0 +1,139 @@
+"""Elasticsearch client transport extensions
+
+- :py:class:`CompressedConnection` compresses request bodies with gzip
+- :py:class:`FastJSONSerializer` relies on faster JSON libraries
+  when available
+"""
+import datetime
+from decimal import Decimal
+import gzip
+import importlib
+import io
+import uuid
+
+from elasticsearch.connection import Urllib3HttpConnection
+from elasticsearch.exceptions import SerializationError
+from elasticsearch.serializer import JSONSerializer
+import six
+import urllib3
+
+__all__ = [
+    'CompressedConnection',
+    'FastJSONSerializer',
+]
+
+
+def gzip_compress(data, compresslevel=6):
+    if isinstance(data, six.text_type):
+        data = data.encode('utf-8')
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb',
+                       compresslevel=compresslevel) as ostr:
+        ostr.write(data)
+    return buf.getvalue()
+
+
+class _CompressedPool(object):
+    """Wrapper around a urllib3 connection pool compressing
+    request bodies"""
+    def __init__(self, pool, min_size, compresslevel):
+        self._pool = pool
+        self._min_size = min_size
+        self._compresslevel = compresslevel
+
+    def urlopen(self, method, url, body=None, headers=None, **kwargs):
+        if body is not None and len(body) >= self._min_size:
+            body = gzip_compress(body, self._compresslevel)
+            headers = dict(headers or {})
+            headers['content-encoding'] = 'gzip'
+        return self._pool.urlopen(method, url, body, headers=headers,
+                                  **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._pool, name)
+
+
+class CompressedConnection(Urllib3HttpConnection):
+    """Connection compressing with gzip request bodies bigger than
+    `compress_min_size` bytes, and accepting compressed responses.
+    """
+    def __init__(self, compress_min_size=1024, compress_level=6, **kwargs):
+        super(CompressedConnection, self).__init__(**kwargs)
+        self.headers.update(urllib3.make_headers(accept_encoding=True))
+        self.pool = _CompressedPool(self.pool, compress_min_size,
+                                    compress_level)
+
+
+class FastJSONSerializer(JSONSerializer):
+    """JSON serializer relying on a faster library than the standard
+    :py:mod:`json` module if available. Values that the library cannot
+    serialize are given to the standard module. Dates, decimals and UUIDs
+    are serialized like :py:class:`JSONSerializer` does, and the result
+    is always a unicode string.
+    """
+    LIBRARIES = ['orjson', 'ujson']
+
+    def __init__(self, library='auto'):
+        """
+        :param library:
+          either `auto` to use the first available library among
+          `LIBRARIES`, the name of the library to use, or `json`
+          for the standard library.
+        """
+        self.library = library
+        self._module = None
+        if library == 'auto':
+            for name in self.LIBRARIES:
+                try:
+                    self._module = importlib.import_module(name)
+                except ImportError:
+                    continue
+                self.library = name
+                break
+            else:
+                self.library = 'json'
+        elif library != 'json':
+            try:
+                self._module = importlib.import_module(library)
+            except ImportError:
+                raise Exception(
+                    "Unknown JSON library: '{}'".format(library)
+                )
+
+    def loads(self, s):
+        if self._module is None:
+            return super(FastJSONSerializer, self).loads(s)
+        try:
+            return self._module.loads(s)
+        except ValueError as e:
+            raise SerializationError(s, e)
+
+    def dumps(self, data):
+        if self._module is None or isinstance(data, six.string_types):
+            return super(FastJSONSerializer, self).dumps(data)
+        try:
+            if self.library == 'ujson':
+                # ujson would serialize dates as timestamps
+                result = self._module.dumps(self._encodable(data),
+                                            ensure_ascii=False)
+            else:
+                result = self._module.dumps(data, default=self.default)
+        except (TypeError, ValueError, OverflowError):
+            return super(FastJSONSerializer, self).dumps(data)
+        if isinstance(result, bytes):
+            result = result.decode('utf-8')
+        return result
+
+    def _encodable(self, data):
+        """Replace values serialized by :py:meth:`default` in the
+        standard module by their serialized form"""
+        if isinstance(data, dict):
+            return dict(
+                (key, self._encodable(value))
+                for key, value in six.iteritems(data)
+            )
+        if isinstance(data, (list, tuple)):
+            return [self._encodable(value) for value in data]
+        if isinstance(data, (datetime.date, Decimal, uuid.UUID)):
+            return self.default(data)
+        return data
@@ -0,0 +1,374 @@
+"""In-process evaluation of a subset of the Elasticsearch Query DSL
+
+Supported queries are `match_all`, `term`, `terms`, `range`, `prefix`,
+`ids`, and `bool`. Documents are Python dicts, and nested fields are
+specified with dots, for instance `author.name`.
+
+Evaluation may rely on :py:class:`FieldIndexes` to avoid scanning every
+document.
+"""
+import bisect
+from collections import Mapping
+
+import six
+
+from .errors import IndexAPIError
+
+__all__ = [
+    'FieldIndex',
+    'FieldIndexes',
+    'compile_query',
+    'select',
+]
+
+UNICODE_MAX = u'\uffff'
+
+
+def field_values(doc, field):
+    """Retrieve values of a document field
+
+    :param dict doc: document
+    :param basestring field: dotted path of the field
+
+    :return: list of values. Lists are flattened, so that a field matches
+      if any of its elements match, like in Elasticsearch.
+    """
+    if field == '_id':
+        field = 'id'
+    values = [doc]
+    for name in field.split('.'):
+        next_values = []
+        for value in values:
+            if isinstance(value, Mapping) and name in value:
+                value = value[name]
+                if isinstance(value, (list, tuple)):
+                    next_values.extend(value)
+                else:
+                    next_values.append(value)
+        values = next_values
+    return [v for v in values if v is not None]
+
+
+class FieldIndex(object):
+    """Map the values of a document field to document identifiers"""
+    def __init__(self, field):
+        self.field = field
+        self.__ids = dict()
+        self.__keys = None
+
+    def add(self, _id, doc):
+        for value in self.__values(doc):
+            ids = self.__ids.get(value)
+            if ids is None:
+                ids = self.__ids[value] = set()
+                self.__keys = None
+            ids.add(_id)
+
+    def remove(self, _id, doc):
+        for value in self.__values(doc):
+            ids = self.__ids.get(value)
+            if ids is not None:
+                ids.discard(_id)
+                if not ids:
+                    del self.__ids[value]
+                    self.__keys = None
+
+    def clear(self):
+        self.__ids.clear()
+        self.__keys = None
+
+    def get(self, value):
+        """:return: identifiers of documents having the given value"""
+        return set(self.__ids.get(value, ()))
+
+    def range(self, gt=None, gte=None, lt=None, lte=None):
+        """:return: identifiers of documents having a value in range"""
+        keys = self.__sorted_keys()
+        start, end = 0, len(keys)
+        if gte is not None:
+            start = max(start, bisect.bisect_left(keys, gte))
+        if gt is not None:
+            start = max(start, bisect.bisect_right(keys, gt))
+        if lte is not None:
+            end = min(end, bisect.bisect_right(keys, lte))
+        if lt is not None:
+            end = min(end, bisect.bisect_left(keys, lt))
+        return self.__union(keys[start:end])
+
+    def prefix(self, prefix):
+        """:return: identifiers of documents having a string value
+        starting with `prefix`"""
+        keys = self.__sorted_keys()
+        start = bisect.bisect_left(keys, prefix)
+        end = bisect.bisect_right(keys, prefix + UNICODE_MAX)
+        return self.__union(
+            key for key in keys[start:end]
+            if isinstance(key, six.string_types) and key.startswith(prefix)
+        )
+
+    def __union(self, keys):
+        ids = set()
+        for key in keys:
+            ids.update(self.__ids[key])
+        return ids
+
+    def __sorted_keys(self):
+        if self.__keys is None:
+            self.__keys = sorted(self.__ids)
+        return self.__keys
+
+    def __values(self, doc):
+        for value in field_values(doc, self.field):
+            if not isinstance(value, (Mapping, list)):
+                # only scalar values are indexed
+                yield value
+
+
+class FieldIndexes(dict):
+    """Secondary indexes of a collection of documents, by field name"""
+    def __init__(self, fields=None):
+        super(FieldIndexes, self).__init__(
+            (field, FieldIndex(field)) for field in fields or []
+        )
+
+    def add(self, _id, doc):
+        for index in self.itervalues():
+            index.add(_id, doc)
+
+    def remove(self, _id, doc):
+        for index in self.itervalues():
+            index.remove(_id, doc)
+
+    def clear_all(self):
+        for index in self.itervalues():
+            index.clear()
+
+
+class MatchAllQuery(object):
+    def __init__(self, params=None):
+        pass
+
+    def match(self, doc):
+        return True
+
+    def candidates(self, indexes):
+        """
+        :param FieldIndexes indexes: secondary indexes
+        :return: identifiers of documents that may match the query, or `None`
+          if every document must be evaluated.
+        """
+        return None
+
+
+class FieldQuery(MatchAllQuery):
+    """Base class of queries on a single field. Documents match if
+    one of their field values matches :py:meth:`match_value`, by default
+    if it is equal to the query value. Subclasses override
+    :py:meth:`match_value` and :py:meth:`index_candidates` together.
+    """
+    PARAMETERS = ['boost', '_name']
+
+    def __init__(self, params):
+        fields = [k for k in params if k not in self.PARAMETERS]
+        if len(fields) != 1:
+            raise IndexAPIError(
+                'expected exactly one field in query: {!r}'.format(params)
+            )
+        self.field = fields[0]
+        self.value = params[self.field]
+        if self.field == '_id':
+            self.field = 'id'
+
+    def match(self, doc):
+        return any(self.match_value(v) for v in field_values(doc, self.field))
+
+    def candidates(self, indexes):
+        index = indexes.get(self.field)
+        if index is not None:
+            return self.index_candidates(index)
+
+    def match_value(self, value):
+        return value == self.value
+
+    def index_candidates(self, index):
+        """
+        :param FieldIndex index: secondary index of the queried field
+        :return: identifiers of documents that may match the query
+        """
+        return index.get(self.value)
+
+
+class TermQuery(FieldQuery):
+    def __init__(self, params):
+        super(TermQuery, self).__init__(params)
+        if isinstance(self.value, Mapping):
+            self.value = self.value['value']
+
+
+class TermsQuery(FieldQuery):
+    def __init__(self, params):
+        super(TermsQuery, self).__init__(params)
+        if not isinstance(self.value, (list, tuple)):
+            raise IndexAPIError(
+                "'terms' query expects a list of values: {!r}".format(params)
+            )
+
+    def match_value(self, value):
+        return value in self.value
+
+    def index_candidates(self, index):
+        ids = set()
+        for value in self.value:
+            ids.update(index.get(value))
+        return ids
+
+
+class RangeQuery(FieldQuery):
+    OPERATORS = ['gt', 'gte', 'lt', 'lte']
+
+    def __init__(self, params):
+        super(RangeQuery, self).__init__(params)
+        self.value = dict(
+            (k, v) for k, v in self.value.iteritems() if k in self.OPERATORS
+        )
+
+    def match_value(self, value):
+        bounds = self.value
+        return (
+            ('gt' not in bounds or value > bounds['gt']) and
+            ('gte' not in bounds or value >= bounds['gte']) and
+            ('lt' not in bounds or value < bounds['lt']) and
+            ('lte' not in bounds or value <= bounds['lte'])
+        )
+
+    def index_candidates(self, index):
+        return index.range(**self.value)
+
+
+class PrefixQuery(TermQuery):
+    def match_value(self, value):
+        return isinstance(value, six.string_types) \
+            and value.startswith(self.value)
+
+    def index_candidates(self, index):
+        return index.prefix(self.value)
+
+
+class IdsQuery(MatchAllQuery):
+    def __init__(self, params):
+        values = params.get('values', [])
+        self.values = set(values)
+        self.values.update(six.text_type(v) for v in values)
+
+    def match(self, doc):
+        _id = doc.get('id')
+        return _id in self.values or six.text_type(_id) in self.values
+
+    def candidates(self, indexes):
+        return set(self.values)
+
+
+class BoolQuery(MatchAllQuery):
+    CLAUSES = ['must', 'filter', 'should', 'must_not']
+
+    def __init__(self, params):
+        for clause in self.CLAUSES:
+            queries = params.get(clause) or []
+            if isinstance(queries, Mapping):
+                queries = [queries]
+            setattr(self, clause, [compile_query(q) for q in queries])
+        default = 0 if self.must or self.filter else 1
+        self.minimum_should_match = min(
+            int(params.get('minimum_should_match', default)),
+            len(self.should)
+        )
+
+    def match(self, doc):
+        if not all(q.match(doc) for q in self.must + self.filter):
+            return False
+        if any(q.match(doc) for q in self.must_not):
+            return False
+        if self.minimum_should_match > 0:
+            matches = sum(1 for q in self.should if q.match(doc))
+            return matches >= self.minimum_should_match
+        return True
+
+    def candidates(self, indexes):
+        ids = None
+        for query in self.must + self.filter:
+            query_ids = query.candidates(indexes)
+            if query_ids is not None:
+                ids = query_ids if ids is None else ids & query_ids
+        if ids is None and self.minimum_should_match > 0:
+            ids = set()
+            for query in self.should:
+                query_ids = query.candidates(indexes)
+                if query_ids is None:
+                    return None
+                ids.update(query_ids)
+        return ids
+
+
+QUERIES = {
+    'bool': BoolQuery,
+    'ids': IdsQuery,
+    'match_all': MatchAllQuery,
+    'prefix': PrefixQuery,
+    'range': RangeQuery,
+    'term': TermQuery,
+    'terms': TermsQuery,
+}
+
+
+def compile_query(query):
+    """Build an object evaluating a query
+
+    :param dict query:
+      query clause, for instance `{'term': {'kind': 'email'}}`.
+      `None` matches every document.
+
+    :return: object providing `match(doc)` and `candidates(indexes)`
+      member methods
+    :raise IndexAPIError: if query is not supported
+    """
+    if query is None:
+        return MatchAllQuery()
+    if not isinstance(query, Mapping) or len(query) != 1:
+        raise IndexAPIError('invalid query: {!r}'.format(query))
+    kind, params = next(six.iteritems(query))
+    if kind not in QUERIES:
+        raise IndexAPIError(
+            "unsupported query '{}', supported queries are: {}".format(
+                kind, ', '.join(sorted(QUERIES))
+            )
+        )
+    if not isinstance(params, Mapping):
+        raise IndexAPIError('invalid query: {!r}'.format(query))
+    return QUERIES[kind](params)
+
+
+def select(docs, query, indexes=None, document=None):
+    """Select documents matching a query
+
+    :param dict docs: documents by identifier
+    :param query: query clause, or object returned by :py:func:`compile_query`
+    :param FieldIndexes indexes: secondary indexes of `docs`
+    :param callable document:
+      given an identifier and a value of `docs`, returns the document
+      to evaluate. Default is the value itself.
+
+    :return: list of tuple `(id, value)`
+    """
+    if not isinstance(query, MatchAllQuery):
+        query = compile_query(query)
+    candidates = query.candidates(indexes or {})
+    if candidates is None:
+        items = docs.iteritems()
+    else:
+        items = ((_id, docs[_id]) for _id in candidates if _id in docs)
+    if document is None:
+        return [(_id, value) for _id, value in items if query.match(value)]
+    return [
+        (_id, value) for _id, value in items
+        if query.match(document(_id, value))
+    ]
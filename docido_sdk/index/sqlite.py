@@ -0,0 +1,380 @@
+"""Local index and key-value store backed by SQLite databases
+
+Unlike :py:class:`docido_sdk.index.test.LocalDumbIndexProcessor` and
+:py:class:`docido_sdk.index.test.LocalKVProcessor`, data is not loaded
+in memory, which allows replaying crawls of large accounts.
+"""
+from contextlib import contextmanager
+import json
+import os.path as osp
+import sqlite3
+import sys
+import tempfile
+import threading
+
+import six
+
+from docido_sdk.core import (
+    Component,
+    implements,
+)
+from docido_sdk.toolbox.collections_ext import chunks
+from docido_sdk.toolbox.decorators import reraise
+from .api import (
+    IndexAPIProcessor,
+    IndexAPIProvider,
+)
+from .errors import IndexAPIError
+from .test import (
+    ALLOWED_CHECKPOINT_VALUE_TYPES,
+    CustomJSONEncoder,
+)
+
+__all__ = [
+    'SQLiteIndex',
+    'SQLiteKV',
+]
+
+reraise = reraise(IndexAPIError)
+MATCH_ALL_QUERY = {'query': {'match_all': {}}}
+
+
+class SQLiteDatabase(object):
+    """Thread-safe SQLite connection"""
+    def __init__(self, path, schema, cache_size=None):
+        """
+        :param path: path to the database file
+        :param list schema: SQL statements creating the tables
+        :param cache_size: maximum number of KiB used by the page cache
+        """
+        self.path = path
+        self.__lock = threading.Lock()
+        self.__connection = sqlite3.connect(path, timeout=30,
+                                            check_same_thread=False)
+        with self.transaction() as cursor:
+            cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.execute('PRAGMA synchronous=NORMAL')
+            if cache_size is not None:
+                cursor.execute('PRAGMA cache_size=-{:d}'.format(cache_size))
+            for statement in schema:
+                cursor.execute(statement)
+
+    @contextmanager
+    def transaction(self):
+        """Provide a cursor. Statements executed in the context are
+        committed at once when it exits, or rolled back if an exception
+        is raised.
+        """
+        with self.__lock:
+            cursor = self.__connection.cursor()
+            try:
+                yield cursor
+            except:
+                self.__connection.rollback()
+                raise
+            else:
+                self.__connection.commit()
+
+    def close(self):
+        with self.__lock:
+            self.__connection.close()
+
+
+def _database_path(config, section, filename):
+    storage = config.get('local_storage', {}).get(section, {})
+    path = storage.get('path')
+    if path is None:
+        path = tempfile.mkdtemp(prefix='docido-local-storage-' + section)
+    return osp.join(path, filename), storage.get('cache_size')
+
+
+class SQLiteKVProcessor(IndexAPIProcessor):
+    """Persistent key-value store in a `kv.sqlite` database, written in the
+    directory given by the `local_storage.kv.path` configuration key.
+    `local_storage.kv.cache_size` optionally limits the amount of memory
+    used by SQLite, in KiB.
+    """
+    SCHEMA = [
+        'CREATE TABLE IF NOT EXISTS kv '
+        '(key TEXT PRIMARY KEY, type TEXT NOT NULL, value)',
+    ]
+    VALUE_TYPES = dict(
+        (_type.__name__, _type)
+        for _type in [str, unicode, int, long, float]
+    )
+
+    def __init__(self, **config):
+        super(SQLiteKVProcessor, self).__init__(**config)
+        path, cache_size = _database_path(config, 'kv', 'kv.sqlite')
+        self.__db = SQLiteDatabase(path, self.SCHEMA, cache_size)
+
+    @reraise
+    def get_kv(self, key):
+        assert isinstance(key, six.string_types)
+        with self.__db.transaction() as cursor:
+            cursor.execute('SELECT type, value FROM kv WHERE key = ?', (key,))
+            row = cursor.fetchone()
+        if row is not None:
+            return self.__decode(*row)
+
+    @reraise
+    def get_kvs(self):
+        with self.__db.transaction() as cursor:
+            cursor.execute('SELECT key, type, value FROM kv')
+            return dict(
+                (key, self.__decode(_type, value))
+                for key, _type, value in cursor
+            )
+
+    @reraise
+    def set_kv(self, key, value):
+        assert isinstance(key, six.string_types)
+        assert isinstance(value, ALLOWED_CHECKPOINT_VALUE_TYPES)
+        with self.__db.transaction() as cursor:
+            cursor.execute(
+                'INSERT OR REPLACE INTO kv (key, type, value) '
+                'VALUES (?, ?, ?)',
+                (key, type(value).__name__, self.__encode(value))
+            )
+
+    @reraise
+    def delete_kv(self, key):
+        assert isinstance(key, six.string_types)
+        with self.__db.transaction() as cursor:
+            cursor.execute('DELETE FROM kv WHERE key = ?', (key,))
+
+    @reraise
+    def delete_kvs(self):
+        with self.__db.transaction() as cursor:
+            cursor.execute('DELETE FROM kv')
+
+    @classmethod
+    def __encode(cls, value):
+        if isinstance(value, str):
+            # arbitrary bytes are stored as BLOB
+            return sqlite3.Binary(value)
+        return value
+
+    @classmethod
+    def __decode(cls, _type, value):
+        _type = cls.VALUE_TYPES[_type]
+        if _type is str:
+            return str(value)
+        return _type(value)
+
+
+class SQLiteKV(Component):
+    implements(IndexAPIProvider)
+
+    def get_index_api(self, **config):
+        return SQLiteKVProcessor(**config)
+
+
+class SQLiteIndexProcessor(IndexAPIProcessor):
+    """Index persisted in a `documents.sqlite` database, written in the
+    directory given by the `local_storage.documents.path` configuration key.
+
+    Writes are batched in a single transaction per call. `search_cards`
+    reads cards by pages of `PAGE_SIZE` cards, so memory usage does not
+    depend on the size of the index. `local_storage.documents.cache_size`
+    optionally limits the amount of memory used by SQLite, in KiB.
+
+    Supported queries are `match_all`, and `ids`, for instance
+    `{'query': {'ids': {'values': ['id1', 'id2']}}}`. A `fields` list
+    restricts the fields returned by `search_cards`. Like other indexes,
+    `delete_cards` requires a query, even to delete all cards.
+
+    Identifiers are stored as text, so that `1` and `'1'` refer to
+    the same card. Cards without identifier are returned as errors
+    by `push_cards`, the other cards of the batch are still written.
+    """
+    SCHEMA = [
+        'CREATE TABLE IF NOT EXISTS cards '
+        '(id TEXT PRIMARY KEY, data TEXT NOT NULL)',
+        'CREATE TABLE IF NOT EXISTS thumbnails '
+        '(id TEXT PRIMARY KEY, payload BLOB, mime TEXT)',
+    ]
+    BATCH_SIZE = 500
+    PAGE_SIZE = 500
+
+    def __init__(self, **config):
+        super(SQLiteIndexProcessor, self).__init__(**config)
+        path, cache_size = _database_path(config, 'documents',
+                                          'documents.sqlite')
+        self.__db = SQLiteDatabase(path, self.SCHEMA, cache_size)
+
+    @reraise
+    def push_cards(self, cards):
+        errors = []
+        with self.__db.transaction() as cursor:
+            for batch in chunks(iter(cards), self.BATCH_SIZE):
+                rows = []
+                for card in batch:
+                    _id = card.get('id') if isinstance(card, dict) else None
+                    if _id is None:
+                        errors.append({'status': 400, 'id': None,
+                                       'error': "missing 'id' field"})
+                        continue
+                    rows.append((
+                        six.text_type(_id),
+                        json.dumps(card, cls=CustomJSONEncoder)
+                    ))
+                cursor.executemany(
+                    'INSERT OR REPLACE INTO cards (id, data) VALUES (?, ?)',
+                    rows
+                )
+        return errors
+
+    @reraise
+    def delete_cards(self, query=None):
+        if not isinstance(query, dict) or 'query' not in query:
+            raise IndexAPIError('a query is required to delete documents')
+        ids = self.__query_ids(query)
+        if ids is None:
+            with self.__db.transaction() as cursor:
+                cursor.execute('DELETE FROM cards')
+        else:
+            self.__delete_by_id('cards', ids)
+
+    @reraise
+    def delete_cards_by_id(self, ids):
+        return self.__delete_by_id('cards', ids)
+
+    @reraise
+    def search_cards(self, query=None):
+        ids = self.__query_ids(query)
+        fields = (query or {}).get('fields')
+        if ids is None:
+            cards = self.__iter_cards()
+        else:
+            cards = self.__iter_cards_by_id(ids)
+        if fields is not None:
+            cards = (
+                dict((k, card[k]) for k in fields if k in card)
+                for card in cards
+            )
+        return self.__reraise_iter(cards)
+
+    @reraise
+    def push_thumbnails(self, thumbnails):
+        with self.__db.transaction() as cursor:
+            for batch in chunks(iter(thumbnails), self.BATCH_SIZE):
+                cursor.executemany(
+                    'INSERT OR REPLACE INTO thumbnails (id, payload, mime) '
+                    'VALUES (?, ?, ?)',
+                    [
+                        (six.text_type(id_), sqlite3.Binary(payload), mime)
+                        for id_, payload, mime in batch
+                    ]
+                )
+        return []
+
+    @reraise
+    def delete_thumbnails(self, query=None):
+        if query != MATCH_ALL_QUERY:
+            raise IndexAPIError(
+                'only match_all query is supported to delete thumbnails'
+            )
+        with self.__db.transaction() as cursor:
+            cursor.execute('DELETE FROM thumbnails')
+
+    @reraise
+    def delete_thumbnails_by_id(self, ids):
+        return self.__delete_by_id('thumbnails', ids)
+
+    def get_thumbnail(self, _id):
+        """Retrieve a thumbnail
+
+        :return: tuple `(payload, mime)` or `None` if thumbnail does not
+          exist
+        """
+        with self.__db.transaction() as cursor:
+            cursor.execute(
+                'SELECT payload, mime FROM thumbnails WHERE id = ?',
+                (six.text_type(_id),)
+            )
+            row = cursor.fetchone()
+        if row is not None:
+            return str(row[0]), row[1]
+
+    def __delete_by_id(self, table, ids):
+        errors = []
+        statement = 'DELETE FROM {} WHERE id = ?'.format(table)
+        with self.__db.transaction() as cursor:
+            for _id in ids:
+                cursor.execute(statement, (six.text_type(_id),))
+                if cursor.rowcount == 0:
+                    errors.append({'status': 404, 'id': _id})
+        return errors
+
+    def __iter_cards(self):
+        # pages are delimited by identifier rather than rowid, because
+        # INSERT OR REPLACE gives a new rowid to the cards pushed again
+        _id = None
+        while True:
+            with self.__db.transaction() as cursor:
+                if _id is None:
+                    cursor.execute(
+                        'SELECT id, data FROM cards ORDER BY id LIMIT ?',
+                        (self.PAGE_SIZE,)
+                    )
+                else:
+                    cursor.execute(
+                        'SELECT id, data FROM cards WHERE id > ? '
+                        'ORDER BY id LIMIT ?',
+                        (_id, self.PAGE_SIZE)
+                    )
+                rows = cursor.fetchall()
+            for _id, data in rows:
+                yield json.loads(data)
+            if len(rows) < self.PAGE_SIZE:
+                break
+
+    def __iter_cards_by_id(self, ids):
+        for batch in chunks(iter(ids), self.PAGE_SIZE):
+            with self.__db.transaction() as cursor:
+                cursor.execute(
+                    'SELECT data FROM cards WHERE id IN ({})'.format(
+                        ', '.join('?' * len(batch))
+                    ),
+                    batch
+                )
+                rows = cursor.fetchall()
+            for row in rows:
+                yield json.loads(row[0])
+
+    @classmethod
+    def __reraise_iter(cls, iterable):
+        """Raise :py:class:`IndexAPIError` when iteration fails, as
+        `reraise` only covers the creation of the generator.
+        """
+        try:
+            for item in iterable:
+                yield item
+        except Exception as e:
+            raise IndexAPIError(e), None, sys.exc_info()[2]
+
+    @classmethod
+    def __query_ids(cls, query):
+        """
+        :return: identifiers given by an `ids` query, `None` if query
+          matches all cards
+        """
+        query = (query or {}).get('query')
+        if query is None or query == MATCH_ALL_QUERY['query']:
+            return None
+        if query.keys() == ['ids']:
+            return [
+                six.text_type(_id) for _id in query['ids'].get('values', [])
+            ]
+        raise IndexAPIError(
+            'only match_all and ids queries are currently supported, '
+            'you should use the ElasticSearch processor instead'
+        )
+
+
+class SQLiteIndex(Component):
+    implements(IndexAPIProvider)
+
+    def get_index_api(self, **config):
+        return SQLiteIndexProcessor(**config)
@@ -1,10 +1,16 @@
 
 import copy
 from contextlib import contextmanager
+import hashlib
 import json
+import logging
+import mmap
+import os
 import os.path as osp
+import re
 import shutil
 import tempfile
+import threading
 
 import six
 
@@ -12,16 +18,23 @@ from docido_sdk.core import (
     Component,
     implements,
 )
+from docido_sdk.toolbox.storage_ext import JSONLinesFile
 from docido_sdk.toolbox.threading_ext import RWLock
 from .api import (
     IndexAPIProcessor,
     IndexAPIProvider,
 )
 from .errors import IndexAPIError
+from .query import (
+    FieldIndexes,
+    compile_query,
+    select,
+)
 from docido_sdk.toolbox.decorators import reraise
 from docido_sdk.toolbox.http_ext import delayed_request
 
 
+LOGGER = logging.getLogger(__name__)
 reraise = reraise(IndexAPIError)
 ALLOWED_CHECKPOINT_VALUE_TYPES = six.string_types + (int, long, float)
 
@@ -36,7 +49,33 @@ class CustomJSONEncoder(json.JSONEncoder):
 class LocalKVProcessor(IndexAPIProcessor):
     """Local thread-safe, `IndexAPIProcessor` persistent storage
     implementation backed by a json file on the local filesystem.
+
+    Configuration is read from the `local_storage.kv` section:
+
+    - `path`: directory where the `kv.yaml` file is written
+    - `write_behind`: if `False` (default), the file is rewritten before
+      every `set_kv`, `delete_kv`, and `delete_kvs` call returns.
+      Otherwise changes are only written when one of the following
+      occurs:
+
+      - `flush_max_changes` changes are pending (default is 100)
+      - `flush_interval` seconds elapsed since the first pending change
+        (default is 5)
+      - a task or the crawl terminates
+      - :py:meth:`flush` is called
+
+    - `fsync`: whether the file is synced to disk when written.
+      Default is `False`.
+
+    Durability: without `write_behind`, a change is persisted when the
+    call returns, but may still be lost if the machine crashes unless
+    `fsync` is enabled. With `write_behind`, changes made after the last
+    flush are lost if the process dies. Either way, the file is replaced
+    atomically, so it is never partially written.
     """
+    process_safe = False
+    DEFAULT_FLUSH_INTERVAL = 5
+    DEFAULT_FLUSH_MAX_CHANGES = 100
 
     __lock = RWLock()
     __store = dict()
@@ -53,10 +92,21 @@ class LocalKVProcessor(IndexAPIProcessor):
             path = tempfile.mkdtemp(prefix='docido-local-storage-kv')
         path = osp.join(path, 'kv.yaml')
         self.__path = path
+        self.__write_behind = kv_storage.get('write_behind', False)
+        self.__flush_interval = kv_storage.get('flush_interval',
+                                               self.DEFAULT_FLUSH_INTERVAL)
+        self.__flush_max_changes = kv_storage.get(
+            'flush_max_changes', self.DEFAULT_FLUSH_MAX_CHANGES
+        )
+        self.__fsync = kv_storage.get('fsync', False)
+        self.__changes = 0
+        self.__timer = None
         with self.__lock.write():
             if osp.exists(path):
                 with open(path) as istr:
                     self.__store = json.load(istr)
+            else:
+                self.__store = dict()
 
     @reraise
     def get_kv(self, key):
@@ -75,24 +125,58 @@ class LocalKVProcessor(IndexAPIProcessor):
         assert isinstance(value, ALLOWED_CHECKPOINT_VALUE_TYPES)
         with self.__lock.write():
             self.__store[key] = value
-            self.__persist()
+            self.__changed()
 
     @reraise
     def delete_kv(self, key):
         assert isinstance(key, six.string_types)
         with self.__lock.write():
             self.__store.pop(key, None)
-            self.__persist()
+            self.__changed()
 
     @reraise
     def delete_kvs(self):
         with self.__lock.write():
             self.__store.clear()
+            self.__changed()
+
+    def flush(self):
+        """Write pending changes, if any"""
+        with self.__lock.write():
+            self.__flush()
+
+    def task_terminated(self):
+        self.flush()
+        return super(LocalKVProcessor, self).task_terminated()
+
+    def crawl_terminated(self):
+        self.flush()
+        return super(LocalKVProcessor, self).crawl_terminated()
+
+    def __changed(self):
+        self.__changes += 1
+        if not self.__write_behind \
+                or self.__changes >= self.__flush_max_changes:
+            self.__flush()
+        elif self.__timer is None and self.__flush_interval is not None:
+            self.__timer = threading.Timer(self.__flush_interval, self.flush)
+            self.__timer.daemon = True
+            self.__timer.start()
+
+    def __flush(self):
+        if self.__timer is not None:
+            self.__timer.cancel()
+            self.__timer = None
+        if self.__changes > 0:
             self.__persist()
+            self.__changes = 0
 
     def __persist(self):
         with open(self.__path + '.new', 'w') as ostr:
             json.dump(self.__store, ostr, indent=2, cls=CustomJSONEncoder)
+            if self.__fsync:
+                ostr.flush()
+                os.fsync(ostr.fileno())
         shutil.move(self.__path + '.new', self.__path)
 
 
@@ -103,14 +187,214 @@ class LocalKV(Component):
         return LocalKVProcessor(**config)
 
 
+class IndexLog(object):
+    """Append-only log of the mutations of a local index.
+
+    Every mutation is appended as a JSON line to `<path>.log`. The log is
+    compacted into the `<path>` snapshot file when it grows bigger than
+    `max_bytes`, in a background thread, or when :py:meth:`compact`
+    is called. Mutations appended in the meantime are written in a new log.
+
+    Log entries are absolute, so replaying twice the same entries
+    is harmless if the process dies while compacting. Only one process
+    should write a log at a time.
+    """
+    DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+
+    __file_lock = threading.Lock()
+    __compaction_lock = threading.Lock()
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.log_path = path + '.log'
+        self.compacting_path = path + '.compacting'
+        self.max_bytes = max_bytes
+        self.__log = JSONLinesFile(self.log_path, CustomJSONEncoder)
+        self.__bytes = 0
+        self.__compaction = None
+
+    def load(self):
+        """Load snapshot and replay logged mutations
+
+        :rtype: dict
+        """
+        index = LocalDumbIndexProcessor.load_index(self.path)
+        self.replay(index, self.compacting_path)
+        self.replay(index, self.log_path)
+        if osp.exists(self.log_path):
+            self.__bytes = osp.getsize(self.log_path)
+        return index
+
+    @classmethod
+    def replay(cls, index, path):
+        for entry in JSONLinesFile(path):
+            operation = entry[0]
+            if operation == 'set':
+                index.update(entry[1])
+            elif operation == 'delete':
+                for key in entry[1]:
+                    index.pop(key, None)
+            elif operation == 'clear':
+                index.clear()
+        return index
+
+    def append(self, entries):
+        """Log mutations
+
+        :param list entries: list of entries, which can be:
+
+          - `['set', [[key, value], ...]]`
+          - `['delete', [key, ...]]`
+          - `['clear']`
+        """
+        with self.__file_lock:
+            self.__bytes += self.__log.append(entries)
+            must_compact = self.max_bytes is not None \
+                and self.__bytes >= self.max_bytes
+        if must_compact:
+            self.compact_in_background()
+
+    def compact(self):
+        """Merge logged mutations into the snapshot file"""
+        with self.__compaction_lock:
+            with self.__file_lock:
+                if osp.exists(self.log_path) \
+                        and not osp.exists(self.compacting_path):
+                    os.rename(self.log_path, self.compacting_path)
+                    self.__bytes = 0
+            if not osp.exists(self.compacting_path):
+                return
+            index = LocalDumbIndexProcessor.load_index(self.path)
+            self.replay(index, self.compacting_path)
+            LocalDumbIndexProcessor.persist_index(index, self.path)
+            os.remove(self.compacting_path)
+
+    def compact_in_background(self):
+        with self.__file_lock:
+            if self.__compaction is not None \
+                    and self.__compaction.is_alive():
+                return
+            self.__compaction = threading.Thread(target=self.__compact)
+            self.__compaction.daemon = True
+            self.__compaction.start()
+
+    def wait(self):
+        """Wait for the background compaction to terminate, if any"""
+        compaction = self.__compaction
+        if compaction is not None:
+            compaction.join()
+
+    def __compact(self):
+        try:
+            self.compact()
+        except Exception:
+            LOGGER.exception('could not compact index log %s', self.log_path)
+
+
+class BlobStore(object):
+    """Content-addressed storage of binary payloads, written in files
+    named after the SHA-1 digest of their content. Identical payloads
+    are therefore stored once.
+    """
+    DIGEST_RE = re.compile('^[0-9a-f]{40}$')
+
+    def __init__(self, path):
+        self.path = path
+
+    def put(self, payload):
+        """Store a payload
+
+        :return: payload digest
+        :rtype: string
+        """
+        if isinstance(payload, six.text_type):
+            payload = payload.encode('utf-8')
+        digest = hashlib.sha1(payload).hexdigest()
+        path = self.__blob_path(digest)
+        if not osp.exists(path):
+            if not osp.isdir(osp.dirname(path)):
+                try:
+                    os.makedirs(osp.dirname(path))
+                except OSError:
+                    # directory created concurrently
+                    if not osp.isdir(osp.dirname(path)):
+                        raise
+            fd, tmp_path = tempfile.mkstemp(dir=osp.dirname(path))
+            with os.fdopen(fd, 'wb') as ostr:
+                ostr.write(payload)
+            os.rename(tmp_path, path)
+        return digest
+
+    def get(self, digest):
+        """Memory-map a payload
+
+        :return: a read-only :py:class:`mmap.mmap` instance, or an empty
+          string if the payload is empty.
+        """
+        with open(self.__blob_path(digest), 'rb') as istr:
+            if os.fstat(istr.fileno()).st_size == 0:
+                return ''
+            return mmap.mmap(istr.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @classmethod
+    def is_digest(cls, value):
+        return isinstance(value, six.string_types) \
+            and cls.DIGEST_RE.match(value) is not None
+
+    def exists(self, digest):
+        return self.is_digest(digest) \
+            and osp.exists(self.__blob_path(digest))
+
+    def collect(self, digests):
+        """Remove payloads whose digest is not in `digests`
+
+        :return: number of removed payloads
+        """
+        removed = 0
+        if not osp.isdir(self.path):
+            return removed
+        for directory in os.listdir(self.path):
+            directory = osp.join(self.path, directory)
+            for digest in os.listdir(directory):
+                if digest not in digests:
+                    os.remove(osp.join(directory, digest))
+                    removed += 1
+        return removed
+
+    def __blob_path(self, digest):
+        return osp.join(self.path, digest[:2], digest)
+
+
 class LocalDumbIndexProcessor(IndexAPIProcessor):
     """Dumb, but yet reentrant, index implementation, persisting indices
     in local-filesystem.
 
-    Some methods does not provide all functionalities the real Docido index
-    provides. More information available in documentation of the following
-    member methods: `delete_cards`, `search_cards`, and `delete_thumbnails`.
+    Queries given to `search_cards`, `delete_cards`, and `delete_thumbnails`
+    are evaluated by :py:mod:`docido_sdk.index.query`, which supports
+    a subset of the Elasticsearch Query DSL. Thumbnails are queried
+    thru their `id` and `mime` fields.
+
+    Thumbnail payloads are written in a :py:class:`BlobStore`, in the
+    `thumbnails` sub-directory, and the thumbnails index only maps
+    their identifiers to the payload digest and mime type. Payloads no
+    longer referenced by the persisted thumbnails index are removed
+    when the crawl is over. Use
+    :py:meth:`get_thumbnail` to read a thumbnail.
+
+    Configuration is read from the `local_storage.documents` section:
+
+    - `path`: directory where indices are written
+    - `storage`: either `log` (default) to append mutations to a
+      :py:class:`IndexLog`, compacted when the crawl is over, or
+      `snapshot` to rewrite the entire index file after every mutation.
+    - `log_max_bytes`: size of a log triggering its compaction
+      in background.
+    - `indexed_fields`: card fields having a secondary index, used to
+      evaluate queries without scanning every card.
     """
+    process_safe = False
+    DEFAULT_INDEXED_FIELDS = ['kind', 'date']
+
     __lock = RWLock()
     __cards = dict()
     __thumbnails = dict()
@@ -125,66 +409,128 @@ class LocalDumbIndexProcessor(IndexAPIProcessor):
         cards_path = osp.join(path, 'cards.yml')
         thumbnails_path = osp.join(path, 'thumbnails.yml')
         failure_probability = index_storage.get('failure_probability', 0)
+        storage = index_storage.get('storage', 'log')
 
         self.__cards_path = cards_path
         self.__thumbnails_path = thumbnails_path
-        self.__cards = LocalDumbIndexProcessor.load_index(cards_path)
-        self.__thumbnails = LocalDumbIndexProcessor.load_index(thumbnails_path)
+        self.__blobs = BlobStore(osp.join(path, 'thumbnails'))
+        if storage == 'log':
+            max_bytes = index_storage.get('log_max_bytes',
+                                          IndexLog.DEFAULT_MAX_BYTES)
+            self.__cards_log = IndexLog(cards_path, max_bytes)
+            self.__thumbnails_log = IndexLog(thumbnails_path, max_bytes)
+            self.__cards = self.__cards_log.load()
+            self.__thumbnails = self.__thumbnails_log.load()
+        elif storage == 'snapshot':
+            self.__cards_log = self.__thumbnails_log = None
+            self.__cards = LocalDumbIndexProcessor.load_index(cards_path)
+            self.__thumbnails = LocalDumbIndexProcessor.load_index(
+                thumbnails_path
+            )
+        else:
+            raise Exception(
+                "Unknown local index storage: '{}'".format(storage)
+            )
+        self.__indexes = FieldIndexes(
+            index_storage.get('indexed_fields', self.DEFAULT_INDEXED_FIELDS)
+        )
+        for _id, card in self.__cards.iteritems():
+            self.__indexes.add(_id, card)
         self.__failure_probability = failure_probability
+        self.__migrate_thumbnails()
+
+    def __migrate_thumbnails(self):
+        """Move payloads of thumbnails written inline in the index
+        by former versions to the blob store"""
+        migrated = []
+        for _id, (payload, mime) in self.__thumbnails.iteritems():
+            if not BlobStore.is_digest(payload):
+                migrated.append((_id, (self.__blobs.put(payload), mime)))
+            elif not self.__blobs.exists(payload):
+                LOGGER.warning('payload %s of thumbnail %s is missing',
+                               payload, _id)
+        if migrated:
+            with self.__update(thumbnails=True) as entries:
+                self.__thumbnails.update(migrated)
+                entries.append(['set', migrated])
 
     @contextmanager
     def __update(self, cards=False, thumbnails=False):
+        entries = []
         self.__lock.writer_acquire()
         try:
-            yield
+            yield entries
             if cards:
-                LocalDumbIndexProcessor.persist_index(
-                    self.__cards, self.__cards_path
-                )
+                self.__persist(self.__cards, self.__cards_path,
+                               self.__cards_log, entries)
             if thumbnails:
-                LocalDumbIndexProcessor.persist_index(
-                    self.__thumbnails,
-                    self.__thumbnails_path
-                )
+                self.__persist(self.__thumbnails, self.__thumbnails_path,
+                               self.__thumbnails_log, entries)
         finally:
             self.__lock.writer_release()
 
+    @classmethod
+    def __persist(cls, index, path, log, entries):
+        if log is None:
+            LocalDumbIndexProcessor.persist_index(index, path)
+        elif entries:
+            log.append(entries)
+
     def push_cards(self, cards):
-        with self.__update(cards=True):
-            for card in cards:
-                self.__cards[card['id']] = card
+        with self.__update(cards=True) as entries:
+            cards = [(card['id'], card) for card in cards]
+            for _id, card in cards:
+                previous = self.__cards.get(_id)
+                if previous is not None:
+                    self.__indexes.remove(_id, previous)
+                self.__indexes.add(_id, card)
+                self.__cards[_id] = card
+            entries.append(['set', cards])
 
     def delete_cards(self, query=None):
-        if query != {'query': {'match_all': {}}}:
-            raise IndexAPIError(
-                'only match_all query is currently supported, you should use' +
-                ' the ElasticSearch processor along with es-settings.yml ' +
-                'config file instead'
-            )
-        with self.__update(cards=True):
-            self.__cards.clear()
+        query = self.__compile_query(query)
+        with self.__update(cards=True) as entries:
+            deleted = select(self.__cards, query, self.__indexes)
+            if len(deleted) == len(self.__cards):
+                self.__cards.clear()
+                self.__indexes.clear_all()
+                entries.append(['clear'])
+                return
+            for _id, card in deleted:
+                del self.__cards[_id]
+                self.__indexes.remove(_id, card)
+            if deleted:
+                entries.append(['delete', [_id for _id, _ in deleted]])
 
     def delete_cards_by_id(self, ids):
         errors = []
-        with self.__update(cards=True):
+        deleted = []
+        with self.__update(cards=True) as entries:
             for _id in ids:
                 if _id not in self.__cards:
                     errors.append({'status': 404, 'id': _id})
                     continue
-                del self.__cards[_id]
+                self.__indexes.remove(_id, self.__cards.pop(_id))
+                deleted.append(_id)
+            if deleted:
+                entries.append(['delete', deleted])
             return errors
 
     def search_cards(self, query=None):
+        fetch_fields = None
+        if query and 'fields' in query.keys():
+            fetch_fields = query.get('fields', None)
+        query = compile_query((query or {}).get('query'))
         with self.__lock.read():
-            fetch_fields = None
-            if query and 'fields' in query.keys():
-                fetch_fields = query.get('fields', None)
             result = list()
+            cards = select(self.__cards, query, self.__indexes)
             if fetch_fields is not None:
-                for card in self.__cards.values():
-                    result.append(dict((k, card[k]) for k in fetch_fields))
+                for _, card in cards:
+                    result.append(dict(
+                        (k, card[k]) for k in fetch_fields if k in card
+                    ))
             else:
-                for card in self.__cards.values():
+                for _, card in cards:
                     result.append(card)
         return result
         # return {
@@ -210,30 +556,86 @@ class LocalDumbIndexProcessor(IndexAPIProcessor):
         # }
 
     def push_thumbnails(self, thumbnails):
-        with self.__update(thumbnails=True):
-            for id_, payload, mime in thumbnails:
-                self.__thumbnails[id_] = (payload, mime)
+        with self.__update(thumbnails=True) as entries:
+            # payloads are written while holding the lock, so that they
+            # are not collected before being referenced
+            thumbnails = [
+                (id_, (self.__blobs.put(payload), mime))
+                for id_, payload, mime in thumbnails
+            ]
+            self.__thumbnails.update(thumbnails)
+            entries.append(['set', thumbnails])
 
     def delete_thumbnails(self, query):
-        if query != {'query': {'match_all': {}}}:
-            raise IndexAPIError(
-                'only match_all query is currently supported, you should use' +
-                ' the ElasticSearch processor along with es-settings.yml ' +
-                'config file instead'
-            )
-        with self.__update(thumbnails=True):
-            self.__thumbnails.clear()
+        query = self.__compile_query(query)
+        with self.__update(thumbnails=True) as entries:
+            deleted = [
+                _id for _id, _ in select(
+                    self.__thumbnails, query,
+                    document=lambda _id, t: {'id': _id, 'mime': t[1]}
+                )
+            ]
+            if len(deleted) == len(self.__thumbnails):
+                self.__thumbnails.clear()
+                entries.append(['clear'])
+                return
+            for _id in deleted:
+                del self.__thumbnails[_id]
+            if deleted:
+                entries.append(['delete', deleted])
 
     def delete_thumbnails_by_id(self, ids):
         errors = []
-        with self.__update(thumbnails=True):
+        deleted = []
+        with self.__update(thumbnails=True) as entries:
             for _id in ids:
                 if _id not in self.__thumbnails:
                     errors.append({'status': 404, 'id': _id})
                     continue
                 del self.__thumbnails[_id]
+                deleted.append(_id)
+            if deleted:
+                entries.append(['delete', deleted])
             return errors
 
+    @classmethod
+    def __compile_query(cls, query):
+        if not isinstance(query, dict) or 'query' not in query:
+            raise IndexAPIError('a query is required to delete documents')
+        return compile_query(query['query'])
+
+    def get_thumbnail(self, _id):
+        """Retrieve a thumbnail
+
+        :return: tuple `(payload, mime)`, where payload is memory-mapped,
+          or `None` if thumbnail does not exist
+        """
+        with self.__lock.read():
+            thumbnail = self.__thumbnails.get(_id)
+        if thumbnail is not None:
+            digest, mime = thumbnail
+            return self.__blobs.get(digest), mime
+
+    def crawl_terminated(self):
+        for log in [self.__cards_log, self.__thumbnails_log]:
+            if log is not None:
+                log.wait()
+                log.compact()
+        with self.__lock.write():
+            # thumbnails may have been pushed by other instances sharing
+            # the same directory, so the persisted index is reloaded
+            thumbnails = self.__load_persisted_thumbnails()
+            thumbnails.update(self.__thumbnails)
+            self.__blobs.collect(set(
+                digest for digest, _ in thumbnails.itervalues()
+            ))
+        return super(LocalDumbIndexProcessor, self).crawl_terminated()
+
+    def __load_persisted_thumbnails(self):
+        if self.__thumbnails_log is not None:
+            return IndexLog(self.__thumbnails_path).load()
+        return LocalDumbIndexProcessor.load_index(self.__thumbnails_path)
+
     @classmethod
     def load_index(cls, path):
         if not osp.exists(path):
@@ -1,5 +1,6 @@
 from contextlib import contextmanager
 import datetime
+import functools
 import logging
 from argparse import ArgumentParser
 import os
@@ -17,7 +18,7 @@ from ..core import (
     Component,
     ExtensionPoint,
 )
-from ..crawler import ICrawler
+from ..crawler import ICrawler, ICrawlMetrics
 from ..crawler.run import TasksRunner
 from ..index.config import YamlPullCrawlersIndexingConfig
 from ..index.processor import (
@@ -47,6 +48,7 @@ def oauth_tokens_from_file():
 
 class LocalRunner(Component):
     crawlers = ExtensionPoint(ICrawler)
+    metrics = ExtensionPoint(ICrawlMetrics)
 
     def _check_pickle(self, tasks):
         try:
@@ -66,11 +68,22 @@ class LocalRunner(Component):
                 docido_config.clear()
                 new_config = Configuration.from_file(config.environment)
                 docido_config.update(new_config)
-            index_api = index_provider.get_index_api(
+            index_api_factory = functools.partial(
+                index_provider.get_index_api,
                 self.service, None, None, config.get('config') or {}
             )
-            runner = TasksRunner(crawler, index_api, config, logger)
-            self._check_pickle(runner.tasks)
+            streaming = config.get('streaming', False)
+            runner = TasksRunner(
+                crawler, index_api_factory(), config, logger,
+                index_api_factory=index_api_factory,
+                check_task=self._check_pickle if streaming else None,
+                metrics=list(self.metrics)
+            )
+            if streaming:
+                # tasks are checked when pulled from the crawler
+                self._check_pickle(runner.tasks.get('epilogue'))
+            else:
+                self._check_pickle(runner.tasks)
             runner.execute()
         return {
             'service': self.service,
@@ -143,6 +156,7 @@ def parse_options(args=None):
 def _prepare_environment(environment):
     environment = environment or env
     loader.load_components(environment)
+    from ..index.sqlite import SQLiteIndex, SQLiteKV
     from ..index.test import LocalKV, LocalDumbIndex
     components = [
         YamlPullCrawlersIndexingConfig,
@@ -151,6 +165,8 @@ def _prepare_environment(environment):
         IndexPipelineProvider,
         LocalKV,
         LocalDumbIndex,
+        SQLiteIndex,
+        SQLiteKV,
     ]
     for component in components:
         _ = environment[component]
@@ -176,6 +192,7 @@ def get_crawls_runner(environment, crawls_root_path, incremental_path):
                 local_storage={
                     'kv': {
                         'path': local_runner.crawl_path,
+                        'write_behind': True,
                     },
                     'documents': {
                         'path': local_runner.crawl_path,
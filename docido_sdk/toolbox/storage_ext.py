@@ -0,0 +1,113 @@
+"""Building blocks of the local persistence of crawl states
+
+- :py:class:`JSONLinesFile` is an append-only file of JSON entries
+- :py:class:`PrefixedKV` restricts the key-value store of an index
+  to the keys starting with a prefix
+"""
+import json
+import os
+import os.path as osp
+import threading
+
+
+class JSONLinesFile(object):
+    """Append-only file where every entry is written as a JSON line"""
+    def __init__(self, path, encoder=None, fsync=False, keep_open=False):
+        """
+        :param path: path to the file
+        :param encoder: :py:class:`json.JSONEncoder` subclass used to
+          serialize entries
+        :param bool fsync: synchronize the file to disk after every append
+        :param bool keep_open:
+          keep the file open between appends, until :py:meth:`close`
+          is called. Do not use if the file may be renamed meanwhile.
+        """
+        self.path = path
+        self.encoder = encoder
+        self.fsync = fsync
+        self.keep_open = keep_open
+        self.__ostr = None
+        self.__lock = threading.Lock()
+
+    def __iter__(self):
+        """Iterate over the entries of the file, if it exists"""
+        if not osp.exists(self.path):
+            return
+        with open(self.path) as istr:
+            for line in istr:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # last line may be truncated if process died
+                    continue
+                yield entry
+
+    def append(self, entries):
+        """Write entries at the end of the file
+
+        :return: number of bytes written
+        """
+        data = ''.join(
+            json.dumps(entry, cls=self.encoder) + '\n' for entry in entries
+        )
+        if not data:
+            return 0
+        with self.__lock:
+            ostr = self.__ostr or open(self.path, 'a')
+            try:
+                ostr.write(data)
+                if self.fsync:
+                    ostr.flush()
+                    os.fsync(ostr.fileno())
+            finally:
+                if self.keep_open:
+                    self.__ostr = ostr
+                else:
+                    ostr.close()
+        return len(data)
+
+    def flush(self):
+        with self.__lock:
+            if self.__ostr is not None:
+                self.__ostr.flush()
+
+    def close(self):
+        with self.__lock:
+            if self.__ostr is not None:
+                self.__ostr.close()
+                self.__ostr = None
+
+    def remove(self):
+        """Close and delete the file"""
+        self.close()
+        with self.__lock:
+            if osp.exists(self.path):
+                os.remove(self.path)
+
+
+class PrefixedKV(object):
+    """Keys of the key-value store of an
+    :py:class:`docido_sdk.index.IndexAPI` starting with a prefix,
+    which is hidden to the caller.
+    """
+    def __init__(self, index_api, prefix):
+        self.index_api = index_api
+        self.prefix = prefix + ':'
+
+    def load(self):
+        """:return: `dict` of the prefixed keys and their value"""
+        return dict(
+            (key[len(self.prefix):], value)
+            for key, value in dict(self.index_api.get_kvs() or {}).iteritems()
+            if key.startswith(self.prefix)
+        )
+
+    def set(self, key, value):
+        self.index_api.set_kv(self.prefix + key, value)
+
+    def delete(self, key):
+        self.index_api.delete_kv(self.prefix + key)
+
+    def clear(self):
+        for key in self.load():
+            self.delete(key)
@@ -28,6 +28,7 @@ extras_require = {
     ':python_version in "2.4, 2.5, 2.6"':
         ['contextlib2', 'backport_collections'],
     ':python_version in "2.7, 3.1, 3.2"': ['contextlib2'],
+    'gevent': ['gevent'],
 }
 
 setup(
@@ -0,0 +1,117 @@
+import time
+import unittest
+
+from docido_sdk.index import IndexAPI
+from docido_sdk.index.processor.buffer import Buffer
+
+
+class RecordIndex(IndexAPI):
+    def __init__(self):
+        self.calls = []
+        self.unavailable = False
+
+    def _record(self, operation, items):
+        self.calls.append((operation, list(items)))
+        return [
+            {'id': item, 'status': 400}
+            for item in items if item == 'bad'
+        ]
+
+    def push_cards(self, cards):
+        return self._record('push_cards', [c.get('id') for c in cards])
+
+    def delete_cards_by_id(self, ids):
+        return self._record('delete_cards_by_id', ids)
+
+    def push_thumbnails(self, thumbnails):
+        return self._record('push_thumbnails', [t[0] for t in thumbnails])
+
+    def delete_thumbnails_by_id(self, ids):
+        if self.unavailable:
+            raise Exception('index is unavailable')
+        return self._record('delete_thumbnails_by_id', ids)
+
+    def search_cards(self, query=None):
+        self.calls.append(('search_cards', query))
+        return iter([])
+
+
+class TestBufferProcessor(unittest.TestCase):
+    def buffer(self, **config):
+        parent = RecordIndex()
+        config.setdefault('max_age', None)
+        return parent, Buffer(parent=parent, buffer=config)
+
+    def test_max_operations(self):
+        parent, index = self.buffer(max_operations=3)
+        self.assertEqual(index.push_cards([dict(id='a')]), [])
+        self.assertEqual(index.push_cards([dict(id='b')]), [])
+        self.assertEqual(parent.calls, [])
+        errors = index.push_cards([dict(id='c'), dict(id='bad')])
+        self.assertEqual(errors, [{'id': 'bad', 'status': 400}])
+        self.assertEqual(parent.calls, [
+            ('push_cards', ['a', 'b', 'c', 'bad']),
+        ])
+
+    def test_operations_order(self):
+        parent, index = self.buffer()
+        index.push_cards([dict(id='a')])
+        index.push_cards([dict(id='b')])
+        index.delete_cards_by_id(['a'])
+        index.push_thumbnails([('t', 'data', 'png')])
+        index.push_cards([dict(id='a')])
+        self.assertEqual(index.task_terminated(), [])
+        self.assertEqual(parent.calls, [
+            ('push_cards', ['a', 'b']),
+            ('delete_cards_by_id', ['a']),
+            ('push_thumbnails', ['t']),
+            ('push_cards', ['a']),
+        ])
+        self.assertEqual(index.crawl_terminated(), [])
+        self.assertEqual(len(parent.calls), 4)
+
+    def test_max_bytes(self):
+        parent, index = self.buffer(max_bytes=20)
+        index.push_thumbnails([('t1', 'data', 'png')])
+        self.assertEqual(parent.calls, [])
+        index.push_thumbnails([('t2', 'x' * 20, 'png')])
+        self.assertEqual(parent.calls, [('push_thumbnails', ['t1', 't2'])])
+
+    def test_max_age(self):
+        parent, index = self.buffer(max_age=0.1)
+        index.push_cards([dict(id='a')])
+        time.sleep(0.1)
+        index.push_cards([dict(id='b')])
+        self.assertEqual(parent.calls, [('push_cards', ['a', 'b'])])
+
+    def test_parent_failure(self):
+        parent, index = self.buffer(max_bytes=1000)
+        index.push_cards([dict(id='bad')])
+        index.delete_thumbnails_by_id(['t1'])
+        index.push_cards([dict(id='a')])
+        parent.unavailable = True
+        with self.assertRaises(Exception):
+            index.flush()
+        self.assertEqual(index._count, 2)
+        self.assertGreater(index._bytes, 0)
+        parent.unavailable = False
+        self.assertEqual(index.flush(), [{'id': 'bad', 'status': 400}])
+        self.assertEqual(parent.calls, [
+            ('push_cards', ['bad']),
+            ('delete_thumbnails_by_id', ['t1']),
+            ('push_cards', ['a']),
+        ])
+        self.assertEqual((index._count, index._bytes), (0, 0))
+
+    def test_flush_before_query(self):
+        parent, index = self.buffer()
+        index.push_cards([dict(id='bad')])
+        list(index.search_cards({'query': {'match_all': {}}}))
+        self.assertEqual(parent.calls[0], ('push_cards', ['bad']))
+        self.assertEqual(parent.calls[1][0], 'search_cards')
+        self.assertEqual(index.task_terminated(),
+                         [{'id': 'bad', 'status': 400}])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+import os.path as osp
+import unittest
+
+from docido_sdk.index.processor.changes import (
+    ChangeDetection,
+    KVFingerprintStore,
+    card_fingerprint,
+)
+from docido_sdk.toolbox.contextlib_ext import tempdir
+
+from test_buffer_processor import RecordIndex
+
+
+class KVRecordIndex(RecordIndex):
+    def __init__(self):
+        super(KVRecordIndex, self).__init__()
+        self.kv = dict()
+        self.kv_writes = 0
+
+    def get_kvs(self):
+        return self.kv.items()
+
+    def set_kv(self, key, value):
+        self.kv_writes += 1
+        self.kv[key] = value
+
+    def delete_kv(self, key):
+        self.kv_writes += 1
+        self.kv.pop(key, None)
+
+
+class TestChangeDetectionProcessor(unittest.TestCase):
+    def test_fingerprint(self):
+        self.assertEqual(card_fingerprint(dict(id='a', title='foo')),
+                         card_fingerprint(dict(title='foo', id='a')))
+        self.assertNotEqual(card_fingerprint(dict(id='a', title='foo')),
+                            card_fingerprint(dict(id='a', title='bar')))
+
+    def test_skip_unchanged_cards(self):
+        parent = KVRecordIndex()
+        index = ChangeDetection(parent=parent)
+        cards = [dict(id='a', title='foo'), dict(id='b', title='bar')]
+        self.assertEqual(index.push_cards(cards), [])
+        self.assertEqual(index.push_cards(cards), [])
+        index.push_cards([dict(id='a', title='foo'),
+                          dict(id='b', title='baz')])
+        self.assertEqual(parent.calls, [
+            ('push_cards', ['a', 'b']),
+            ('push_cards', ['b']),
+        ])
+        self.assertEqual(index.stats, dict(pushed=3, skipped=3))
+        # fingerprints are reloaded from the kv store
+        index = ChangeDetection(parent=parent)
+        index.push_cards(cards)
+        self.assertEqual(parent.calls[-1], ('push_cards', ['b']))
+
+    def test_failed_cards_are_pushed_again(self):
+        parent = KVRecordIndex()
+        index = ChangeDetection(parent=parent)
+        cards = [dict(id='a'), dict(id='bad')]
+        self.assertEqual(index.push_cards(cards),
+                         [{'id': 'bad', 'status': 400}])
+        index.push_cards(cards)
+        self.assertEqual(parent.calls[-1], ('push_cards', ['bad']))
+
+    def test_kv_writes_are_batched(self):
+        parent = KVRecordIndex()
+        index = ChangeDetection(parent=parent)
+        cards = [dict(id=i) for i in range(1000)]
+        index.push_cards(cards)
+        buckets = KVFingerprintStore.BUCKETS
+        self.assertEqual(len(parent.kv), buckets)
+        self.assertEqual(parent.kv_writes, buckets)
+        index.delete_cards_by_id(range(500))
+        self.assertEqual(parent.kv_writes, 2 * buckets)
+        index = ChangeDetection(parent=parent)
+        index.push_cards(cards)
+        self.assertEqual(parent.calls[-1], ('push_cards', range(500)))
+        index.delete_cards({'query': {'match_all': {}}})
+        self.assertEqual(parent.kv, dict())
+        self.assertEqual(parent.kv_writes, 4 * buckets)
+
+    def test_invalid_cards_are_forwarded(self):
+        parent = KVRecordIndex()
+        index = ChangeDetection(parent=parent)
+        index.push_cards([{}])
+        self.assertEqual(parent.calls, [('push_cards', [None])])
+        self.assertEqual(parent.kv, dict())
+
+    def test_deletions(self):
+        parent = KVRecordIndex()
+        index = ChangeDetection(parent=parent)
+        cards = [dict(id='a'), dict(id='b'), dict(id='c')]
+        index.push_cards(cards)
+        index.delete_cards_by_id(['a'])
+        index.push_cards(cards)
+        self.assertEqual(parent.calls[-1], ('push_cards', ['a']))
+        index.delete_cards({'query': {'match_all': {}}})
+        self.assertEqual(parent.kv, dict())
+        index.push_cards(cards)
+        self.assertEqual(parent.calls[-1], ('push_cards', ['a', 'b', 'c']))
+
+    def test_file_storage(self):
+        with tempdir() as path:
+            config = dict(storage='file',
+                          path=osp.join(path, 'fingerprints'))
+            parent = RecordIndex()
+            index = ChangeDetection(parent=parent, change_detection=config)
+            index.push_cards([dict(id='a'), dict(id='b')])
+            index.delete_cards_by_id(['b'])
+            index.crawl_terminated()
+            index = ChangeDetection(parent=parent, change_detection=config)
+            index.push_cards([dict(id='a'), dict(id='b')])
+            self.assertEqual(parent.calls[-1], ('push_cards', ['b']))
+
+    def test_invalid_storage(self):
+        with self.assertRaises(Exception):
+            ChangeDetection(change_detection=dict(storage='file'))
+        with self.assertRaises(Exception):
+            ChangeDetection(change_detection=dict(storage='foo'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import unittest
+
+from docido_sdk.crawler import Retry
+from docido_sdk.crawler.concurrency import AdaptiveConcurrency
+
+
+def _ok():
+    return 42
+
+
+def _retry():
+    raise Retry(countdown=0)
+
+
+def _fail():
+    raise Exception('foo')
+
+
+class TestAdaptiveConcurrency(unittest.TestCase):
+    def test_additive_increase(self):
+        controller = AdaptiveConcurrency(4)
+        call = controller.wrap(_ok)
+        self.assertEqual(controller.limit, 1)
+        self.assertEqual(call(), 42)
+        self.assertEqual(controller.limit, 2)
+        call()
+        self.assertEqual(controller.limit, 2)
+        call()
+        self.assertEqual(controller.limit, 3)
+        for _ in range(10):
+            call()
+        self.assertEqual(controller.limit, 4)
+        self.assertEqual(controller.in_flight, 0)
+
+    def test_multiplicative_decrease(self):
+        controller = AdaptiveConcurrency(8, initial=8)
+        with self.assertRaises(Retry):
+            controller.wrap(_retry)()
+        self.assertEqual(controller.limit, 4)
+        with self.assertRaises(Retry):
+            controller.wrap(_retry)()
+        self.assertEqual(controller.limit, 2)
+
+    def test_single_decrease_per_epoch(self):
+        controller = AdaptiveConcurrency(8, initial=8)
+        epochs = [controller.acquire() for _ in range(3)]
+        for epoch in epochs:
+            controller.release(epoch, retry=True)
+        self.assertEqual(controller.limit, 4)
+        self.assertEqual(controller.in_flight, 0)
+
+    def test_unhealthy_tasks(self):
+        controller = AdaptiveConcurrency(4, max_latency=1)
+        controller.release(controller.acquire(), latency=2)
+        self.assertEqual(controller.limit, 1)
+        with self.assertRaises(Exception):
+            controller.wrap(_fail)()
+        self.assertEqual(controller.limit, 1)
+        controller.release(controller.acquire(), latency=0.5)
+        self.assertEqual(controller.limit, 2)
+
+    def test_bounds(self):
+        controller = AdaptiveConcurrency(4, minimum=2, initial=10)
+        self.assertEqual(controller.limit, 4)
+        for _ in range(3):
+            controller.release(controller.acquire(), retry=True)
+        self.assertEqual(controller.limit, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
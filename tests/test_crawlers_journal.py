@@ -0,0 +1,93 @@
+import os.path as osp
+import unittest
+
+from docido_sdk.crawler.journal import (
+    CrawlJournal,
+    FileJournalStorage,
+    KVJournalStorage,
+)
+from docido_sdk.index import IndexAPI
+from docido_sdk.toolbox.contextlib_ext import tempdir
+
+
+class RamKVIndex(IndexAPI):
+    def __init__(self):
+        self.kvs = dict()
+
+    def get_kvs(self):
+        return self.kvs.items()
+
+    def set_kv(self, key, value):
+        self.kvs[key] = value
+
+    def delete_kv(self, key):
+        self.kvs.pop(key, None)
+
+
+class TestCrawlJournal(unittest.TestCase):
+    TASKS = [[1, 2, 3], [4, 5]]
+
+    def check_journal(self, storage):
+        journal = CrawlJournal(storage)
+        self.assertEqual(journal.load(self.TASKS), {})
+        journal.record(0, 1, 'foo')
+        journal.record(0, 2, dict(bar=42))
+        journal.record(1, 1, None)
+        journal.record(1, 2, lambda: 'not picklable')
+        journal = CrawlJournal(storage)
+        self.assertEqual(
+            journal.load(self.TASKS),
+            {0: (2, dict(bar=42)), 1: (1, None)}
+        )
+        # a crawl with different tasks discards the journal
+        self.assertEqual(journal.load(self.TASKS + [[6]]), {})
+        self.assertEqual(journal.load(self.TASKS), {})
+        journal.record(0, 1, 'foo')
+        self.assertEqual(journal.load([[1, 2, 7], [4, 5]]), {})
+        journal.record(0, 1, 'foo')
+        self.assertEqual(journal.load([[1, 2, 7], [4, 5]], dict(full=True)),
+                         {})
+        journal.record(0, 1, 'foo')
+        self.assertEqual(journal.load([[1, 2, 7], [4, 5]], dict(full=True)),
+                         {0: (1, 'foo')})
+        self.assertEqual(journal.load(self.TASKS), {})
+        journal.record(0, 1, 'foo')
+        journal.clear()
+        self.assertEqual(journal.load(self.TASKS), {})
+
+    def test_kv_storage(self):
+        index = RamKVIndex()
+        index.set_kv('foo', 'bar')
+        self.check_journal(KVJournalStorage(index))
+        journal = CrawlJournal.from_config(True, index)
+        self.assertIsInstance(journal.storage, KVJournalStorage)
+        journal.clear()
+        self.assertEqual(index.kvs, {'foo': 'bar'})
+
+    def test_file_storage(self):
+        with tempdir() as path:
+            path = osp.join(path, 'journal')
+            self.check_journal(FileJournalStorage(path))
+            with open(path, 'a') as ostr:
+                ostr.write('["tasks", "3f')
+            journal = CrawlJournal.from_config(
+                dict(storage='file', path=path), None
+            )
+            self.assertEqual(journal.load(self.TASKS), {})
+
+    def test_unpicklable_tasks(self):
+        journal = CrawlJournal(KVJournalStorage(RamKVIndex()))
+        tasks = [[lambda: None]]
+        self.assertEqual(journal.load(tasks), {})
+        journal.record(0, 1, 'foo')
+        self.assertEqual(journal.load(tasks), {})
+
+    def test_invalid_config(self):
+        with self.assertRaises(Exception):
+            CrawlJournal.from_config(dict(storage='file'), None)
+        with self.assertRaises(Exception):
+            CrawlJournal.from_config(dict(storage='foo'), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+
+from docido_sdk.crawler.metrics import percentile, TasksStatistics
+from docido_sdk.toolbox.collections_ext import nameddict
+
+
+def _event(elapsed, cards=0, error=None, delay=None):
+    return nameddict(elapsed=elapsed, cards=cards, error=error, delay=delay)
+
+
+class TestTasksStatistics(unittest.TestCase):
+    def test_percentile(self):
+        values = range(1, 101)
+        self.assertIsNone(percentile([], 50))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 95), 95)
+        self.assertEqual(percentile(values, 100), 100)
+        self.assertEqual(percentile([0], 50), 0)
+
+    def test_summary(self):
+        stats = TasksStatistics()
+        stats.task_ended(_event(0.1, cards=10))
+        stats.task_ended(_event(0.3, error=Exception()))
+        stats.task_retried(_event(0.2, delay=2))
+        stats.epilogue_ended(_event(0.4, cards=5))
+        summary = stats.summary()
+        self.assertEqual(summary.tasks, 3)
+        self.assertEqual(summary.errors, 1)
+        self.assertEqual(summary.retries, 1)
+        self.assertEqual(summary.retry_wait, 2)
+        self.assertEqual(summary.cards, 15)
+        self.assertEqual(summary.latency_p50, 0.2)
+        self.assertEqual(summary.latency_p95, 0.4)
+        self.assertIn('3 tasks executed', TasksStatistics.format(summary))
+
+    def test_max_samples(self):
+        stats = TasksStatistics(max_samples=10)
+        for i in range(100):
+            stats.task_ended(_event(i))
+        self.assertEqual(len(stats._durations), 10)
+        self.assertEqual(stats.summary().tasks, 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
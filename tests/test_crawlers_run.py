@@ -0,0 +1,549 @@
+import functools
+import json
+import logging
+import os
+import os.path as osp
+import subprocess
+import sys
+import threading
+import time
+import unittest
+
+try:
+    import gevent
+except ImportError:
+    gevent = None
+
+from docido_sdk.crawler import Retry
+from docido_sdk.crawler.run import TasksRunner
+from docido_sdk.index import IndexAPI
+from docido_sdk.oauth import OAuthToken
+from docido_sdk.toolbox.collections_ext import nameddict
+from docido_sdk.toolbox.contextlib_ext import tempdir
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+def _increment_task(index, token, prev_result, config, logger):
+    return (prev_result or 0) + 1
+
+
+def _wait_event_task(wait_event, set_event, index, token, prev_result,
+                     config, logger):
+    set_event.set()
+    if not wait_event.wait(5):
+        raise Exception('sequences were not executed concurrently')
+    return threading.current_thread().name
+
+
+def _pid_task(index, token, prev_result, config, logger):
+    assert isinstance(index, IndexAPI)
+    return (prev_result or []) + [os.getpid()]
+
+
+def _retry_task(index, token, prev_result, config, logger, attempt=1):
+    if attempt < 3:
+        raise Retry(countdown=0, kwargs=dict(attempt=attempt + 1))
+    return attempt
+
+
+def _countdown_retry_task(events, index, token, prev_result, config, logger,
+                          attempt=1):
+    events.append(('retry', attempt))
+    if attempt == 1:
+        raise Retry(countdown=1, kwargs=dict(attempt=2))
+    return attempt
+
+
+def _append_task(events, name, index, token, prev_result, config, logger):
+    events.append(name)
+    return name
+
+
+def _quick_task(done, event, index, token, prev_result, config, logger):
+    done.append(threading.current_thread().name)
+    if len(done) == 5:
+        event.set()
+
+
+def _count_task(state, started, index, token, prev_result, config,
+                logger):
+    started.set()
+    state['count'] += 1
+    time.sleep(0.01)
+
+
+def _interrupt_task(started, index, token, prev_result, config, logger):
+    started.wait(5)
+    raise KeyboardInterrupt()
+
+
+def _crash_task(state, index, token, prev_result, config, logger):
+    state['calls'] += 1
+    if state['crash']:
+        raise KeyboardInterrupt()
+    return prev_result + 1
+
+
+_JOURNAL_STATE = dict()
+
+
+def _journal_crash_task(index, token, prev_result, config, logger):
+    return _crash_task(_JOURNAL_STATE, index, token, prev_result, config,
+                       logger)
+
+
+def _journal_counting_task(index, token, prev_result, config, logger):
+    _JOURNAL_STATE['counted'] += 1
+    return _increment_task(index, token, prev_result, config, logger)
+
+
+class _WriteBehindKV(IndexAPI):
+    """Key-value store persisting changes when a task is terminated"""
+    def __init__(self):
+        self.pending = dict()
+        self.persisted = dict()
+
+    def get_kvs(self):
+        return dict(self.persisted, **self.pending).items()
+
+    def set_kv(self, key, value):
+        self.pending[key] = value
+
+    def delete_kv(self, key):
+        self.pending.pop(key, None)
+        self.persisted.pop(key, None)
+
+    def task_terminated(self):
+        self.persisted.update(self.pending)
+        self.pending.clear()
+
+
+_WRITE_BEHIND_KV = _WriteBehindKV()
+
+
+def _persisted_kvs_task(index, token, prev_result, config, logger):
+    return sorted(_WRITE_BEHIND_KV.persisted)
+
+
+def _push_task(count, index, token, prev_result, config, logger):
+    index.push_cards([dict(id=str(i)) for i in range(count)])
+    return count
+
+
+class _RejectingIndex(IndexAPI):
+    """Index rejecting cards whose identifier is 'bad'"""
+    def push_cards(self, cards):
+        return [
+            {'id': card['id'], 'status': 400}
+            for card in cards if card['id'] == 'bad'
+        ]
+
+    def get_thumbnail(self, _id):
+        return 'thumbnail'
+
+
+def _rejected_push_task(index, token, prev_result, config, logger):
+    index.push_cards([dict(id='a'), dict(id='bad'), dict(id='b')])
+    return type(index).__name__, index.get_thumbnail('a')
+
+
+class _ApiError(Exception):
+    def __init__(self, status, reason):
+        super(_ApiError, self).__init__('{} {}'.format(status, reason))
+
+
+def _api_error_task(index, token, prev_result, config, logger):
+    raise _ApiError(503, 'unavailable')
+
+
+class _TerminationRecorder(IndexAPI):
+    """Record in a file the processes whose pipeline is terminated"""
+    def __init__(self, path):
+        self.path = path
+
+    def crawl_terminated(self):
+        with open(self.path, 'a') as ostr:
+            ostr.write('{}\n'.format(os.getpid()))
+
+
+class _LocalIndex(IndexAPI):
+    process_safe = False
+
+
+def _greenlet_task(index, token, prev_result, config, logger):
+    if not isinstance(gevent.getcurrent(), gevent.Greenlet):
+        raise Exception('task is not executed by a greenlet')
+    # patched by gevent, lets the other greenlets run
+    time.sleep(0.5)
+    return (prev_result or 0) + 1
+
+
+def _greenlet_retry_task(index, token, prev_result, config, logger,
+                         attempt=1):
+    if attempt < 3:
+        raise Retry(countdown=0, kwargs=dict(attempt=attempt + 1))
+    return prev_result + attempt
+
+
+def _gevent_crawl():
+    """Executed in a monkey patched child process by
+    :py:meth:`TestTasksRunner.test_gevent_executor`"""
+    tasks = [
+        [_greenlet_task] * 2,
+        [_greenlet_task, _greenlet_retry_task],
+        [_greenlet_task],
+    ]
+    crawler = FakeCrawler(tasks, epilogue=_epilogue)
+    config = nameddict(token=OAuthToken(), executor='gevent',
+                       max_concurrent_tasks=3)
+    runner = TasksRunner(crawler, IndexAPI(), config, LOGGER)
+    start = time.time()
+    results = runner.execute()
+    json.dump(dict(results=results, elapsed=time.time() - start),
+              sys.stdout)
+
+
+def _epilogue(index, token, results, config, logger):
+    return results
+
+
+class FakeCrawler(object):
+    def __init__(self, tasks, **kwargs):
+        self.crawl_tasks = dict(tasks=tasks, **kwargs)
+
+    def iter_crawl_tasks(self, index, token, config, logger):
+        return self.crawl_tasks
+
+
+def _iter_tasks(events, tasks):
+    for i, task in enumerate(tasks):
+        events.append(('pull', i))
+        yield task
+
+
+class RecordMetrics(object):
+    def __init__(self):
+        self.events = []
+        self.summary = None
+
+    def task_started(self, event):
+        self.events.append(('task_started', event.sequence, event.attempt))
+
+    def task_ended(self, event):
+        self.events.append(('task_ended', event.task, event.cards))
+
+    def task_retried(self, event):
+        self.events.append(('task_retried', event.task, event.delay))
+
+    def epilogue_started(self, event):
+        self.events.append(('epilogue_started', event.epilogue))
+
+    def epilogue_ended(self, event):
+        self.events.append(('epilogue_ended', event.error))
+
+    def crawl_ended(self, summary):
+        self.summary = summary
+
+
+class TestTasksRunner(unittest.TestCase):
+    def run_tasks(self, tasks, check_task=None, metrics=None,
+                  index_api_factory=IndexAPI, **config):
+        config.setdefault('token', OAuthToken())
+        crawler = FakeCrawler(tasks, epilogue=_epilogue)
+        runner = TasksRunner(crawler, index_api_factory(), nameddict(config),
+                             LOGGER, index_api_factory=index_api_factory,
+                             check_task=check_task, metrics=metrics)
+        return runner.execute()
+
+    def test_sequential_executor(self):
+        tasks = [
+            [_increment_task] * 3,
+            [_increment_task] * 5,
+        ]
+        self.assertEqual(self.run_tasks(tasks), [3, 5])
+
+    def test_thread_executor(self):
+        tasks = [
+            [_increment_task] * 3,
+            [_increment_task] * 5,
+            [_increment_task] * 2,
+        ]
+        self.assertEqual(
+            self.run_tasks(tasks, executor='thread',
+                           max_concurrent_tasks=2),
+            [3, 5, 2]
+        )
+
+    def test_thread_executor_concurrency(self):
+        e1, e2 = threading.Event(), threading.Event()
+        tasks = [
+            [functools.partial(_wait_event_task, e1, e2)],
+            [functools.partial(_wait_event_task, e2, e1)],
+        ]
+        results = self.run_tasks(tasks, executor='thread')
+        self.assertEqual(len(results), 2)
+        self.assertNotEqual(results[0], results[1])
+
+    def test_process_executor(self):
+        tasks = [
+            [_pid_task] * 2,
+            [_pid_task] * 3,
+            [_retry_task],
+        ]
+        results = self.run_tasks(tasks, executor='process',
+                                 max_concurrent_tasks=2)
+        self.assertEqual(len(results[0]), 2)
+        self.assertEqual(len(results[1]), 3)
+        self.assertNotIn(os.getpid(), results[0] + results[1])
+        self.assertEqual(results[2], 3)
+
+    def test_process_executor_unpicklable_exception(self):
+        errors = []
+
+        class RecordErrors(object):
+            def task_ended(self, event):
+                if event.error is not None:
+                    errors.append(event.error)
+        self.run_tasks([[_api_error_task]], executor='process',
+                       metrics=[RecordErrors()])
+        self.assertEqual(len(errors), 1)
+        self.assertIn('_ApiError: 503 unavailable', str(errors[0]))
+        self.assertIn('in _api_error_task', str(errors[0]))
+
+    def test_process_executor_terminates_workers_pipeline(self):
+        with tempdir() as path:
+            path = osp.join(path, 'terminated')
+            tasks = [[_pid_task] * 2, [_pid_task] * 2]
+            results = self.run_tasks(
+                tasks, executor='process', max_concurrent_tasks=2,
+                index_api_factory=functools.partial(_TerminationRecorder,
+                                                    path)
+            )
+            with open(path) as istr:
+                pids = [int(pid) for pid in istr]
+            # parent pipeline, and every worker pipeline
+            self.assertEqual(len(pids), 3)
+            self.assertIn(os.getpid(), pids)
+            self.assertTrue(set(results[0] + results[1]) <= set(pids))
+
+    def test_process_executor_rejects_local_processors(self):
+        with self.assertRaises(Exception) as exc:
+            self.run_tasks([[_pid_task]], executor='process',
+                           index_api_factory=_LocalIndex)
+        self.assertIn('_LocalIndex', str(exc.exception))
+
+    def test_retry_does_not_block_other_sequences(self):
+        events = []
+        tasks = [
+            [functools.partial(_countdown_retry_task, events)],
+            [
+                functools.partial(_append_task, events, 'a'),
+                functools.partial(_append_task, events, 'b'),
+            ],
+        ]
+        self.assertEqual(self.run_tasks(tasks), [2, 'b'])
+        self.assertEqual(events, [('retry', 1), 'a', 'b', ('retry', 2)])
+
+    def test_streaming(self):
+        events = []
+        checked = []
+        tasks = _iter_tasks(events, [
+            functools.partial(_append_task, events, i) for i in range(5)
+        ])
+        results = self.run_tasks(tasks, check_task=checked.append,
+                                 streaming=True, max_concurrent_tasks=1)
+        self.assertEqual(results, [4])
+        self.assertEqual(len(checked), 5)
+        self.assertEqual(events[:4], [('pull', 0), 0, ('pull', 1), 1])
+
+    def test_streaming_threads(self):
+        events = []
+        tasks = (
+            functools.partial(_append_task, events, i) for i in range(20)
+        )
+        results = self.run_tasks(tasks, executor='thread', streaming=True,
+                                 max_concurrent_tasks=2)
+        self.assertEqual(sorted(events), range(20))
+        self.assertIn(len(results), [1, 2])
+        self.assertIn(19, results)
+
+    def test_streaming_sequences(self):
+        events = []
+        tasks = _iter_tasks(events, [
+            [_increment_task] * 2,
+            [_increment_task] * 3,
+        ])
+        self.assertEqual(self.run_tasks(tasks, streaming=True), [2, 3])
+
+    def test_streaming_empty(self):
+        self.assertEqual(self.run_tasks(iter([]), streaming=True), [])
+
+    def test_dynamic_scheduling(self):
+        event = threading.Event()
+        done = []
+        tasks = [
+            functools.partial(_wait_event_task, event, threading.Event())
+        ]
+        tasks += [functools.partial(_quick_task, done, event)] * 5
+        results = self.run_tasks(tasks, executor='thread',
+                                 scheduling='dynamic', max_concurrent_tasks=2)
+        self.assertEqual(len(results), 2)
+        self.assertEqual(len(done), 5)
+        self.assertIsInstance(results[0], str)
+        self.assertNotIn(results[0], done)
+
+    def test_interrupt_stops_other_workers(self):
+        state = dict(count=0)
+        started = threading.Event()
+        tasks = [functools.partial(_interrupt_task, started)]
+        tasks += [functools.partial(_count_task, state, started)] * 200
+        with self.assertRaises(KeyboardInterrupt):
+            self.run_tasks(tasks, executor='thread', scheduling='dynamic',
+                           max_concurrent_tasks=2)
+        self.assertLess(state['count'], 10)
+
+    def test_dynamic_scheduling_results(self):
+        results = self.run_tasks([_increment_task] * 4, scheduling='dynamic',
+                                 max_concurrent_tasks=3)
+        # tasks are not chained, and idle sequences have no result
+        self.assertEqual(results, [1])
+
+    def test_dynamic_scheduling_sequences(self):
+        tasks = [
+            [_increment_task] * 3,
+            [_increment_task] * 5,
+        ]
+        self.assertEqual(self.run_tasks(tasks, scheduling='dynamic'), [3, 5])
+
+    def test_adaptive_concurrency(self):
+        tasks = [
+            [_increment_task] * 3,
+            [_increment_task] * 5,
+            [_retry_task],
+        ]
+        results = self.run_tasks(tasks, executor='thread',
+                                 adaptive_concurrency=dict(initial=2),
+                                 max_concurrent_tasks=3)
+        self.assertEqual(results, [3, 5, 3])
+
+    def test_journal(self):
+        _JOURNAL_STATE.update(crash=True, calls=0, counted=0)
+        tasks = [
+            [_journal_counting_task, _journal_crash_task, _increment_task],
+            [_journal_counting_task, _increment_task, _increment_task],
+        ]
+        with tempdir() as path:
+            journal = dict(storage='file', path=osp.join(path, 'journal'))
+            with self.assertRaises(KeyboardInterrupt):
+                self.run_tasks(tasks, journal=journal)
+            self.assertEqual(_JOURNAL_STATE['counted'], 1)
+            _JOURNAL_STATE['crash'] = False
+            self.assertEqual(self.run_tasks(tasks, journal=journal), [3, 3])
+            self.assertEqual(_JOURNAL_STATE['calls'], 2)
+            # first task of the first sequence is not executed again
+            self.assertEqual(_JOURNAL_STATE['counted'], 2)
+            self.assertFalse(osp.exists(journal['path']))
+
+    def test_journal_persisted_with_task(self):
+        tasks = [[_increment_task, _persisted_kvs_task]]
+        results = self.run_tasks(tasks, journal=True,
+                                 index_api_factory=lambda: _WRITE_BEHIND_KV)
+        # first task was recorded when its changes were persisted
+        self.assertIn('crawl-journal:seq:0', results[0])
+        self.assertEqual(_WRITE_BEHIND_KV.persisted, {})
+
+    def test_journal_of_different_crawl(self):
+        _JOURNAL_STATE.update(crash=True, calls=0, counted=0)
+        tasks = [[_increment_task, _journal_crash_task]]
+        with tempdir() as path:
+            journal = dict(storage='file', path=osp.join(path, 'journal'))
+            with self.assertRaises(KeyboardInterrupt):
+                self.run_tasks(tasks, journal=journal)
+            # same shape, different tasks
+            tasks = [[_journal_counting_task, _increment_task]]
+            self.assertEqual(self.run_tasks(tasks, journal=journal), [2])
+            self.assertEqual(_JOURNAL_STATE['counted'], 1)
+
+    def test_metrics(self):
+        metrics = RecordMetrics()
+        tasks = [
+            [functools.partial(_push_task, 3), _retry_task],
+            [functools.partial(_push_task, 2)],
+        ]
+        self.assertEqual(self.run_tasks(tasks, metrics=[metrics]), [3, 2])
+        self.assertEqual(metrics.events, [
+            ('task_started', 0, 1),
+            ('task_ended', '_push_task', 3),
+            ('task_started', 0, 1),
+            ('task_retried', '_retry_task', 0),
+            ('task_started', 0, 2),
+            ('task_retried', '_retry_task', 0),
+            ('task_started', 0, 3),
+            ('task_ended', '_retry_task', 0),
+            ('task_started', 1, 1),
+            ('task_ended', '_push_task', 2),
+            ('epilogue_started', True),
+            ('epilogue_ended', None),
+        ])
+        summary = metrics.summary
+        self.assertEqual(summary.tasks, 4)
+        self.assertEqual(summary.retries, 2)
+        self.assertEqual(summary.errors, 0)
+        self.assertEqual(summary.cards, 5)
+        self.assertIsNotNone(summary.latency_p95)
+
+    def test_count_pushed_cards(self):
+        for executor in ['sequential', 'thread', 'process']:
+            metrics = RecordMetrics()
+            results = self.run_tasks([[_rejected_push_task]] * 2,
+                                     executor=executor, metrics=[metrics],
+                                     index_api_factory=_RejectingIndex)
+            # tasks are given the index pipeline itself
+            self.assertEqual([tuple(r) for r in results],
+                             [('_RejectingIndex', 'thumbnail')] * 2)
+            self.assertEqual(metrics.summary.cards, 4)
+
+    def test_process_executor_metrics(self):
+        metrics = RecordMetrics()
+        tasks = [
+            [functools.partial(_push_task, 3)],
+            [functools.partial(_crash_task, dict(crash=False, calls=0))],
+        ]
+        self.run_tasks(tasks, executor='process', metrics=[metrics])
+        self.assertEqual(metrics.summary.cards, 3)
+        self.assertEqual(metrics.summary.errors, 1)
+
+    @unittest.skipIf(gevent is None, 'gevent is not installed')
+    def test_gevent_executor(self):
+        script = '\n'.join([
+            'from gevent import monkey',
+            'monkey.patch_all()',
+            'import test_crawlers_run',
+            'test_crawlers_run._gevent_crawl()',
+        ])
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        output = subprocess.check_output(
+            [sys.executable, '-c', script],
+            cwd=osp.dirname(osp.abspath(__file__)), env=env
+        )
+        crawl = json.loads(output)
+        self.assertEqual(crawl['results'], [2, 4, 1])
+        # sequences of 2 tasks sleeping 0.5s were executed concurrently
+        self.assertLess(crawl['elapsed'], 1.5)
+
+    def test_gevent_executor_requires_monkey_patching(self):
+        with self.assertRaises(Exception) as exc:
+            self.run_tasks([_increment_task], executor='gevent')
+        self.assertIn('gevent', exc.exception.message)
+
+    def test_unknown_executor(self):
+        with self.assertRaises(Exception) as exc:
+            self.run_tasks([_increment_task], executor='foo')
+        self.assertEqual(exc.exception.message,
+                         "Unknown tasks executor: 'foo'")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,12 +1,21 @@
 import unittest
 
+import functools
+
 from docido_sdk.crawler.tasks import (
+    balance_crawl_tasks,
     check_custom_concurrency,
+    get_task_cost,
     reorg_crawl_tasks,
+    set_task_cost,
     split_crawl_tasks,
 )
 
 
+def _task(name, *args):
+    return name
+
+
 class TestCrawlersTasks(unittest.TestCase):
     def test_check_custom_concurrency(self):
         ccc = check_custom_concurrency
@@ -27,6 +36,15 @@ class TestCrawlersTasks(unittest.TestCase):
             ([1, 2, 3], None, 2)
         )
 
+    def test_reorg_crawl_tasks_streaming(self):
+        tasks = iter([1, 2, 3])
+        futures, epilogue, concurrency = reorg_crawl_tasks(
+            dict(tasks=tasks), 2, streaming=True
+        )
+        self.assertIs(futures, tasks)
+        self.assertIsNone(epilogue)
+        self.assertEqual(concurrency, 2)
+
     def test_split_crawl_tasks(self):
         sct = split_crawl_tasks
         self.assertEqual(sct([1, 2, 3], 2), [[1, 2], [3]])
@@ -36,6 +54,31 @@ class TestCrawlersTasks(unittest.TestCase):
             self.assertEqual(sct([[1, 2], 42], 1))
         self.assertEqual(exc.exception.message, 'Expected a list of tasks')
 
+    def test_task_cost(self):
+        task = functools.partial(_task, 'a')
+        self.assertEqual(get_task_cost(task), 1)
+        self.assertIs(set_task_cost(task, 42), task)
+        self.assertEqual(get_task_cost(task), 42)
+
+    def test_balance_crawl_tasks(self):
+        tasks = [
+            set_task_cost(functools.partial(_task, name), cost)
+            for name, cost in [('a', 1), ('b', 10), ('c', 2), ('d', 7),
+                               ('e', 3)]
+        ]
+        sequences = balance_crawl_tasks(tasks, 2)
+        self.assertEqual(
+            [[t.args[0] for t in seq] for seq in sequences],
+            [['b', 'c'], ['d', 'e', 'a']]
+        )
+        self.assertEqual(len(balance_crawl_tasks(tasks[:1], 3)), 1)
+
+    def test_split_crawl_tasks_with_costs(self):
+        tasks = [functools.partial(_task, name) for name in 'abcd']
+        set_task_cost(tasks[0], 100)
+        sequences = split_crawl_tasks(tasks, 2)
+        self.assertEqual(sequences, [[tasks[0]], tasks[1:]])
+
 
 if __name__ == '__main__':
     unittest.main()
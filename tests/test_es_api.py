@@ -1,6 +1,11 @@
+import json
 import unittest
 import os.path as osp
 
+from elasticsearch.exceptions import ConnectionTimeout
+from elasticsearch.serializer import JSONSerializer
+import mock
+
 import tempfile
 import shutil
 from contextlib import contextmanager
@@ -9,12 +14,20 @@ from docido_sdk.core import (
     implements,
 )
 from docido_sdk.env import Environment
-from docido_sdk.index import IndexAPIConfigurationProvider
+from docido_sdk.index import (
+    IndexAPI,
+    IndexAPIConfigurationProvider,
+    IndexAPIError,
+)
 from docido_sdk.index.pipeline import IndexPipelineProvider
 import docido_sdk.config as docido_config
 
 from docido_sdk.toolbox.collections_ext import Configuration
 from docido_sdk.index.processor import Elasticsearch
+from docido_sdk.index.processor.es_api import (
+    ElasticsearchProcessor,
+    get_es_client,
+)
 
 
 class TestEsAPI(unittest.TestCase):
@@ -60,7 +73,8 @@ class TestEsAPI(unittest.TestCase):
                     'docido_user_id': docido_user_id,
                     'account_login': account_login,
                     'elasticsearch': {
-                        'routing': 'id'
+                        'routing': 'id',
+                        'scroll_size': 2,
                     }
                 }
 
@@ -68,6 +82,56 @@ class TestEsAPI(unittest.TestCase):
             DumbIndexAPIConfiguration
         ]
 
+    def test_refresh_policy(self):
+        policy = ElasticsearchProcessor._refresh_policy
+        self.assertEqual(policy(True), 'true')
+        self.assertEqual(policy(False), 'none')
+        self.assertEqual(policy(None), 'none')
+        self.assertEqual(policy('wait_for'), 'wait_for')
+        self.assertEqual(policy('crawl_terminated'), 'crawl_terminated')
+        with self.assertRaises(Exception):
+            policy('sometimes')
+
+    def test_bulk_chunks(self):
+        errors = []
+        docs = [dict(id=str(i), data='x' * i * 10) for i in range(6)]
+        lines = list(ElasticsearchProcessor._iter_bulk_lines(
+            docs[:3] + [dict(data='no id')] + docs[3:],
+            ElasticsearchProcessor._bulk_header('index', 'item'),
+            JSONSerializer(), errors
+        ))
+        self.assertEqual(errors, [dict(data='no id')])
+        self.assertEqual(
+            json.loads(lines[0][1]),
+            {'index': {'_index': 'index', '_type': 'item', '_id': '0'}}
+        )
+        chunks = list(ElasticsearchProcessor._bulk_chunks(lines, 2, 1 << 20))
+        self.assertEqual([len(c) for c in chunks], [2, 2, 2])
+        self.assertEqual(len(chunks[0][0][0]), 2)
+        chunks = list(ElasticsearchProcessor._bulk_chunks(lines, 10, 200))
+        self.assertEqual([[d['id'] for _, d in c] for c in chunks],
+                         [['0', '1'], ['2'], ['3'], ['4'], ['5']])
+
+    def test_push_several_chunks(self):
+        with self.index() as index:
+            try:
+                cards = [dict(id=str(i)) for i in range(1200)]
+                cards.insert(600, [])
+                errors = index.push_cards(cards)
+                self.assertEqual(len(errors), 1)
+                query = {'query': {'match_all': {}}}
+                self.assertEqual(len(list(index.search_cards(query))), 1200)
+            finally:
+                index.delete_cards({'query': {'match_all': {}}})
+
+    def test_shared_clients(self):
+        client = get_es_client('localhost:9200', timeout=5)
+        self.assertIs(client, get_es_client('localhost:9200', timeout=5))
+        self.assertIsNot(client, get_es_client('localhost:9200', timeout=6))
+        self.assertIsNot(client, get_es_client('localhost:9201', timeout=5))
+        pool = client.transport.get_connection().pool
+        self.assertEqual(pool.pool.maxsize, 25)
+
     def test_ping(self):
         with self.index() as index:
             index.ping()
@@ -121,6 +185,19 @@ class TestEsAPI(unittest.TestCase):
             finally:
                 index.delete_cards({'query': {'match_all': {}}})
 
+    def test_search_several_pages(self):
+        with self.index() as index:
+            try:
+                cards = [dict(id=str(i)) for i in range(7)]
+                self.assertEqual(index.push_cards(cards), [])
+                query = {'query': {'match_all': {}}, 'sort': ['id']}
+                self.assertEqual(list(index.search_cards(query)), cards)
+                cards_gen = index.search_cards({'query': {'match_all': {}}})
+                self.assertIn(next(cards_gen), cards)
+                cards_gen.close()
+            finally:
+                index.delete_cards({'query': {'match_all': {}}})
+
     def test_push_and_get_card(self):
         with self.index() as index:
             index.push_cards([self.TEST_DOC])
@@ -134,6 +211,24 @@ class TestEsAPI(unittest.TestCase):
             index.push_thumbnails([self.TEST_THUMB])
             index.delete_thumbnails({'query': {'match_all': {}}})
 
+    def test_delete_thumbnails_keeps_cards(self):
+        with self.index() as index:
+            try:
+                card = {'id': self.TEST_THUMB[0]}
+                index.push_cards([card])
+                index.push_thumbnails([self.TEST_THUMB])
+                index.delete_thumbnails({'query': {'match_all': {}}})
+                self.assertEqual(
+                    index.delete_thumbnails_by_id([self.TEST_THUMB[0]]),
+                    [{'status': 404, 'id': self.TEST_THUMB[0]}]
+                )
+                self.assertEqual(
+                    list(index.search_cards({'query': {'match_all': {}}})),
+                    [card]
+                )
+            finally:
+                index.delete_cards({'query': {'match_all': {}}})
+
     def test_push_and_delete_thumbnails_by_id(self):
         with self.index() as index:
             index.push_thumbnails([self.TEST_THUMB])
@@ -146,3 +241,193 @@ class TestEsAPI(unittest.TestCase):
             self.assertListEqual(delete_result, [
                 {'status': 404, 'id': 'aFakeId'}
             ])
+
+
+class TestEsBulkRetry(unittest.TestCase):
+    ES_HOST = 'localhost:9299'
+
+    def _bulk(self, statuses):
+        requests = []
+
+        def bulk(body, **kwargs):
+            lines = body.splitlines()
+            ids = [json.loads(l).values()[0]['_id'] for l in lines[::2]]
+            requests.append(ids)
+            status = statuses.pop(0) if any(statuses) else {}
+            items = [
+                dict(index=dict(_id=_id, status=status.get(_id, 201)))
+                for _id in ids
+            ]
+            return dict(errors=any(status), items=items)
+        return requests, bulk
+
+    def test_resubmit_rejected_items(self):
+        config = Configuration(dict(
+            elasticsearch=dict(
+                ES_HOST=self.ES_HOST,
+                ES_INDEX='index',
+                ES_STORE_INDEX='store',
+                ES_CARD_TYPE='item',
+                ES_STORE_TYPE='thumbnail',
+            ),
+            ha_retry=dict(elasticsearch_bulk=dict(
+                delay=0,
+                max_retries=2,
+                delay_policy='truncated_exponential_backoff',
+                delay_config=dict(max_collisions=5),
+            )),
+        ))
+        with docido_config:
+            docido_config.clear()
+            docido_config.update(config)
+            index = ElasticsearchProcessor(
+                parent=IndexAPI(), service='test',
+                elasticsearch=dict(refresh='none')
+            )
+            requests, bulk = self._bulk([
+                {'b': 429, 'c': 400},
+                {'b': 503},
+            ])
+            client = get_es_client(self.ES_HOST)
+            client.bulk = bulk
+            try:
+                errors = index.push_cards([
+                    dict(id='a'), dict(id='b'), dict(id='c')
+                ])
+            finally:
+                del client.bulk
+        self.assertEqual(requests, [['a', 'b', 'c'], ['b'], ['b']])
+        self.assertEqual([(e['id'], e['status']) for e in errors],
+                         [('c', 400)])
+        self.assertEqual(index.bulk_stats.retries, 2)
+        self.assertEqual(index.bulk_stats.retried_items, 2)
+
+
+class TestEsRefreshPolicy(unittest.TestCase):
+    ES_HOST = 'localhost:9296'
+
+    def crawl(self, refresh):
+        """Push cards and thumbnails with a mocked client
+
+        :return: tuple `(bulk_refresh, refreshed)` where `bulk_refresh`
+          is the list of `refresh` parameters given to bulk requests,
+          and `refreshed` gives for `push`, `task_terminated` and
+          `crawl_terminated` the indices refreshed by `indices.refresh`
+        """
+        config = Configuration(dict(elasticsearch=dict(
+            ES_HOST=self.ES_HOST,
+            ES_INDEX='index',
+            ES_STORE_INDEX='store',
+            ES_CARD_TYPE='item',
+            ES_STORE_TYPE='thumbnail',
+        )))
+        bulk_refresh = []
+
+        def bulk(body, **kwargs):
+            bulk_refresh.append(kwargs.get('refresh'))
+            lines = body.splitlines()
+            ids = [json.loads(l).values()[0]['_id'] for l in lines[::2]]
+            return dict(errors=False, items=[
+                dict(index=dict(_id=_id, status=201)) for _id in ids
+            ])
+        with docido_config:
+            docido_config.clear()
+            docido_config.update(config)
+            index = ElasticsearchProcessor(
+                parent=IndexAPI(), service='test',
+                elasticsearch=dict(refresh=refresh)
+            )
+            client = get_es_client(self.ES_HOST)
+            refreshed = dict()
+            with mock.patch.object(client, 'bulk', bulk), \
+                    mock.patch.object(client.indices, 'refresh') as refresh:
+                index.push_cards([dict(id='a'), dict(id='b')])
+                index.push_cards([dict(id='c')])
+                index.push_thumbnails([('t', '\x13', 'png')])
+                for step in ['push', 'task_terminated', 'crawl_terminated']:
+                    if step != 'push':
+                        getattr(index, step)()
+                    refreshed[step] = sorted(
+                        call[1]['index'] for call in refresh.call_args_list
+                    )
+                    refresh.reset_mock()
+        return bulk_refresh, refreshed
+
+    def test_refresh_policies(self):
+        never = dict(push=[], task_terminated=[], crawl_terminated=[])
+        self.assertEqual(self.crawl(True), ([True] * 3, never))
+        self.assertEqual(self.crawl('none'), ([None] * 3, never))
+        self.assertEqual(self.crawl('wait_for'), (['wait_for'] * 3, never))
+        self.assertEqual(self.crawl('task_terminated'), ([None] * 3, dict(
+            push=[], task_terminated=['index', 'store'], crawl_terminated=[]
+        )))
+        self.assertEqual(self.crawl('crawl_terminated'), ([None] * 3, dict(
+            push=[], task_terminated=[], crawl_terminated=['index', 'store']
+        )))
+
+
+class TestEsDeleteByQuery(unittest.TestCase):
+    ES_HOST = 'localhost:9295'
+
+    def delete_cards(self, statuses):
+        """Delete cards by query with a mocked transport, answering
+        the task status requests with the given `statuses`
+
+        :return: list of requests `(method, path, params)`
+        """
+        config = Configuration(dict(elasticsearch=dict(
+            ES_HOST=self.ES_HOST,
+            ES_INDEX='index',
+            ES_STORE_INDEX='store',
+            ES_CARD_TYPE='item',
+            ES_STORE_TYPE='thumbnail',
+        )))
+        requests = []
+        statuses = list(statuses)
+
+        def perform_request(method, path, params=None, body=None):
+            requests.append((method, path, params))
+            if method == 'POST':
+                return 200, dict(task='node:42')
+            status = statuses.pop(0)
+            if isinstance(status, Exception):
+                raise status
+            return 200, status
+        with docido_config:
+            docido_config.clear()
+            docido_config.update(config)
+            index = ElasticsearchProcessor(
+                parent=IndexAPI(), service='test',
+                elasticsearch=dict(refresh=True, task_poll_interval=0)
+            )
+            client = get_es_client(self.ES_HOST)
+            with mock.patch.object(ElasticsearchProcessor, '_es_version',
+                                   (5, 1)), \
+                    mock.patch.object(client.transport, 'perform_request',
+                                      perform_request):
+                index.delete_cards({'query': {'match_all': {}}})
+        return requests
+
+    def test_poll_task(self):
+        requests = self.delete_cards([
+            dict(completed=False),
+            ConnectionTimeout('TIMEOUT', 'timed out', None),
+            dict(completed=True, response=dict(deleted=3, failures=[])),
+        ])
+        method, path, params = requests[0]
+        self.assertEqual((method, path),
+                         ('POST', '/index/item/_delete_by_query'))
+        self.assertEqual(params['wait_for_completion'], 'false')
+        self.assertEqual(params['refresh'], 'true')
+        self.assertEqual(requests[1:], [('GET', '/_tasks/node:42', None)] * 3)
+
+    def test_failures(self):
+        with self.assertRaises(IndexAPIError) as exc:
+            self.delete_cards([dict(completed=True, response=dict(
+                deleted=1, failures=[dict(id='a', status=409)]
+            ))])
+        self.assertIn('1 documents of index index', str(exc.exception))
+        with self.assertRaises(IndexAPIError):
+            self.delete_cards([dict(completed=True, error=dict(
+                type='search_phase_execution_exception'
+            ))])
@@ -0,0 +1,112 @@
+import datetime
+from decimal import Decimal
+import gzip
+import importlib
+import io
+import unittest
+import uuid
+
+import six
+
+from docido_sdk.index.processor.es_api import get_es_client
+from docido_sdk.index.processor.es_transport import (
+    CompressedConnection,
+    FastJSONSerializer,
+)
+
+
+class RecordPool(object):
+    maxsize = 10
+
+    def __init__(self):
+        self.requests = []
+
+    def urlopen(self, method, url, body=None, headers=None, **kwargs):
+        self.requests.append((body, headers))
+
+
+class TestCompressedConnection(unittest.TestCase):
+    def test_compress_big_bodies(self):
+        connection = CompressedConnection(compress_min_size=100)
+        pool = RecordPool()
+        connection.pool._pool = pool
+        self.assertEqual(connection.pool.maxsize, 10)
+        connection.pool.urlopen('POST', '/_bulk', u'{}\n',
+                                headers=connection.headers)
+        body = u'{"id": "\xe9"}\n' * 100
+        connection.pool.urlopen('POST', '/_bulk', body,
+                                headers=connection.headers)
+        self.assertEqual(pool.requests[0][0], u'{}\n')
+        self.assertNotIn('content-encoding', pool.requests[0][1])
+        compressed, headers = pool.requests[1]
+        self.assertEqual(headers['content-encoding'], 'gzip')
+        self.assertIn('gzip', headers['accept-encoding'])
+        with gzip.GzipFile(fileobj=io.BytesIO(compressed)) as istr:
+            self.assertEqual(istr.read().decode('utf-8'), body)
+        self.assertNotIn('content-encoding', connection.headers)
+
+    def test_client_params(self):
+        client = get_es_client('localhost:9298', http_compress=True,
+                               serializer='json')
+        connection = client.transport.get_connection()
+        self.assertIsInstance(connection, CompressedConnection)
+        self.assertIsInstance(client.transport.serializer, FastJSONSerializer)
+
+
+def installed(module):
+    try:
+        importlib.import_module(module)
+    except ImportError:
+        return False
+    return True
+
+
+class TestFastJSONSerializer(unittest.TestCase):
+    def check_serialize(self, library):
+        serializer = FastJSONSerializer(library)
+        data = dict(
+            id=u'\xe9',
+            date=datetime.date(2016, 1, 2),
+            items=[dict(
+                created=datetime.datetime(2016, 1, 2, 3, 4, 5),
+                price=Decimal('1.5'),
+                uid=uuid.UUID(int=1),
+            )],
+        )
+        serialized = serializer.dumps(data)
+        self.assertIsInstance(serialized, six.text_type)
+        self.assertEqual(
+            serializer.loads(serialized),
+            dict(
+                id=u'\xe9',
+                date='2016-01-02',
+                items=[dict(
+                    created='2016-01-02T03:04:05',
+                    price=1.5,
+                    uid='00000000-0000-0000-0000-000000000001',
+                )],
+            )
+        )
+        self.assertEqual(serializer.dumps('{}'), '{}')
+
+    def test_serialize(self):
+        self.check_serialize('auto')
+
+    def test_serialize_json(self):
+        self.check_serialize('json')
+
+    @unittest.skipIf(not installed('ujson'), 'ujson is not installed')
+    def test_serialize_ujson(self):
+        self.check_serialize('ujson')
+
+    @unittest.skipIf(not installed('orjson'), 'orjson is not installed')
+    def test_serialize_orjson(self):
+        self.check_serialize('orjson')
+
+    def test_unknown_library(self):
+        with self.assertRaises(Exception):
+            FastJSONSerializer('nojson')
+
+
+if __name__ == '__main__':
+    unittest.main()
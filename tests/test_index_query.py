@@ -0,0 +1,120 @@
+import unittest
+
+from docido_sdk.index import IndexAPIError
+from docido_sdk.index.query import (
+    FieldIndexes,
+    compile_query,
+    select,
+)
+
+
+CARDS = dict((card['id'], card) for card in [
+    {'id': 'a', 'kind': 'email', 'date': 10, 'title': 'foo',
+     'author': {'name': 'john'}, 'labels': ['x', 'y']},
+    {'id': 'b', 'kind': 'email', 'date': 20, 'title': 'foobar',
+     'author': {'name': 'jane'}},
+    {'id': 'c', 'kind': 'file', 'date': 30, 'title': 'bar',
+     'labels': ['y']},
+    {'id': 'd', 'kind': 'file', 'title': 'baz'},
+])
+
+
+class TestIndexQuery(unittest.TestCase):
+    def search(self, query, indexes=None):
+        evaluated = []
+
+        def document(_id, card):
+            evaluated.append(_id)
+            return card
+        selected = select(CARDS, query, indexes, document=document)
+        ids = sorted(_id for _id, _ in selected)
+        return ids, len(evaluated)
+
+    def assertMatch(self, query, expected):
+        ids, _ = self.search(query)
+        self.assertEqual(ids, expected)
+        indexes = FieldIndexes(['kind', 'date', 'title', 'labels'])
+        for _id, card in CARDS.iteritems():
+            indexes.add(_id, card)
+        ids, _ = self.search(query, indexes)
+        self.assertEqual(ids, expected)
+
+    def test_match_all(self):
+        self.assertMatch(None, ['a', 'b', 'c', 'd'])
+        self.assertMatch({'match_all': {}}, ['a', 'b', 'c', 'd'])
+
+    def test_term(self):
+        self.assertMatch({'term': {'kind': 'file'}}, ['c', 'd'])
+        self.assertMatch({'term': {'kind': {'value': 'email'}}}, ['a', 'b'])
+        self.assertMatch({'term': {'author.name': 'jane'}}, ['b'])
+        self.assertMatch({'term': {'labels': 'y'}}, ['a', 'c'])
+        self.assertMatch({'term': {'_id': 'c'}}, ['c'])
+
+    def test_terms(self):
+        self.assertMatch({'terms': {'title': ['foo', 'bar', 'qux']}},
+                         ['a', 'c'])
+
+    def test_range(self):
+        self.assertMatch({'range': {'date': {'gte': 20}}}, ['b', 'c'])
+        self.assertMatch({'range': {'date': {'gt': 10, 'lte': 20}}}, ['b'])
+        self.assertMatch({'range': {'date': {'lt': 30}}}, ['a', 'b'])
+
+    def test_prefix(self):
+        self.assertMatch({'prefix': {'title': 'foo'}}, ['a', 'b'])
+        self.assertMatch({'prefix': {'title': {'value': 'ba'}}}, ['c', 'd'])
+
+    def test_ids(self):
+        self.assertMatch({'ids': {'values': ['b', 'd', 'z']}}, ['b', 'd'])
+
+    def test_bool(self):
+        self.assertMatch({'bool': {
+            'must': {'term': {'kind': 'email'}},
+            'must_not': [{'term': {'author.name': 'john'}}],
+        }}, ['b'])
+        self.assertMatch({'bool': {
+            'should': [
+                {'term': {'title': 'baz'}},
+                {'range': {'date': {'lt': 15}}},
+            ],
+        }}, ['a', 'd'])
+        self.assertMatch({'bool': {
+            'filter': [{'term': {'kind': 'email'}}],
+            'should': [{'term': {'labels': 'y'}}, {'term': {'title': 'foo'}}],
+            'minimum_should_match': 2,
+        }}, ['a'])
+
+    def test_secondary_indexes(self):
+        indexes = FieldIndexes(['kind', 'date'])
+        for _id, card in CARDS.iteritems():
+            indexes.add(_id, card)
+        self.assertEqual(
+            self.search({'term': {'kind': 'email'}}, indexes), (['a', 'b'], 2)
+        )
+        self.assertEqual(
+            self.search({'bool': {'filter': [
+                {'term': {'kind': 'file'}},
+                {'range': {'date': {'gt': 0}}},
+            ]}}, indexes),
+            (['c'], 1)
+        )
+        # `title` is not indexed
+        self.assertEqual(
+            self.search({'term': {'title': 'foo'}}, indexes), (['a'], 4)
+        )
+        indexes.remove('a', CARDS['a'])
+        self.assertEqual(indexes['kind'].get('email'), set(['b']))
+        self.assertEqual(indexes['date'].range(lt=20), set())
+
+    def test_invalid_queries(self):
+        for query in [
+            {'match': {'title': 'foo'}},
+            {'term': {'kind': 'file'}, 'ids': {'values': []}},
+            {'term': {}},
+            {'terms': {'kind': 'file'}},
+        ]:
+            with self.assertRaises(IndexAPIError):
+                compile_query(query)
+
+
+if __name__ == '__main__':
+    unittest.main()
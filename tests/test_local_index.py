@@ -1,5 +1,8 @@
 from contextlib import contextmanager
+import hashlib
 from itertools import repeat
+import json
+import os
 import os.path as osp
 import shutil
 import tempfile
@@ -11,12 +14,21 @@ from docido_sdk.core import (
     implements,
 )
 from docido_sdk.index import (
+    IndexAPI,
+    IndexAPIError,
     IndexPipelineConfig,
     IndexAPIConfigurationProvider,
 )
 from docido_sdk.index.pipeline import IndexPipelineProvider
-from docido_sdk.index.test import LocalDumbIndex
-from docido_sdk.toolbox.contextlib_ext import unregister_component
+from docido_sdk.index.test import (
+    IndexLog,
+    LocalDumbIndex,
+    LocalDumbIndexProcessor,
+)
+from docido_sdk.toolbox.contextlib_ext import (
+    tempdir,
+    unregister_component,
+)
 
 
 class TestLocalIndex(unittest.TestCase):
@@ -56,6 +68,37 @@ class TestLocalIndex(unittest.TestCase):
             delete_result = index.delete_thumbnails_by_id(['testid'])
             self.assertListEqual(delete_result, [])
 
+    def test_queries(self):
+        cards = [
+            {'id': 'a', 'kind': 'email', 'date': 10, 'title': 'foo'},
+            {'id': 'b', 'kind': 'email', 'date': 20, 'title': 'bar'},
+            {'id': 'c', 'kind': 'file', 'date': 30, 'title': 'baz'},
+        ]
+        with self.index() as index:
+            index.push_cards(cards)
+            index.push_cards([dict(cards[0], kind='file')])
+            self.assertEqual(
+                sorted(c['id'] for c in index.search_cards({
+                    'query': {'term': {'kind': 'file'}},
+                })),
+                ['a', 'c']
+            )
+            self.assertEqual(
+                index.search_cards({
+                    'query': {'range': {'date': {'gt': 15, 'lt': 25}}},
+                    'fields': ['title'],
+                }),
+                [{'title': 'bar'}]
+            )
+            index.delete_cards({'query': {'prefix': {'title': 'ba'}}})
+            self.assertEqual([c['id'] for c in index.search_cards()], ['a'])
+            with self.assertRaises(IndexAPIError):
+                index.delete_cards()
+            index.push_thumbnails([('a', 'data', 'png'), ('b', 'data', 'jpg')])
+            index.delete_thumbnails({'query': {'term': {'mime': 'png'}}})
+            self.assertEqual(index.delete_thumbnails_by_id(['a', 'b']),
+                             [{'status': 404, 'id': 'a'}])
+
     def test_delete_invalid_thumbnail(self):
         with self.index() as index:
             delete_result = index.delete_thumbnails_by_id(['aFakeId'])
@@ -117,5 +160,157 @@ class TestLocalIndex(unittest.TestCase):
         return ForcePipeline, ForceConfig
 
 
+class TestIndexLog(unittest.TestCase):
+    def local_index(self, path, **config):
+        config['path'] = path
+        return LocalDumbIndexProcessor(
+            parent=IndexAPI(), local_storage=dict(documents=config)
+        )
+
+    def test_replay_mutations(self):
+        with tempdir() as path:
+            index = self.local_index(path)
+            index.push_cards([{'id': 'a'}, {'id': 'b'}])
+            index.push_cards([{'id': 'c', 'title': 'foo'}])
+            index.delete_cards_by_id(['b'])
+            index.push_thumbnails([('a', 'data', 'png')])
+            self.assertFalse(osp.exists(osp.join(path, 'cards.yml')))
+            with open(osp.join(path, 'cards.yml.log')) as istr:
+                self.assertEqual(len(istr.readlines()), 3)
+            index = self.local_index(path)
+            self.assertEqual(
+                sorted(index.search_cards(), key=lambda c: c['id']),
+                [{'id': 'a'}, {'id': 'c', 'title': 'foo'}]
+            )
+            self.assertEqual(index.delete_thumbnails_by_id(['a']), [])
+
+    def test_compaction_on_crawl_terminated(self):
+        with tempdir() as path:
+            index = self.local_index(path)
+            index.push_cards([{'id': 'a'}, {'id': 'b'}])
+            index.delete_cards({'query': {'match_all': {}}})
+            index.push_cards([{'id': 'c'}])
+            index.crawl_terminated()
+            self.assertFalse(osp.exists(osp.join(path, 'cards.yml.log')))
+            self.assertEqual(
+                LocalDumbIndexProcessor.load_index(
+                    osp.join(path, 'cards.yml')
+                ),
+                {'c': {'id': 'c'}}
+            )
+            index.push_cards([{'id': 'd'}])
+            index = self.local_index(path)
+            self.assertEqual(
+                sorted(c['id'] for c in index.search_cards()), ['c', 'd']
+            )
+
+    def test_background_compaction(self):
+        with tempdir() as path:
+            log = IndexLog(osp.join(path, 'cards.yml'), max_bytes=50)
+            log.append([['set', [['a', {'id': 'a'}]]]])
+            log.wait()
+            self.assertFalse(osp.exists(log.path))
+            log.append([['set', [['b', {'id': 'b', 'title': 'x' * 50}]]]])
+            log.wait()
+            self.assertTrue(osp.exists(log.path))
+            self.assertFalse(osp.exists(log.log_path))
+            self.assertEqual(sorted(IndexLog(log.path).load()), ['a', 'b'])
+
+    def test_interrupted_compaction(self):
+        with tempdir() as path:
+            log = IndexLog(osp.join(path, 'cards.yml'))
+            log.append([['set', [['a', 1], ['b', 2]]]])
+            log.compact()
+            with open(log.compacting_path, 'w') as ostr:
+                ostr.write('["delete", ["a"]]\n["set", [["c"')
+            log.append([['set', [['d', 4]]]])
+            self.assertEqual(log.load(), {'b': 2, 'd': 4})
+            log.compact()
+            self.assertFalse(osp.exists(log.compacting_path))
+            self.assertEqual(log.load(), {'b': 2, 'd': 4})
+
+    def test_thumbnail_blobs(self):
+        with tempdir() as path:
+            index = self.local_index(path)
+            index.push_thumbnails([
+                ('a', '\x00\xffpng', 'png'),
+                ('b', '\x00\xffpng', 'png'),
+                ('c', '', 'gif'),
+            ])
+            blobs_path = osp.join(path, 'thumbnails')
+            self.assertEqual(
+                sum(len(files) for _, _, files in os.walk(blobs_path)), 2
+            )
+            payload, mime = index.get_thumbnail('b')
+            self.assertEqual((payload[:], mime), ('\x00\xffpng', 'png'))
+            self.assertEqual(index.get_thumbnail('c'), ('', 'gif'))
+            self.assertIsNone(index.get_thumbnail('d'))
+            # index only refers to payload digests
+            with open(osp.join(path, 'thumbnails.yml.log')) as istr:
+                _, thumbnails = json.loads(istr.readline())
+            self.assertEqual(thumbnails[0][1][1], 'png')
+            self.assertEqual(len(thumbnails[0][1][0]), 40)
+            index.delete_thumbnails_by_id(['a', 'c'])
+            index.crawl_terminated()
+            self.assertEqual(
+                sum(len(files) for _, _, files in os.walk(blobs_path)), 1
+            )
+            index = self.local_index(path)
+            self.assertEqual(index.get_thumbnail('b')[0][:], '\x00\xffpng')
+
+    def test_migrate_inline_thumbnails(self):
+        with tempdir() as path:
+            LocalDumbIndexProcessor.persist_index(
+                {'a': ['data', 'png']}, osp.join(path, 'thumbnails.yml')
+            )
+            index = self.local_index(path)
+            payload, mime = index.get_thumbnail('a')
+            self.assertEqual((payload[:], mime), ('data', 'png'))
+            index.crawl_terminated()
+            index = self.local_index(path)
+            self.assertEqual(index.get_thumbnail('a')[0][:], 'data')
+
+    def test_collect_blobs_of_other_instances(self):
+        with tempdir() as path:
+            index = self.local_index(path)
+            other = self.local_index(path)
+            other.push_thumbnails([('a', 'other', 'png')])
+            index.push_thumbnails([('b', 'mine', 'png')])
+            index.crawl_terminated()
+            self.assertEqual(other.get_thumbnail('a')[0][:], 'other')
+            self.assertEqual(index.get_thumbnail('b')[0][:], 'mine')
+
+    def test_missing_thumbnail_blob(self):
+        with tempdir() as path:
+            digest = hashlib.sha1('lost').hexdigest()
+            LocalDumbIndexProcessor.persist_index(
+                {'a': [digest, 'png']}, osp.join(path, 'thumbnails.yml')
+            )
+            self.local_index(path)
+            # digest is not mistaken for an inline payload
+            self.assertFalse(osp.exists(osp.join(path, 'thumbnails')))
+            self.assertEqual(
+                LocalDumbIndexProcessor.load_index(
+                    osp.join(path, 'thumbnails.yml')
+                ),
+                {'a': [digest, 'png']}
+            )
+            self.assertFalse(osp.exists(osp.join(path, 'thumbnails.yml.log')))
+
+    def test_snapshot_storage(self):
+        with tempdir() as path:
+            index = self.local_index(path, storage='snapshot')
+            index.push_cards([{'id': 'a'}])
+            self.assertFalse(osp.exists(osp.join(path, 'cards.yml.log')))
+            self.assertEqual(
+                LocalDumbIndexProcessor.load_index(
+                    osp.join(path, 'cards.yml')
+                ),
+                {'a': {'id': 'a'}}
+            )
+        with self.assertRaises(Exception):
+            self.local_index(path, storage='foo')
+
+
 if __name__ == '__main___':
     unittest.main()
@@ -1,24 +1,33 @@
 from contextlib import contextmanager
 import copy
+import json
 import os.path as osp
 import shutil
 import tempfile
+import time
 import unittest
 
 from docido_sdk.env import Environment
 from docido_sdk.index import (
+    IndexAPI,
     IndexAPIConfigurationProvider,
     IndexAPIError,
     IndexPipelineConfig,
 )
 from docido_sdk.index.pipeline import IndexPipelineProvider
-from docido_sdk.index.test import LocalKV
+from docido_sdk.index.test import (
+    LocalKV,
+    LocalKVProcessor,
+)
 from docido_sdk.core import (
     Component,
     ComponentMeta,
     implements,
 )
-from docido_sdk.toolbox.contextlib_ext import unregister_component
+from docido_sdk.toolbox.contextlib_ext import (
+    tempdir,
+    unregister_component,
+)
 
 
 class TestLocalKV(unittest.TestCase):
@@ -117,5 +126,50 @@ class TestLocalKV(unittest.TestCase):
                 kv.set_kv('key', None)
 
 
+class TestLocalKVWriteBehind(unittest.TestCase):
+    def kv(self, path, **config):
+        config['path'] = path
+        return LocalKVProcessor(parent=IndexAPI(),
+                                local_storage=dict(kv=config))
+
+    def persisted(self, path):
+        kv_path = osp.join(path, 'kv.yaml')
+        if osp.exists(kv_path):
+            with open(kv_path) as istr:
+                return json.load(istr)
+
+    def test_flush_max_changes(self):
+        with tempdir() as path:
+            kv = self.kv(path, write_behind=True, flush_max_changes=3,
+                         flush_interval=None)
+            kv.set_kv('k1', 1)
+            kv.set_kv('k2', 2)
+            self.assertIsNone(self.persisted(path))
+            self.assertEqual(kv.get_kv('k2'), 2)
+            kv.delete_kv('k1')
+            self.assertEqual(self.persisted(path), {'k2': 2})
+            kv.set_kv('k3', 3)
+            kv.task_terminated()
+            self.assertEqual(self.persisted(path), {'k2': 2, 'k3': 3})
+            kv.delete_kvs()
+            kv.crawl_terminated()
+            self.assertEqual(self.persisted(path), {})
+
+    def test_flush_interval(self):
+        with tempdir() as path:
+            kv = self.kv(path, write_behind=True, flush_interval=0.05,
+                         fsync=True)
+            kv.set_kv('k1', 1)
+            self.assertIsNone(self.persisted(path))
+            time.sleep(0.5)
+            self.assertEqual(self.persisted(path), {'k1': 1})
+
+    def test_write_through(self):
+        with tempdir() as path:
+            kv = self.kv(path)
+            kv.set_kv('k1', 1)
+            self.assertEqual(self.persisted(path), {'k1': 1})
+
+
 if __name__ == '__main__':
     unittest.main()
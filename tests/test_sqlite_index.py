@@ -0,0 +1,158 @@
+import unittest
+
+from docido_sdk.index import (
+    IndexAPI,
+    IndexAPIError,
+)
+from docido_sdk.index.sqlite import (
+    SQLiteIndexProcessor,
+    SQLiteKVProcessor,
+)
+from docido_sdk.toolbox.contextlib_ext import tempdir
+
+
+def local_storage(path):
+    return dict(local_storage=dict(
+        documents=dict(path=path),
+        kv=dict(path=path, cache_size=1024),
+    ))
+
+
+class TestSQLiteIndex(unittest.TestCase):
+    def test_push_and_search_cards(self):
+        with tempdir() as path:
+            index = SQLiteIndexProcessor(parent=IndexAPI(),
+                                         **local_storage(path))
+            index.PAGE_SIZE = 2
+            cards = [dict(id=str(i), title='card' + str(i)) for i in range(5)]
+            self.assertEqual(index.push_cards(iter(cards)), [])
+            index.push_cards([dict(id='2', title='updated')])
+            cards[2]['title'] = 'updated'
+            self.assertEqual(
+                sorted(index.search_cards(), key=lambda c: c['id']), cards
+            )
+            # index is persisted
+            index = SQLiteIndexProcessor(parent=IndexAPI(),
+                                         **local_storage(path))
+            self.assertEqual(
+                list(index.search_cards({
+                    'query': {'ids': {'values': ['1', '3', 'unknown']}},
+                    'fields': ['title'],
+                })),
+                [dict(title='card1'), dict(title='card3')]
+            )
+
+    def test_search_while_pushing_cards(self):
+        with tempdir() as path:
+            index = SQLiteIndexProcessor(**local_storage(path))
+            index.PAGE_SIZE = 2
+            index.push_cards([dict(id=str(i), version=0) for i in range(5)])
+            seen = []
+            for card in index.search_cards():
+                seen.append(card['id'])
+                card['version'] += 1
+                index.push_cards([card])
+            self.assertEqual(seen, ['0', '1', '2', '3', '4'])
+            self.assertEqual(
+                [c['version'] for c in index.search_cards()], [1] * 5
+            )
+
+    def test_card_identifiers(self):
+        with tempdir() as path:
+            index = SQLiteIndexProcessor(**local_storage(path))
+            index.push_cards([dict(id=1, title='int')])
+            query = {'query': {'ids': {'values': ['1']}}}
+            self.assertEqual(list(index.search_cards(query)),
+                             [dict(id=1, title='int')])
+            index.push_cards([dict(id='1', title='str')])
+            self.assertEqual(list(index.search_cards()),
+                             [dict(id='1', title='str')])
+            self.assertEqual(index.delete_cards_by_id([1]), [])
+            self.assertEqual(list(index.search_cards()), [])
+
+    def test_invalid_cards(self):
+        with tempdir() as path:
+            index = SQLiteIndexProcessor(**local_storage(path))
+            errors = index.push_cards([dict(id=1), dict(title='no id'),
+                                       dict(id=2)])
+            self.assertEqual(errors, [{'status': 400, 'id': None,
+                                       'error': "missing 'id' field"}])
+            self.assertEqual(list(index.search_cards()),
+                             [dict(id=1), dict(id=2)])
+
+    def test_search_errors(self):
+        with tempdir() as path:
+            index = SQLiteIndexProcessor(**local_storage(path))
+            index.push_cards([dict(id=1)])
+            cards = index.search_cards()
+            index._SQLiteIndexProcessor__db.close()
+            with self.assertRaises(IndexAPIError):
+                list(cards)
+
+    def test_delete_cards(self):
+        with tempdir() as path:
+            index = SQLiteIndexProcessor(**local_storage(path))
+            index.push_cards([dict(id=i) for i in range(4)])
+            self.assertEqual(index.delete_cards_by_id([0, 42]),
+                             [{'status': 404, 'id': 42}])
+            index.delete_cards({'query': {'ids': {'values': [1]}}})
+            self.assertEqual(list(index.search_cards()),
+                             [dict(id=2), dict(id=3)])
+            with self.assertRaises(IndexAPIError):
+                index.delete_cards({'query': {'term': {'id': 2}}})
+            with self.assertRaises(IndexAPIError):
+                index.delete_cards()
+            self.assertEqual(len(list(index.search_cards())), 2)
+            index.delete_cards({'query': {'match_all': {}}})
+            self.assertEqual(list(index.search_cards()), [])
+
+    def test_thumbnails(self):
+        with tempdir() as path:
+            index = SQLiteIndexProcessor(**local_storage(path))
+            index.push_thumbnails([('a', '\x00\xff', 'png'),
+                                   ('b', 'data', 'jpg')])
+            self.assertEqual(index.get_thumbnail('a'), ('\x00\xff', 'png'))
+            self.assertEqual(index.delete_thumbnails_by_id(['a', 'c']),
+                             [{'status': 404, 'id': 'c'}])
+            self.assertIsNone(index.get_thumbnail('a'))
+            index.delete_thumbnails({'query': {'match_all': {}}})
+            self.assertIsNone(index.get_thumbnail('b'))
+
+
+class TestSQLiteKV(unittest.TestCase):
+    def test_kv(self):
+        with tempdir() as path:
+            kv = SQLiteKVProcessor(**local_storage(path))
+            kv.set_kv('k1', '\xff')
+            kv.set_kv('k2', u'unicode')
+            kv.set_kv('k3', 42)
+            kv.set_kv('k4', long(42))
+            kv.set_kv('k5', 3.14)
+            kv.set_kv('k5', 2.71)
+            kv = SQLiteKVProcessor(**local_storage(path))
+            kvs = kv.get_kvs()
+            self.assertEqual(kvs, {
+                'k1': '\xff', 'k2': u'unicode', 'k3': 42, 'k4': 42,
+                'k5': 2.71,
+            })
+            self.assertEqual(
+                [type(kvs[k]) for k in ['k1', 'k2', 'k3', 'k4', 'k5']],
+                [str, unicode, int, long, float]
+            )
+            kv.delete_kv('k1')
+            self.assertIsNone(kv.get_kv('k1'))
+            self.assertEqual(kv.get_kv('k3'), 42)
+            kv.delete_kvs()
+            self.assertEqual(kv.get_kvs(), {})
+
+    def test_invalid_arguments(self):
+        with tempdir() as path:
+            kv = SQLiteKVProcessor(**local_storage(path))
+            with self.assertRaises(IndexAPIError):
+                kv.get_kv(None)
+            with self.assertRaises(IndexAPIError):
+                kv.set_kv('key', None)
+
+
+if __name__ == '__main__':
+    unittest.main()
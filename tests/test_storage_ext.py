@@ -0,0 +1,70 @@
+import os.path as osp
+import unittest
+
+from docido_sdk.index import IndexAPI
+from docido_sdk.toolbox.contextlib_ext import tempdir
+from docido_sdk.toolbox.storage_ext import (
+    JSONLinesFile,
+    PrefixedKV,
+)
+
+
+class RamKVIndex(IndexAPI):
+    def __init__(self):
+        self.kvs = dict()
+
+    def get_kvs(self):
+        return self.kvs.items()
+
+    def set_kv(self, key, value):
+        self.kvs[key] = value
+
+    def delete_kv(self, key):
+        self.kvs.pop(key, None)
+
+
+class TestJSONLinesFile(unittest.TestCase):
+    def test_append_and_read(self):
+        for keep_open in [False, True]:
+            with tempdir() as path:
+                path = osp.join(path, 'entries')
+                jsonl = JSONLinesFile(path, fsync=True, keep_open=keep_open)
+                self.assertEqual(list(jsonl), [])
+                self.assertEqual(jsonl.append([]), 0)
+                self.assertEqual(jsonl.append([['a', 1], ['b', None]]), 21)
+                jsonl.flush()
+                self.assertEqual(list(jsonl), [['a', 1], ['b', None]])
+                jsonl.close()
+                jsonl.append([{'c': 2}])
+                jsonl.close()
+                self.assertEqual(list(JSONLinesFile(path)),
+                                 [['a', 1], ['b', None], {'c': 2}])
+                jsonl.remove()
+                self.assertFalse(osp.exists(path))
+
+    def test_truncated_line(self):
+        with tempdir() as path:
+            path = osp.join(path, 'entries')
+            with open(path, 'w') as ostr:
+                ostr.write('["a", 1]\n["b", ')
+            self.assertEqual(list(JSONLinesFile(path)), [['a', 1]])
+
+
+class TestPrefixedKV(unittest.TestCase):
+    def test_prefixed_keys(self):
+        index = RamKVIndex()
+        index.set_kv('other', 0)
+        kv = PrefixedKV(index, 'prefix')
+        kv.set('a', 1)
+        kv.set('b', 2)
+        self.assertEqual(index.kvs, {'other': 0, 'prefix:a': 1,
+                                     'prefix:b': 2})
+        kv.delete('a')
+        self.assertEqual(kv.load(), {'b': 2})
+        kv.clear()
+        self.assertEqual(kv.load(), {})
+        self.assertEqual(index.kvs, {'other': 0})
+
+
+if __name__ == '__main__':
+    unittest.main()